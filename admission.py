@@ -0,0 +1,262 @@
+import os
+import math
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from functools import wraps
+from flask import current_app, request, session, g, jsonify
+from flask_login import current_user
+from metrics import is_alive
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    id TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    client TEXT NOT NULL,
+    admin INTEGER NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    host TEXT NOT NULL DEFAULT '',
+    pid INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS leases_tool ON leases (tool, expires);
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class AdmissionRefused(Exception):
+    """Raised when a tool can't take more work from a client right now."""
+
+    def __init__(self, tool, reason, retry_after):
+        super().__init__(f"Too many {tool} requests ({reason}), try again in {math.ceil(retry_after)}s")
+        self.tool = tool
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Lease:
+    """One admitted unit of work; holds a concurrency slot until released."""
+
+    def __init__(self, controller, lease_id):
+        self.controller = controller
+        self.id = lease_id
+        self.handed_off = False
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.id)
+
+
+class AdmissionController:
+    """Global and per-client limits on the CPU-heavy tools.
+
+    For each tool, ``limits`` sets how many requests may be in the system
+    at once (queued or running) in total (``queue``) and per IP address and
+    per browser session, and a per-client rate (``per_minute`` with bursts
+    of ``burst``). Logged-in admins skip the per-client limits and may use
+    ``admin_reserve`` slots that are kept free of everyone else's work.
+
+    State lives in a small SQLite database, updated in short exclusive
+    transactions, so every worker process on the host enforces the same
+    limits. Each lease records the process holding it; leases of processes
+    that died (crashed, OOM-killed) are reaped before every admission, and
+    any lease still expires after ``lease_ttl`` as a backstop.
+    """
+
+    def __init__(self, path, limits, job_concurrency):
+        self.path = path
+        self.limits = limits
+        self.job_concurrency = job_concurrency
+        self.host = socket.gethostname()
+        self._local = threading.local()
+
+    def admit(self, tool, ip, client, admin=False):
+        """Take a slot for one request or raise AdmissionRefused."""
+        limits = self.limits[tool]
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            self._reap_dead(db)
+            active = db.execute("SELECT COUNT(*) FROM leases WHERE tool = ?", (tool,)).fetchone()[0]
+            capacity = limits['queue'] if admin else limits['queue'] - limits.get('admin_reserve', 0)
+            if active >= capacity:
+                # Time for the queue ahead to drain to a free slot
+                running = self.job_concurrency.get(tool, 1)
+                waves = (active - capacity) // running + 1
+                raise AdmissionRefused(tool, 'server busy', waves * limits['seconds'])
+
+            if not admin:
+                for column, value, limit in (('ip', ip, limits['per_ip']), ('client', client, limits['per_session'])):
+                    count, oldest = db.execute(
+                        f"SELECT COUNT(*), MIN(created) FROM leases WHERE tool = ? AND {column} = ?",
+                        (tool, value)
+                    ).fetchone()
+                    if count >= limit:
+                        retry_after = max(1, limits['seconds'] - (now - (oldest or now)))
+                        raise AdmissionRefused(tool, 'too many at once', retry_after)
+                retry_after = self._take_token(db, f"{tool}:{ip}", limits, now)
+                if retry_after:
+                    raise AdmissionRefused(tool, 'rate limited', retry_after)
+
+            lease_id = str(uuid.uuid4())
+            db.execute(
+                "INSERT INTO leases (id, tool, ip, client, admin, created, expires, host, pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (lease_id, tool, ip, client, int(admin), now, now + limits.get('lease_ttl', 3600), self.host, os.getpid())
+            )
+        return Lease(self, lease_id)
+
+    def release(self, lease_id):
+        with self._transaction() as db:
+            db.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    def stats(self):
+        """Work in the system per tool, with the share taken by admins."""
+        now = time.time()
+        with self._transaction() as db:
+            self._reap_dead(db)
+            rows = db.execute(
+                "SELECT tool, COUNT(*), SUM(admin) FROM leases WHERE expires >= ? GROUP BY tool", (now,)
+            ).fetchall()
+        active = {tool: {'active': count, 'admin': admins} for tool, count, admins in rows}
+        return {
+            tool: dict(active.get(tool, {'active': 0, 'admin': 0}), queue=limits['queue'])
+            for tool, limits in self.limits.items()
+        }
+
+    def _reap_dead(self, db):
+        """Drop the leases of this host's processes that no longer exist."""
+        pids = [pid for (pid,) in db.execute("SELECT DISTINCT pid FROM leases WHERE host = ?", (self.host,))]
+        dead = [(self.host, pid) for pid in pids if not is_alive(pid)]
+        if dead:
+            db.executemany("DELETE FROM leases WHERE host = ? AND pid = ?", dead)
+            logger.warning("Released the admission leases of %s exited processes", len(dead))
+
+    def _take_token(self, db, key, limits, now):
+        rate = limits['per_minute'] / 60.0
+        row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = limits['burst'] if row is None else min(limits['burst'], row[0] + (now - row[1]) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        db.execute(
+            "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+            (key, tokens - 1, now)
+        )
+        return 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(leases)")}
+            for column, ddl in (('host', "TEXT NOT NULL DEFAULT ''"), ('pid', 'INTEGER NOT NULL DEFAULT 0')):
+                if column not in columns:  # Databases created before leases recorded their owner
+                    try:
+                        connection.execute(f"ALTER TABLE leases ADD COLUMN {column} {ddl}")
+                    except sqlite3.OperationalError:
+                        pass  # Added by another process meanwhile
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so the check and the
+    # insert of an admission can't interleave with another process's
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def client_identity():
+    """IP address and a per-session id of the requesting client."""
+    if 'client_id' not in session:
+        session['client_id'] = str(uuid.uuid4())
+    return request.remote_addr or 'unknown', session['client_id']
+
+
+def too_many_requests_response(error):
+    """429 response telling the client when to retry."""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+def admission_controlled(tool, methods=('POST',)):
+    """Admit requests to a tool view (POSTs by default) through the admission controller.
+
+    The lease is released when the view returns, unless a background job
+    took it over (see ``take_lease``), in which case it is released when
+    the job finishes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in methods:
+                return view(*args, **kwargs)
+            ip, client = client_identity()
+            admin = current_user.is_authenticated and current_user.is_admin
+            try:
+                lease = get_admission_controller().admit(tool, ip, client, admin=admin)
+            except AdmissionRefused as e:
+                logger.info("Refused %s request from %s: %s", tool, ip, e.reason)
+                return too_many_requests_response(e)
+            g.admission_lease = lease
+            try:
+                return view(*args, **kwargs)
+            finally:
+                g.admission_lease = None
+                if not lease.handed_off:
+                    lease.release()
+        return wrapper
+    return decorator
+
+
+def take_lease():
+    """Take over the current request's admission lease, if any, to release it later."""
+    lease = g.get('admission_lease')
+    if lease is not None:
+        lease.handed_off = True
+    return lease
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Return the process-wide admission controller, configured from the current app."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                path=current_app.config['ADMISSION_DB'],
+                limits=current_app.config['ADMISSION_LIMITS'],
+                job_concurrency=current_app.config['JOB_CONCURRENCY']
+            )
+        return _controller
@@ -0,0 +1,162 @@
+import re
+import math
+import time
+import threading
+from collections import Counter, OrderedDict
+import metrics
+
+# Words too common in questions to say anything about the topic
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'can', 'do', 'does', 'for', 'how', 'i', 'in', 'is', 'it', 'me', 'my',
+    'of', 'on', 'or', 'should', 'the', 'to', 'what', 'whats', 'which', 'with', 'you', 'your'
+}
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace, so trivial variations match."""
+    return ' '.join(re.sub(r"[^\w\s]", ' ', question.lower().replace("'", '')).split())
+
+
+def question_terms(normalized):
+    """Words and adjacent word pairs of a normalized question, stop words left out."""
+    words = [word for word in normalized.split() if word not in STOP_WORDS]
+    return Counter(words + [f"{first} {second}" for first, second in zip(words, words[1:])])
+
+
+class AnswerCache:
+    """Answers to previously asked questions, matched exactly or by similarity.
+
+    A question first looks for an entry with the same normalized text,
+    then for the most similar cached question by TF-IDF cosine similarity
+    over words and word pairs, accepted at ``similarity`` or above. Entries
+    expire after ``ttl`` seconds and the least recently used are evicted
+    past ``max_entries``.
+
+    Identical questions arriving while the first is still being answered
+    can wait for that answer instead of asking the model again: ``claim``
+    makes the first caller responsible for answering and hands everyone
+    else an event to ``wait`` on.
+    """
+
+    def __init__(self, max_entries, ttl, similarity):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # normalized question -> entry
+        self._document_frequency = Counter()
+        self._in_flight = {}  # normalized question -> threading.Event
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, question):
+        """Cached answer for a question, or None (the caller ``claim``s it next)."""
+        with self._lock:
+            answer, kind = self._find(normalize_question(question))
+            if answer is not None:
+                self._count(kind)
+            return answer
+
+    def claim(self, question):
+        """None if the caller should answer the question, else an event set once another caller did."""
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key]
+            self._in_flight[key] = threading.Event()
+            self._count('miss')
+            return None
+
+    def wait(self, question, event, timeout):
+        """Wait for a claimed question's answer; None if it didn't arrive (the caller answers then)."""
+        event.wait(timeout)
+        with self._lock:
+            answer, _ = self._find(normalize_question(question))
+            self._count('coalesced' if answer is not None else 'miss')
+            return answer
+
+    def put(self, question, answer):
+        key = normalize_question(question)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._document_frequency.subtract(old['terms'].keys())
+            terms = question_terms(key)
+            self._entries[key] = {'answer': answer, 'terms': terms, 'created': time.time()}
+            self._document_frequency.update(terms.keys())
+            self._prune()
+
+    def release(self, question):
+        """End a claim, successful or not, waking the callers waiting on it."""
+        with self._lock:
+            event = self._in_flight.pop(normalize_question(question), None)
+        if event is not None:
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._document_frequency.clear()
+
+    def stats(self):
+        """Entry count, lookups by outcome and the share answered from the cache."""
+        with self._lock:
+            hits = self._counts['exact'] + self._counts['similar'] + self._counts['coalesced']
+            lookups = hits + self._counts['miss']
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'exact_hits': self._counts['exact'],
+                'similar_hits': self._counts['similar'],
+                'coalesced': self._counts['coalesced'],
+                'misses': self._counts['miss'],
+                'hit_rate': hits / lookups if lookups else None
+            }
+
+    def _count(self, kind):
+        self._counts[kind] += 1
+        metrics.inc('cache_lookups_total', cache='chat', result=kind)
+
+    def _find(self, key):
+        self._prune()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry['answer'], 'exact'
+
+        query = self._weights(question_terms(key))
+        best_key, best_score = None, 0.0
+        for candidate, entry in self._entries.items():
+            score = cosine(query, self._weights(entry['terms']))
+            if score > best_score:
+                best_key, best_score = candidate, score
+        if best_key is not None and best_score >= self.similarity:
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key]['answer'], 'similar'
+        return None, 'miss'
+
+    def _weights(self, terms):
+        # Smoothed inverse document frequency over the cached questions
+        total = len(self._entries)
+        return {
+            term: count * (math.log((1 + total) / (1 + self._document_frequency[term])) + 1)
+            for term, count in terms.items()
+        }
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in self._entries.items() if entry['created'] < cutoff]
+        while len(self._entries) - len(expired) > self.max_entries:
+            key = next(key for key in self._entries if key not in expired)
+            expired.append(key)
+        for key in expired:
+            self._document_frequency.subtract(self._entries.pop(key)['terms'].keys())
+        if expired:
+            self._document_frequency += Counter()  # Drops terms no longer counted
+
+
+def cosine(first, second):
+    dot = sum(weight * second.get(term, 0.0) for term, weight in first.items())
+    if not dot:
+        return 0.0
+    norm = math.sqrt(sum(w * w for w in first.values())) * math.sqrt(sum(w * w for w in second.values()))
+    return dot / norm
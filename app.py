@@ -6,9 +6,8 @@ from forms import TrackForm
 import os
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask import send_from_directory, send_file
-import yt_dlp
 import subprocess
 import uuid
 from pathlib import Path
@@ -17,25 +16,38 @@ from threading import Timer
 import time
 import requests as http_requests
 from dotenv import load_dotenv
-from together import Together
-import ssl
 import shutil
 import warnings
-import traceback
-from utils import ensure_directory_exists, save_uploaded_file, cleanup_file, analyze_audio_file, convert_audio
+import logging
+from utils import ensure_directory_exists, save_uploaded_file, cleanup_file, analyze_audio_file, convert_audio, ffmpeg_convert_args, ffmpeg_progress_parser, record_conversion, CODEC_ARGS
 from services import AudioConversionService, StemSeparationService
 from config import config
 from routes import register_blueprints
+from routes.media import has_artwork, schedule_purge
+from storage import BlobStore
+from decorators import admin_required
+from routes.admin import bulk_delete_tracks
+from exports import ZipEntry, ZipStream, manifest_entry, zip_response
+from commands import register_commands
+from schema import upgrade_schema
+import ingest
+from jobs import get_job_runner, progress_reporter, JobQueueFull
+from routes.jobs import queue_full_response
+from outbound import UpstreamUnavailable
+from youtube import get_youtube_pool
+from admission import admission_controlled
+import metrics
+import logs
+import profiling
+import database
 
 warnings.filterwarnings("ignore")
-ssl._create_default_https_context = ssl._create_unverified_context
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Together API client
-client = Together(api_key=os.getenv('TOGETHER_API_KEY'))
-
 # Create Flask app
 app = Flask(__name__)
 
@@ -44,8 +56,19 @@ app_config = config['development']  # Change to 'production' for production
 app.config.from_object(app_config)
 app_config.init_app(app)
 
-# Initialize database
-db.init_app(app)
+# Take client addresses from the trusted reverse proxies' X-Forwarded-* headers
+if app.config['TRUSTED_PROXIES']:
+    proxies = app.config['TRUSTED_PROXIES']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+# Log through a background thread, tagged with request and job ids
+logs.init_app(app)
+
+# Profile requests on demand (after logging, which assigns the request ids)
+profiling.init_app(app)
+
+# Initialize database (pool sizing, SQLite pragmas, read replica)
+database.init_app(app)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -58,34 +81,16 @@ ACTIVE_SESSIONS = {}
 # Register blueprints
 register_blueprints(app)
 
-# Admin required decorator
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated or not current_user.is_admin:
-            flash("Admin access required.", "danger")
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
+# Register CLI commands
+register_commands(app)
+
+# Record request and job metrics
+metrics.init_app(app)
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# YouTube downloader configuration
-YDL_OPTS_BASE = {
-    'format': 'bestaudio/best',
-    'quiet': False,  # Changed to False for debugging
-    'no_warnings': False,  # Changed to False for debugging
-    'extract_audio': True,
-    'postprocessor_args': [
-        '-ar', '44100',
-        '-ac', '2',
-        '-b:a', '192k',
-    ],
-    'prefer_ffmpeg': True,
-}
-
 # Routes
 
 @app.route('/youtube')
@@ -102,38 +107,38 @@ def fetch_video_info():
         if not url:
             return jsonify({'error': 'No URL provided'}), 400
 
-        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            videos = []
-            if 'entries' in info:  # Playlist
-                for entry in info['entries']:
-                    if entry:  # Check if entry is valid
-                        videos.append({
-                            'id': entry.get('id'),
-                            'title': entry.get('title', 'Unknown Title'),
-                            'uploader': entry.get('uploader', 'Unknown Uploader'),
-                            'thumbnail': entry.get('thumbnail', ''),
-                            'duration': entry.get('duration', 0),
-                            'url': f"https://www.youtube.com/watch?v={entry.get('id')}"
-                        })
-            else:  # Single video
-                videos.append({
-                    'id': info.get('id'),
-                    'title': info.get('title', 'Unknown Title'),
-                    'uploader': info.get('uploader', 'Unknown Uploader'),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'duration': info.get('duration', 0),
-                    'url': url
-                })
+        info = get_youtube_pool().extract_info(url)
+        videos = []
+        if 'entries' in info:  # Playlist
+            for entry in info['entries']:
+                if entry:  # Check if entry is valid
+                    videos.append({
+                        'id': entry.get('id'),
+                        'title': entry.get('title', 'Unknown Title'),
+                        'uploader': entry.get('uploader', 'Unknown Uploader'),
+                        'thumbnail': entry.get('thumbnail', ''),
+                        'duration': entry.get('duration', 0),
+                        'url': f"https://www.youtube.com/watch?v={entry.get('id')}"
+                    })
+        else:  # Single video
+            videos.append({
+                'id': info.get('id'),
+                'title': info.get('title', 'Unknown Title'),
+                'uploader': info.get('uploader', 'Unknown Uploader'),
+                'thumbnail': info.get('thumbnail', ''),
+                'duration': info.get('duration', 0),
+                'url': url
+            })
 
         return jsonify({
             'success': True,
             'videos': videos
         })
 
+    except UpstreamUnavailable as e:
+        return queue_full_response(e)
     except Exception as e:
-        print(f"Error fetching video info: {str(e)}")
+        logger.warning("Error fetching video info: %s", e)
         return jsonify({
             'success': False,
             'error': f"Failed to fetch video information: {str(e)}"
@@ -165,13 +170,14 @@ def create_conversion_session():
         })
 
     except Exception as e:
-        print(f"Error creating session: {str(e)}")
+        logger.exception("Error creating session")
         return jsonify({
             'success': False,
             'error': f"Failed to create conversion session: {str(e)}"
         }), 500
 
 @app.route('/youtube/convert', methods=['POST'])
+@admission_controlled('youtube')
 def convert_video():
     """Convert a single video to audio"""
     try:
@@ -179,7 +185,7 @@ def convert_video():
         video_id = request.json.get('videoId')
         output_format = request.json.get('format')
 
-        print(f"Starting conversion for video {video_id} in session {session_id}")
+        logger.info("Starting conversion for video %s in session %s", video_id, session_id)
 
         if not all([session_id, video_id, output_format]):
             return jsonify({
@@ -193,12 +199,17 @@ def convert_video():
                 'error': 'Invalid or expired session'
             }), 400
 
+        if output_format not in CODEC_ARGS:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid format: {output_format}'
+            }), 400
+
         session = ACTIVE_SESSIONS[session_id]
         output_dir = session['directory']
         
         # Ensure output directory exists
         Path(output_dir).mkdir(parents=True, exist_ok=True)
-        print(f"Output directory confirmed: {output_dir}")
 
         # Find video info
         video = next((v for v in session['videos'] if v['id'] == video_id), None)
@@ -212,62 +223,81 @@ def convert_video():
         safe_filename = f"{secure_filename(video['uploader'])} - {secure_filename(video['title'])}"
         output_path = os.path.join(output_dir, safe_filename)
         
-        print(f"Output path: {output_path}")
-
-        # Configure yt-dlp options for this download
-        ydl_opts = {
-            **YDL_OPTS_BASE,
-            'outtmpl': output_path,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': output_format,
-                'preferredquality': '192' if output_format == 'mp3' else '0',
-            }],
-        }
-
-        print(f"Starting download with options: {ydl_opts}")
+        logger.debug("Output path: %s", output_path)
 
-        # Download and convert
+        # Download and convert in the background; the client follows the job
         video_url = f"https://www.youtube.com/watch?v={video_id}"
-        print(f"Downloading from URL: {video_url}")
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            error_code = ydl.download([video_url])
-            if error_code != 0:
-                raise Exception(f"yt-dlp returned error code: {error_code}")
-
-        # Check for the output file with extension
-        expected_output = f"{output_path}.{output_format}"
-        print(f"Looking for output file: {expected_output}")
-
-        if not os.path.exists(expected_output):
-            # List directory contents for debugging
-            print(f"Directory contents of {output_dir}:")
-            print(os.listdir(output_dir))
-            raise Exception(f"Conversion failed - output file not found at {expected_output}")
-
-        # Get the actual filename that was created
         final_filename = f"{safe_filename}.{output_format}"
-        
-        print(f"Conversion successful. Final filename: {final_filename}")
+        download_url = url_for('download_converted', session_id=session_id, filename=final_filename)
+        logger.debug("Queueing download from URL: %s", video_url)
+
+        job = get_job_runner().submit(
+            'youtube', youtube_conversion_job,
+            video_url, output_path, output_format, final_filename, download_url
+        )
+        session.setdefault('jobs', []).append(job.id)
 
         return jsonify({
             'success': True,
-            'downloadUrl': url_for('download_converted', 
-                                 session_id=session_id, 
-                                 filename=final_filename),
-            'filename': final_filename
-        })
+            'jobId': job.id,
+            'statusUrl': url_for('jobs.job_status', job_id=job.id),
+            'eventsUrl': url_for('jobs.job_events', job_id=job.id)
+        }), 202
 
+    except JobQueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
-        print(f"Conversion error: {str(e)}")
-        print("Full traceback:")
-        print(traceback.format_exc())
+        logger.exception("Conversion error")
         return jsonify({
             'success': False,
             'error': f"Conversion failed: {str(e)}"
         }), 500
 
+@profiling.profiled('download')
+def download_youtube_audio(job, video_url, output_path):
+    """Download the best audio stream with yt-dlp (blocking); returns its path and duration."""
+    def report_progress(progress):
+        # yt-dlp calls this between chunks, so a cancelled job stops promptly
+        job.check_cancelled()
+        total = progress.get('total_bytes') or progress.get('total_bytes_estimate')
+        if progress.get('status') == 'downloading' and total:
+            job.progress('download', progress.get('downloaded_bytes', 0) / total * 100)
+
+    logger.debug("Starting download from %s", video_url)
+    source_path, info = get_youtube_pool().download(video_url, f"{output_path}.source", progress=report_progress)
+    return source_path, info.get('duration')
+
+async def youtube_conversion_job(job, video_url, output_path, output_format, final_filename, download_url):
+    """Job body: download on the blocking pool, then transcode with a non-blocking ffmpeg."""
+    runner = get_job_runner()
+    job.progress('download', 0)
+    source_path, duration = await runner.run_blocking(download_youtube_audio, job, video_url, output_path)
+    expected_output = f"{output_path}.{output_format}"
+    try:
+        job.progress('convert', 0)
+        started = time.perf_counter()
+        await runner.run_process(
+            *ffmpeg_convert_args(
+                source_path, expected_output, output_format,
+                extra_args=['-vn', '-ar', '44100', '-ac', '2'], progress=True
+            ),
+            on_line=progress_reporter(job, 'convert', ffmpeg_progress_parser(duration))
+        )
+        record_conversion('youtube', time.perf_counter() - started, source_path, expected_output)
+    except BaseException:
+        if os.path.exists(expected_output):
+            os.remove(expected_output)
+        raise
+    finally:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+    if not os.path.exists(expected_output):
+        raise Exception(f"Conversion failed - output file not found at {expected_output}")
+
+    logger.info("Conversion successful. Final filename: %s", final_filename)
+    return {'downloadUrl': download_url, 'filename': final_filename}
+
 @app.route('/youtube/download/<session_id>/<path:filename>')
 def download_converted(session_id, filename):
     """Download a converted audio file"""
@@ -294,7 +324,7 @@ def download_converted(session_id, filename):
         )
 
     except Exception as e:
-        print(f"Download error: {str(e)}")
+        logger.exception("Download error")
         return jsonify({
             'success': False,
             'error': f"Download failed: {str(e)}"
@@ -304,13 +334,11 @@ def download_converted(session_id, filename):
 def cleanup_expired_sessions():
     """Clean up expired sessions or specific session"""
     try:
-        print("=== YOUTUBE CLEANUP ENDPOINT CALLED ===")
-        
         # Check if a specific session ID was provided
         session_id = request.json.get('sessionId') if request.is_json else request.form.get('sessionId')
         
         if session_id:
-            print(f"Cleaning up specific session: {session_id}")
+            logger.debug("Cleaning up specific session: %s", session_id)
             if session_id in ACTIVE_SESSIONS:
                 cleanup_session(session_id)
                 return jsonify({
@@ -318,7 +346,7 @@ def cleanup_expired_sessions():
                     'message': f'Cleaned up session {session_id}'
                 })
             else:
-                print(f"Session not found: {session_id}")
+                logger.debug("Session not found: %s", session_id)
                 return jsonify({
                     'success': False,
                     'message': f'Session {session_id} not found'
@@ -331,14 +359,14 @@ def cleanup_expired_sessions():
             if current_time - session['created_at'] > app.config['SESSION_TIMEOUT']
         ]
         
-        print(f"Found {len(expired_sessions)} expired sessions to clean up")
+        logger.debug("Found %s expired sessions to clean up", len(expired_sessions))
         for session_id in expired_sessions:
             cleanup_session(session_id)
 
         # Check if we should clean up all sessions (e.g., on application shutdown)
         clean_all = request.json.get('cleanAll') if request.is_json else request.form.get('cleanAll')
         if clean_all == 'true' or clean_all == True:
-            print("Cleaning up all sessions")
+            logger.info("Cleaning up all sessions")
             all_sessions = list(ACTIVE_SESSIONS.keys())
             for session_id in all_sessions:
                 cleanup_session(session_id)
@@ -354,9 +382,7 @@ def cleanup_expired_sessions():
         })
 
     except Exception as e:
-        print(f"Cleanup error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Cleanup error")
         return jsonify({
             'success': False,
             'error': f"Cleanup failed: {str(e)}"
@@ -365,91 +391,57 @@ def cleanup_expired_sessions():
 def cleanup_session(session_id):
     """Clean up session files and data"""
     try:
-        print(f"=== CLEANUP_SESSION CALLED for session {session_id} ===")
+        # Stop downloads and conversions still running for this session
+        session = ACTIVE_SESSIONS.get(session_id)
+        if session and session.get('jobs'):
+            with app.app_context():
+                runner = get_job_runner()
+                for job_id in session['jobs']:
+                    runner.cancel(job_id)
         
         # Clean up session directory in converted folder
         session_dir = os.path.join(app.config['CONVERTED_FOLDER'], session_id)
-        print(f"Checking if session directory exists: {session_dir}")
         if os.path.exists(session_dir):
-            print(f"Removing session directory: {session_dir}")
             shutil.rmtree(session_dir)
-            print(f"Successfully removed session directory: {session_dir}")
+            logger.debug("Removed session directory: %s", session_dir)
         
         # Clean up any files in the YouTube folder
         youtube_dir = app.config['YOUTUBE_FOLDER']
-        print(f"Checking for files in YouTube folder: {youtube_dir}")
         if os.path.exists(youtube_dir):
             for filename in os.listdir(youtube_dir):
                 if session_id in filename:
                     file_path = os.path.join(youtube_dir, filename)
-                    print(f"Removing YouTube file: {file_path}")
                     if os.path.isfile(file_path):
                         os.remove(file_path)
                     elif os.path.isdir(file_path):
                         shutil.rmtree(file_path)
-                    print(f"Successfully removed: {file_path}")
+                    logger.debug("Removed YouTube file: %s", file_path)
         
         # Clean up any files in the uploads folder
         uploads_dir = app.config['UPLOAD_FOLDER']
-        print(f"Checking for files in uploads folder: {uploads_dir}")
         if os.path.exists(uploads_dir):
             for filename in os.listdir(uploads_dir):
                 if session_id in filename:
                     file_path = os.path.join(uploads_dir, filename)
-                    print(f"Removing upload file: {file_path}")
                     if os.path.isfile(file_path):
                         os.remove(file_path)
                     elif os.path.isdir(file_path):
                         shutil.rmtree(file_path)
-                    print(f"Successfully removed: {file_path}")
+                    logger.debug("Removed upload file: %s", file_path)
         
         # Remove session from active sessions
         if session_id in ACTIVE_SESSIONS:
-            print(f"Removing session from ACTIVE_SESSIONS: {session_id}")
             del ACTIVE_SESSIONS[session_id]
-            print(f"Successfully removed session from ACTIVE_SESSIONS")
+            logger.debug("Removed session %s", session_id)
             
-    except Exception as e:
-        print(f"Error cleaning up session {session_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error cleaning up session %s", session_id)
 
 @app.route('/guides')
 def guides():
     latest_track = Track.query.order_by(Track.date_added.desc()).first()
     return render_template('guides.html', latest_track=latest_track)
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    user_message = data.get('message', '')
-    
-    try:
-        response = client.chat.completions.create(
-            model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Your name is Alex. You are a music production expert who helps people learn about music production, DAWs, mixing, and music theory, especially hip hop beatmaking. Try not to repeat yourself too much and be funny sometimes. Make the experience of learning music production and hip hop beats as fun as possible"
-                },
-                {
-                    "role": "user",
-                    "content": user_message
-                }
-            ],
-            temperature=0.7,
-            top_p=0.7,
-            top_k=50,
-            repetition_penalty=1
-        )
-        
-        answer = response.choices[0].message.content
-        return jsonify({"answer": answer})
-        
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return jsonify({"answer": "Sorry, I encountered an error. Please try again."}), 500
-
 @app.route('/')
 def index():
     latest_track = Track.query.order_by(Track.date_added.desc()).first()
@@ -464,20 +456,23 @@ def about():
 def showcase():
     sort_by = request.args.get('sort', 'date_desc')
     
+    # Tracks still being ingested (or that failed validation) stay hidden
+    published = Track.query.filter_by(status='ready')
+
     if sort_by == 'name_asc':
-        tracks = Track.query.order_by(Track.name.asc()).all()
+        tracks = published.order_by(Track.name.asc()).all()
     elif sort_by == 'name_desc':
-        tracks = Track.query.order_by(Track.name.desc()).all()
+        tracks = published.order_by(Track.name.desc()).all()
     elif sort_by == 'date_asc':
-        tracks = Track.query.order_by(Track.date_added.asc()).all()
+        tracks = published.order_by(Track.date_added.asc()).all()
     elif sort_by == 'play_count':
-        tracks = Track.query.order_by(Track.play_count.desc()).all()
+        tracks = published.order_by(Track.play_count.desc()).all()
     elif sort_by == 'like_count':  # New sorting option
-        tracks = Track.query.order_by(Track.like_count.desc()).all()
+        tracks = published.order_by(Track.like_count.desc()).all()
     else:  # date_desc is default
-        tracks = Track.query.order_by(Track.date_added.desc()).all()
+        tracks = published.order_by(Track.date_added.desc()).all()
     
-    latest_track = Track.query.order_by(Track.date_added.desc()).first()
+    latest_track = published.order_by(Track.date_added.desc()).first()
     return render_template('showcase.html', tracks=tracks, sort_by=sort_by, latest_track=latest_track)
 
 @app.route('/admin', methods=['GET', 'POST'])
@@ -512,95 +507,77 @@ def admin_panel():
         action = request.form.get('action')
 
         if action == 'add' and form.validate_on_submit():
-            # Get the track name and create a safe filename
-            track_name = form.name.data
-            safe_name = secure_filename(track_name)
-            
+            store = BlobStore(app.config['UPLOAD_FOLDER'])
             new_track = Track(
-                name=track_name,
-                description=form.description.data or ""
+                name=form.name.data,
+                description=form.description.data or "",
+                status='processing'
             )
 
             # Handle audio file
             if 'file' in request.files and request.files['file']:
-                music_file = request.files['file']
-                file_ext = os.path.splitext(music_file.filename)[1]
-                music_filename = safe_name + file_ext
-                music_file.save(os.path.join(app.config['UPLOAD_FOLDER'], music_filename))
-                new_track.file = music_filename
+                new_track.file = store.put(request.files['file'])
 
             # Handle primary artwork
             if 'artwork' in request.files and request.files['artwork']:
-                artwork = request.files['artwork']
-                art_ext = os.path.splitext(artwork.filename)[1]
-                artwork_filename = safe_name + "_artwork" + art_ext
-                artwork.save(os.path.join(app.config['UPLOAD_FOLDER'], artwork_filename))
-                new_track.artwork = artwork_filename
+                new_track.artwork = store.put(request.files['artwork'])
             else:
                 new_track.artwork = "No Artwork"
 
             # Handle secondary artwork
             if 'artwork_secondary' in request.files and request.files['artwork_secondary']:
-                secondary = request.files['artwork_secondary']
-                sec_ext = os.path.splitext(secondary.filename)[1]
-                secondary_filename = safe_name + "_secondary" + sec_ext
-                secondary.save(os.path.join(app.config['UPLOAD_FOLDER'], secondary_filename))
-                new_track.artwork_secondary = secondary_filename
+                new_track.artwork_secondary = store.put(request.files['artwork_secondary'])
             else:
                 new_track.artwork_secondary = "No Secondary Artwork"
 
             db.session.add(new_track)
             db.session.commit()
-            flash('New track added successfully!', 'success')
+
+            # Validate, transcode, analyze and thumbnail in the background
+            ingest.enqueue(new_track.id)
+            flash('New track uploaded; it will appear once processing finishes.', 'success')
 
         elif action == 'update':
             track_id = request.form.get('track_id')
             track = Track.query.get_or_404(track_id)
             
             if track:
-                track_name = request.form.get('name')
-                safe_name = secure_filename(track_name)
-                
-                track.name = track_name
+                store = BlobStore(app.config['UPLOAD_FOLDER'])
+                orphans = []
+                audio_changed = False
+
+                track.name = request.form.get('name')
                 track.description = request.form.get('description', track.description)
 
                 # Handle audio file update
                 if 'file' in request.files and request.files['file'].filename != '':
-                    music_file = request.files['file']
-                    if track.file:
-                        old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], track.file)
-                        if os.path.exists(old_file_path):
-                            os.remove(old_file_path)
-                    file_ext = os.path.splitext(music_file.filename)[1]
-                    music_filename = safe_name + file_ext
-                    music_file.save(os.path.join(app.config['UPLOAD_FOLDER'], music_filename))
-                    track.file = music_filename
+                    orphans.append(store.release(track.file))
+                    track.file = store.put(request.files['file'])
+                    track.rendition = track.tempo = track.musical_key = track.duration = None
+                    track.loudness = track.true_peak = track.replay_gain = None
+                    audio_changed = True
 
                 # Handle primary artwork update
                 if 'artwork' in request.files and request.files['artwork'].filename != '':
-                    artwork = request.files['artwork']
-                    if track.artwork and track.artwork != "No Artwork":
-                        old_artwork_path = os.path.join(app.config['UPLOAD_FOLDER'], track.artwork)
-                        if os.path.exists(old_artwork_path):
-                            os.remove(old_artwork_path)
-                    art_ext = os.path.splitext(artwork.filename)[1]
-                    artwork_filename = safe_name + "_artwork" + art_ext
-                    artwork.save(os.path.join(app.config['UPLOAD_FOLDER'], artwork_filename))
-                    track.artwork = artwork_filename
+                    if has_artwork(track.artwork):
+                        orphans.append(store.release(track.artwork))
+                    track.artwork = store.put(request.files['artwork'])
 
                 # Handle secondary artwork update
                 if 'artwork_secondary' in request.files and request.files['artwork_secondary'].filename != '':
-                    secondary = request.files['artwork_secondary']
-                    if track.artwork_secondary and track.artwork_secondary != "No Secondary Artwork":
-                        old_secondary_path = os.path.join(app.config['UPLOAD_FOLDER'], track.artwork_secondary)
-                        if os.path.exists(old_secondary_path):
-                            os.remove(old_secondary_path)
-                    sec_ext = os.path.splitext(secondary.filename)[1]
-                    secondary_filename = safe_name + "_secondary" + sec_ext
-                    secondary.save(os.path.join(app.config['UPLOAD_FOLDER'], secondary_filename))
-                    track.artwork_secondary = secondary_filename
+                    if has_artwork(track.artwork_secondary):
+                        orphans.append(store.release(track.artwork_secondary))
+                    track.artwork_secondary = store.put(request.files['artwork_secondary'])
 
                 db.session.commit()
+                schedule_purge(orphans)
+
+                # New audio goes through the whole pipeline again; otherwise
+                # only the artwork thumbnails need rebuilding
+                if audio_changed:
+                    ingest.enqueue(track.id, force=True)
+                else:
+                    ingest.enqueue(track.id, ['thumbnails'])
                 flash('Track updated successfully!', 'success')
 
         return redirect(url_for('admin_panel'))
@@ -642,6 +619,53 @@ def download_tracks():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/download_tracks/export')
+@login_required
+@admin_required
+def export_tracks():
+    """Stream the selected tracks, their artwork and a manifest as one zip."""
+    track_ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+    if not track_ids:
+        return jsonify({'success': False, 'message': 'No tracks selected'}), 400
+
+    tracks = Track.query.filter(Track.id.in_(track_ids)).order_by(Track.id).all()
+    entries = []
+    manifest = {'tracks': []}
+
+    for track in tracks:
+        folder = f"{track.id} - {secure_filename(track.name) or 'track'}"
+        item = {
+            'id': track.id,
+            'name': track.name,
+            'description': track.description,
+            'play_count': track.play_count or 0,
+            'like_count': track.like_count or 0,
+            'unlike_count': track.unlike_count or 0,
+            'date_added': track.date_added.isoformat() if track.date_added else None,
+            'files': {}
+        }
+
+        for column, label in (('file', 'audio'), ('artwork', 'artwork'), ('artwork_secondary', 'artwork_secondary')):
+            filename = getattr(track, column)
+            if column != 'file' and not has_artwork(filename):
+                continue
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename or '')
+            if not filename or not os.path.isfile(file_path):
+                continue
+            arcname = f"{folder}/{label}{os.path.splitext(filename)[1]}"
+            entries.append(ZipEntry(arcname, path=file_path))
+            item['files'][label] = arcname
+
+        manifest['tracks'].append(item)
+
+    if not entries:
+        return jsonify({'success': False, 'message': 'No files available for download'}), 404
+
+    # A stable manifest timestamp keeps the archive byte-identical for resumes
+    newest = max((t.date_added for t in tracks if t.date_added), default=None)
+    entries.insert(0, manifest_entry(manifest, mtime=newest.timestamp() if newest else 0))
+    return zip_response(ZipStream(entries), 'nobz-tracks.zip')
+
 @app.route('/delete_tracks', methods=['POST'])
 @login_required
 @admin_required
@@ -650,24 +674,8 @@ def delete_tracks():
     track_ids = data.get('track_ids', [])
     
     try:
-        for track_id in track_ids:
-            track = Track.query.get_or_404(track_id)
-            
-            # Delete associated files
-            if track.artwork and track.artwork != "No Artwork":
-                artwork_path = os.path.join(app.config['UPLOAD_FOLDER'], track.artwork)
-                if os.path.exists(artwork_path):
-                    os.remove(artwork_path)
-                    
-            if track.file:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], track.file)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-
-            db.session.delete(track)
-        
-        db.session.commit()
-        return jsonify({'success': True, 'message': 'Tracks deleted successfully!'})
+        results = bulk_delete_tracks(track_ids)
+        return jsonify({'success': True, 'message': 'Tracks deleted successfully!', 'results': results})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -701,7 +709,8 @@ def remove_artwork():
 @app.route('/track/like/<int:track_id>', methods=['POST'])
 def like_track(track_id):
     track = Track.query.get_or_404(track_id)
-    track.like_count = track.like_count + 1 if track.like_count else 1
+    # Incremented by the database, so concurrent likes are all counted
+    Track.query.filter_by(id=track_id).update({Track.like_count: db.func.coalesce(Track.like_count, 0) + 1}, synchronize_session=False)
     db.session.commit()
     return jsonify({'success': True, 'like_count': track.like_count})
 
@@ -709,7 +718,7 @@ def like_track(track_id):
 @app.route('/track/unlike/<int:track_id>', methods=['POST'])
 def unlike_track(track_id):
     track = Track.query.get_or_404(track_id)
-    track.unlike_count = track.unlike_count + 1 if track.unlike_count else 1
+    Track.query.filter_by(id=track_id).update({Track.unlike_count: db.func.coalesce(Track.unlike_count, 0) + 1}, synchronize_session=False)
     db.session.commit()
     return jsonify({'success': True, 'unlike_count': track.unlike_count})
 
@@ -735,7 +744,7 @@ def clear_unlikes(track_id):
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
         # Create admin user if it doesn't exist
         admin_user = User.query.filter_by(username=os.getenv('ADMIN_USER')).first()
         if not admin_user:
@@ -0,0 +1,344 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+from config import Config
+from utils import CODEC_ARGS, probe_audio
+from separation import SeparationEngine, SAMPLE_RATE
+from services import SEPARATION_SCRIPT, separation_args
+from benchmarks.fixtures import Fixture
+from benchmarks.measure import percentile
+
+# Detected tempos this close to the truth count as right
+TEMPO_TOLERANCE = 2
+# Seconds an output may be longer or shorter than its input (encoder padding)
+DURATION_TOLERANCE = 0.1
+
+# Tempos and keys of the accuracy fixtures, spread over the tempo range and both modes
+ACCURACY_TRACKS = [(85, 'Am'), (100, 'G'), (120, 'C'), (128, 'F#m'), (140, 'D#'), (174, 'Em')]
+
+
+class Case:
+    """One benchmark: ``run(*args)`` measured in a child process.
+
+    ``prepare`` is an optional context manager factory run in the child
+    around the measurement (see ``measure``); ``check(outcome)`` runs here
+    afterwards to add accuracy figures to the outcome without timing them.
+    """
+
+    def __init__(self, suite, name, run, args=(), prepare=None, check=None, details=None):
+        self.suite = suite
+        self.name = name
+        self.run = run
+        self.args = args
+        self.prepare = prepare
+        self.check = check
+        self.details = details or {}
+
+    @property
+    def id(self):
+        return f"{self.suite}/{self.name}"
+
+
+# Analysis
+
+def analyze(path, bpm, key):
+    from utils import analyze_audio_file
+    result = analyze_audio_file(path)
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    tempo_error = abs(result['tempo'] - bpm)
+    # Half or double the tempo is the most common mistake; count it separately
+    octave_error = min(abs(result['tempo'] * factor - bpm) for factor in (0.5, 1, 2))
+    return {
+        'tempo': result['tempo'],
+        'key': result['key'],
+        'loudness': result['loudness'],
+        'tempo_error': tempo_error,
+        'tempo_correct': tempo_error <= TEMPO_TOLERANCE,
+        'tempo_octave_correct': octave_error <= TEMPO_TOLERANCE,
+        'key_correct': result['key'] == key
+    }
+
+
+def analyze_cases(options):
+    from utils import analyze_audio_file
+    if not options.cold:
+        # JIT-compile librosa's numba functions once, before the runs fork from here
+        analyze_audio_file(Fixture(120, 'C', 5).ensure(options.fixtures))
+
+    fixtures = [Fixture(bpm, key, options.seconds) for bpm, key in ACCURACY_TRACKS]
+    fixtures += [Fixture(120, 'C', seconds) for seconds in options.lengths if seconds != options.seconds]
+    return [
+        Case('analyze', fixture.name, analyze, (fixture.ensure(options.fixtures), fixture.bpm, fixture.key),
+             details=fixture.to_dict())
+        for fixture in fixtures
+    ]
+
+
+# Conversion
+
+def convert(path, output_path, output_format, loudness_target):
+    from utils import convert_audio
+    if not convert_audio(path, output_path, output_format, loudness_target):
+        raise RuntimeError(f"Converting to {output_format} failed")
+    return {'output_bytes': os.path.getsize(output_path)}
+
+
+def output_checker(paths, seconds, output_format):
+    """``check`` comparing the duration and format of outputs with what they should be."""
+    def check(outcome):
+        errors = []
+        for path in paths():
+            info = probe_audio(path)
+            errors.append(abs(info['duration'] - seconds) if info and output_format in info['format'] else None)
+        return {
+            'duration_error': max((error for error in errors if error is not None), default=None),
+            'duration_correct': bool(errors) and all(error is not None and error <= DURATION_TOLERANCE for error in errors)
+        }
+    return check
+
+
+def convert_cases(options):
+    cases = []
+    output_folder = os.path.join(options.work, 'convert')
+    sources = [Fixture(120, 'C', options.seconds, source_format) for source_format in CODEC_ARGS]
+    sources += [Fixture(120, 'C', seconds) for seconds in options.lengths if seconds != options.seconds]
+    for source in sources:
+        path = source.ensure(options.fixtures)
+        targets = [(target, None) for target in CODEC_ARGS]
+        if source.format == 'wav' and source.seconds == options.seconds:
+            targets += [(target, Config.LOUDNESS_TARGET) for target in CODEC_ARGS]
+        for target, loudness_target in targets:
+            name = f"{source.name}-to-{target}" + ('-normalized' if loudness_target is not None else '')
+            output_path = os.path.join(output_folder, f"{name}.{target}")
+            cases.append(Case(
+                'convert', name, convert, (path, output_path, target, loudness_target),
+                check=output_checker(lambda output_path=output_path: [output_path], source.seconds, target),
+                details=dict(source.to_dict(), target=target, loudness_target=loudness_target)
+            ))
+    return cases
+
+
+# Separation
+
+class StubSeparationEngine(SeparationEngine):
+    """The separation engine with demucs replaced by a band split of the spectrum.
+
+    Decoding, level statistics, stem encoding and their memory use are the
+    engine's own, so changes to them can be measured without torch or a
+    model download. Inputs are always separated in memory.
+    """
+
+    SOURCES = ['bass', 'other', 'vocals', 'drums']
+    BANDS = [0, 200, 1000, 4000, SAMPLE_RATE]  # Hz, one band per source
+
+    def __init__(self, **kwargs):
+        super().__init__(in_memory=24 * 3600, **kwargs)
+
+    def _separate_in_memory(self, pcm, mean, std):
+        spectrum = np.fft.rfft(pcm.T.astype(np.float32) / 32768.0, axis=1)
+        bins = np.fft.rfftfreq(len(pcm), 1 / SAMPLE_RATE)
+        sources = np.empty((len(self.SOURCES), pcm.shape[1], len(pcm)), dtype=np.float32)
+        for index, (low, high) in enumerate(zip(self.BANDS, self.BANDS[1:])):
+            band = spectrum * ((bins >= low) & (bins < high))
+            sources[index] = np.fft.irfft(band, n=len(pcm), axis=1)
+        return list(self.SOURCES), sources
+
+
+def separate_stub(path, output_dir):
+    stems = StubSeparationEngine(output_format='mp3').separate(path, output_dir)
+    return {'stems': sorted(stems)}
+
+
+def separate_preset(path, output_dir, options):
+    # The engine runs exactly as separation jobs run it, model loading included
+    process = subprocess.run(
+        [sys.executable, SEPARATION_SCRIPT, path, '--out', output_dir, *separation_args(options)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"separation.py failed: {process.stderr[-2000:]}")
+    return {'stems': sorted(line.split(' ', 2)[1] for line in process.stdout.splitlines() if line.startswith('stem '))}
+
+
+def stem_paths(output_dir):
+    return lambda: [os.path.join(output_dir, name) for name in sorted(os.listdir(output_dir))] if os.path.isdir(output_dir) else []
+
+
+def separate_cases(options):
+    cases = []
+    output_folder = os.path.join(options.work, 'separate')
+    for seconds in sorted({options.seconds, *options.lengths}):
+        fixture = Fixture(120, 'C', seconds)
+        output_dir = os.path.join(output_folder, f"stub-{fixture.name}")
+        cases.append(Case(
+            'separate', f"stub-{fixture.name}", separate_stub, (fixture.ensure(options.fixtures), output_dir),
+            check=output_checker(stem_paths(output_dir), seconds, 'mp3'),
+            details=dict(fixture.to_dict(), model='stub')
+        ))
+
+    fixture = Fixture(120, 'C', options.seconds)
+    for preset in options.separation_presets:
+        base = dict(
+            Config.SEPARATION_PRESETS[preset],
+            workers=Config.SEPARATION_WORKERS,
+            threads=Config.SEPARATION_THREADS,
+            window=Config.SEPARATION_WINDOW,
+            overlap=Config.SEPARATION_OVERLAP,
+            in_memory=Config.SEPARATION_IN_MEMORY
+        )
+        # In one pass, and forced through the windowed worker pool
+        for mode, in_memory in (('in-memory', base['in_memory']), ('windowed', 0)):
+            name = f"{preset}-{mode}-{fixture.name}"
+            output_dir = os.path.join(output_folder, name)
+            separation_options = dict(base, in_memory=in_memory)
+            cases.append(Case(
+                'separate', name, separate_preset, (fixture.ensure(options.fixtures), output_dir, separation_options),
+                check=output_checker(stem_paths(output_dir), fixture.seconds, separation_options['format']),
+                details=dict(fixture.to_dict(), preset=preset, model=base['model'], in_memory=in_memory)
+            ))
+    return cases
+
+
+# Endpoints
+
+BENCHMARK_ADMIN = ('benchmark', 'benchmark')
+
+
+def import_app(folder):
+    """Import the app against a scratch database, from ``folder``.
+
+    The app's folders are relative to the working directory, so uploads,
+    caches and the admission database all end up in ``folder``. The
+    benchmark client logs in as an admin, which lifts the per-client
+    admission limits that would otherwise refuse most of its requests.
+    """
+    from werkzeug.security import generate_password_hash
+    os.makedirs(folder, exist_ok=True)
+    os.chdir(folder)
+    Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath('benchmark.db')}"
+    from app import app
+    from extensions import db
+    from models import User
+    from schema import upgrade_schema
+    with app.app_context():
+        upgrade_schema()
+        if User.query.filter_by(username=BENCHMARK_ADMIN[0]).first() is None:
+            db.session.add(User(username=BENCHMARK_ADMIN[0], password=generate_password_hash(BENCHMARK_ADMIN[1]), is_admin=True))
+            db.session.commit()
+    return app
+
+
+@contextmanager
+def running_server(folder, url, path, form, concurrency, requests_per_client, warmup):
+    """Serve the app on a free port with one logged-in session per client, workers warmed up."""
+    import logging
+    import requests
+    from werkzeug.serving import make_server
+
+    # The development server logs every request at INFO
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, import_app(folder), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        sessions = []
+        for _ in range(concurrency):
+            session = requests.Session()
+            session.post(f"{base}/admin", data={'username': BENCHMARK_ADMIN[0], 'password': BENCHMARK_ADMIN[1]})
+            sessions.append(session)
+        warmups = [threading.Thread(target=submit_and_wait, args=(sessions[0], base, url, path, form)) for _ in range(warmup)]
+        for warming in warmups:
+            warming.start()
+        for warming in warmups:
+            warming.join()
+        yield base, sessions, url, path, form, requests_per_client
+    finally:
+        server.shutdown()
+
+
+def submit_and_wait(session, base, url, path, form, poll=0.05):
+    """Submit a job and follow it until it finished: (submit seconds, job seconds, succeeded)."""
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        response = session.post(f"{base}{url}", files={'audio_file': (os.path.basename(path), f)}, data=form)
+    submitted = time.perf_counter() - started
+    if response.status_code != 202:
+        return submitted, None, False
+    status_url = f"{base}{response.json()['status_url']}"
+    while True:
+        job = session.get(status_url).json()['job']
+        if job['state'] in ('done', 'failed', 'cancelled'):
+            return submitted, time.perf_counter() - started, job['state'] == 'done'
+        time.sleep(poll)
+
+
+def load(base, sessions, url, path, form, requests_per_client):
+    results = []
+    lock = threading.Lock()
+
+    def client(session):
+        for _ in range(requests_per_client):
+            result = submit_and_wait(session, base, url, path, form)
+            with lock:
+                results.append(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    submits = [submitted for submitted, _, _ in results]
+    jobs = [seconds for _, seconds, ok in results if ok]
+    return {
+        'requests': len(results),
+        'errors': len(results) - len(jobs),
+        'throughput_per_second': len(jobs) / elapsed,
+        'submit_p50_seconds': percentile(submits, 50),
+        'submit_p95_seconds': percentile(submits, 95),
+        'job_p50_seconds': percentile(jobs, 50),
+        'job_p95_seconds': percentile(jobs, 95),
+        'job_p99_seconds': percentile(jobs, 99)
+    }
+
+
+def endpoint_cases(options):
+    folder = os.path.join(options.work, 'app')
+    fixture = Fixture(120, 'C', options.seconds)
+    path = fixture.ensure(options.fixtures)
+    # Jobs per client at each concurrency; conversions are quicker than analyses
+    endpoints = [
+        ('analyze', '/audio/analyze', {}, 2),
+        ('convert', '/audio/converter', {'target_format': 'mp3'}, 4),
+    ]
+    # One warm-up job per worker process, so the timed jobs find them warm
+    warmup = 0 if options.cold else Config.WORKER_PROCESSES
+    return [
+        Case(
+            'endpoints', f"{name}-c{concurrency}", load,
+            (folder, url, path, form, concurrency, requests_per_client, warmup),
+            prepare=running_server,
+            details=dict(fixture.to_dict(), url=url, concurrency=concurrency, requests=concurrency * requests_per_client)
+        )
+        for name, url, form, requests_per_client in endpoints
+        for concurrency in options.concurrency
+    ]
+
+
+SUITES = {
+    'analyze': analyze_cases,
+    'convert': convert_cases,
+    'separate': separate_cases,
+    'endpoints': endpoint_cases,
+}
+
@@ -0,0 +1,106 @@
+import os
+import wave
+import subprocess
+import numpy as np
+from utils import CODEC_ARGS
+
+SAMPLE_RATE = 44100
+
+# Bumped whenever the synthesis changes, so cached fixtures are regenerated
+VERSION = 1
+
+NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# One chord per bar, as (semitones above the tonic, minor chord): I IV V I and i iv V i
+MAJOR_PROGRESSION = [(0, False), (5, False), (7, False), (0, False)]
+MINOR_PROGRESSION = [(0, True), (5, True), (7, False), (0, True)]
+
+
+class Fixture:
+    """A synthetic track with a known tempo and key.
+
+    A click on every beat (accented on the downbeat) over sustained chords
+    that cadence in ``key``, named as the analyzer names keys ('F#', 'Am').
+    The audio is deterministic, so fixtures are generated once per folder
+    and reused by every later run.
+    """
+
+    def __init__(self, bpm, key, seconds, format='wav'):
+        self.bpm = bpm
+        self.key = key
+        self.seconds = seconds
+        self.format = format
+
+    @property
+    def name(self):
+        return f"{self.bpm}bpm-{self.key.replace('#', 's')}-{self.seconds:g}s.{self.format}"
+
+    def ensure(self, folder):
+        """Path of the fixture in ``folder``, generated first if missing."""
+        folder = os.path.join(folder, f"v{VERSION}")
+        path = os.path.join(folder, self.name)
+        if os.path.exists(path):
+            return path
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.{self.format}"
+        if self.format == 'wav':
+            write_wav(tmp_path, synthesize(self.bpm, self.key, self.seconds))
+        else:
+            source = Fixture(self.bpm, self.key, self.seconds).ensure(os.path.dirname(folder))
+            process = subprocess.run(
+                ['ffmpeg', '-y', '-v', 'error', '-i', source, *CODEC_ARGS[self.format], tmp_path],
+                stderr=subprocess.PIPE
+            )
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg could not encode {self.name}: {process.stderr.decode('utf-8', errors='replace')}")
+        os.replace(tmp_path, path)
+        return path
+
+    def to_dict(self):
+        return {'bpm': self.bpm, 'key': self.key, 'seconds': self.seconds, 'format': self.format}
+
+
+def synthesize(bpm, key, seconds, seed=0):
+    """Stereo int16 samples of shape (samples, 2) at SAMPLE_RATE."""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    beat = 60.0 / bpm
+    bar = 4 * beat
+    minor = key.endswith('m')
+    tonic = NOTES.index(key[:-1] if minor else key)
+    progression = MINOR_PROGRESSION if minor else MAJOR_PROGRESSION
+    mono = np.zeros(total, dtype=np.float32)
+
+    # Chords: bass note, triad and octave, each with a second harmonic,
+    # swelling in and decaying over the bar
+    for index, start in enumerate(np.arange(0, seconds, bar)):
+        degree, minor_chord = progression[index % len(progression)]
+        root = 48 + (tonic + degree) % 12
+        begin, end = int(start * SAMPLE_RATE), min(total, int((start + bar) * SAMPLE_RATE))
+        t = np.arange(end - begin, dtype=np.float32) / SAMPLE_RATE
+        envelope = np.minimum(1.0, t / 0.02) * np.exp(-0.8 * t)
+        for note in (root - 12, root, root + (3 if minor_chord else 4), root + 7, root + 12):
+            frequency = 440.0 * 2 ** ((note - 69) / 12)
+            mono[begin:end] += 0.06 * envelope * (np.sin(2 * np.pi * frequency * t) + 0.3 * np.sin(4 * np.pi * frequency * t))
+
+    # Clicks: short decaying sine bursts, higher and louder on the downbeat
+    length = int(0.03 * SAMPLE_RATE)
+    t = np.arange(length, dtype=np.float32) / SAMPLE_RATE
+    accent = 0.6 * np.sin(2 * np.pi * 2500 * t) * np.exp(-150 * t)
+    click = 0.4 * np.sin(2 * np.pi * 1500 * t) * np.exp(-150 * t)
+    for index, start in enumerate(np.arange(0, seconds, beat)):
+        begin = int(start * SAMPLE_RATE)
+        count = min(length, total - begin)
+        mono[begin:begin + count] += (accent if index % 4 == 0 else click)[:count]
+
+    mono += rng.normal(0, 0.001, total).astype(np.float32)
+    stereo = np.stack((mono, 0.9 * mono), axis=1)
+    return (np.clip(stereo, -1, 1) * 32767).astype('<i2')
+
+
+def write_wav(path, samples):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
@@ -0,0 +1,411 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from importlib.util import find_spec
+from benchmarks.fixtures import Fixture, NOTES
+from benchmarks.measure import percentile
+from benchmarks.run import environment, format_value
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Schema of the results files, bumped when it changes incompatibly
+RESULTS_VERSION = 1
+
+KINDS = ['home', 'showcase', 'stream', 'like', 'unlike']
+
+# Share of each kind of request in a traffic profile
+PROFILES = {
+    'browse': {'home': 30, 'showcase': 60, 'stream': 10},
+    'listen': {'showcase': 20, 'stream': 70, 'like': 10},
+    'react': {'showcase': 20, 'like': 60, 'unlike': 20},
+    'mixed': {'home': 15, 'showcase': 35, 'stream': 35, 'like': 10, 'unlike': 5},
+}
+
+SORTS = ['date_desc', 'date_asc', 'name_asc', 'name_desc', 'play_count', 'like_count']
+
+# Bytes asked for by a stream request, from a random offset, as a player seeking does
+STREAM_CHUNK = 256 * 1024
+
+# How often the lock probe asks for the database's write lock, and how long it waits
+PROBE_INTERVAL = 0.1
+PROBE_TIMEOUT = 5.0
+
+
+def parse_mix(value):
+    """Parse ``home=20,like=5`` into request weights."""
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown request kind {kind!r}, expected one of {', '.join(KINDS)}")
+        try:
+            mix[kind] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Weight of {kind} is not a number: {weight!r}")
+    return mix
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.load',
+        description="Load test the public pages, likes and audio streaming of the app served by gunicorn."
+    )
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed',
+                        help="Traffic profile (default mixed): " + '; '.join(
+                            f"{name} " + ', '.join(f"{kind} {weight}" for kind, weight in mix.items())
+                            for name, mix in PROFILES.items()))
+    parser.add_argument('--mix', type=parse_mix, default=None, help="Custom weights instead of a profile, e.g. showcase=3,like=1")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help="Concurrent clients, one level after another (default 1 8 32)")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds of load at each concurrency (default 20)")
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds at the start of each level left out of the figures (default 2)")
+    parser.add_argument('--think', type=float, default=0, help="Seconds each client waits between requests (default 0)")
+    parser.add_argument('--tracks', type=int, default=200, help="Synthetic tracks in the database (default 200)")
+    parser.add_argument('--files', type=int, default=8, help="Distinct audio files the tracks share (default 8)")
+    parser.add_argument('--seconds', type=float, default=30, help="Length of the audio files (default 30)")
+    parser.add_argument('--workers', type=int, default=1, help="gunicorn worker processes (default 1)")
+    parser.add_argument('--threads', type=int, default=16, help="gunicorn threads per worker (default 16)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data and the request mix")
+    parser.add_argument('--fixtures', default=os.path.join('cache', 'benchmarks', 'fixtures'), help="Folder of the generated fixtures")
+    parser.add_argument('--output', default=None, help="Results file (default cache/benchmarks/load-<time>.json)")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch database, server log and audio files")
+    args = parser.parse_args(argv)
+    args.mix = args.mix or PROFILES[args.profile]
+    if args.warmup >= args.duration:
+        parser.error("--warmup must be shorter than --duration")
+    args.fixtures = os.path.abspath(args.fixtures)
+    args.output = os.path.abspath(args.output or os.path.join('cache', 'benchmarks', f"load-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    return args
+
+
+def seed(folder, database, static, options):
+    """Create a scratch database of synthetic published tracks, with their audio in ``static``.
+
+    The audio has to be where the app serves static files from, so
+    ``static`` is a folder of its own under ``static/uploads``. Run in a
+    process of its own, as importing the app starts its background threads.
+    Returns (track id, static path, size) of every track.
+    """
+    os.environ['DATABASE_URI'] = f"sqlite:///{database}"
+    # The app creates its relative folders on import; keep them in the scratch folder
+    os.chdir(folder)
+    from app import app
+    from extensions import db
+    from images import MISSING_ARTWORK
+    from models import Track
+    from schema import upgrade_schema
+
+    os.makedirs(static, exist_ok=True)
+    files = []
+    for index in range(options.files):
+        fixture = Fixture(80 + 10 * index, NOTES[index % len(NOTES)], options.seconds)
+        shutil.copyfile(fixture.ensure(options.fixtures), os.path.join(static, fixture.name))
+        files.append((fixture, fixture.name))
+
+    rng = random.Random(options.seed)
+    now = datetime.utcnow()
+    prefix = os.path.basename(static)
+    with app.app_context():
+        upgrade_schema()
+        for index in range(options.tracks):
+            fixture, filename = files[index % len(files)]
+            db.session.add(Track(
+                name=f"Load test {index + 1:05d}",
+                description=f"Synthetic {fixture.bpm} BPM track in {fixture.key}",
+                file=f"{prefix}/{filename}",
+                artwork=MISSING_ARTWORK[0],
+                artwork_secondary=MISSING_ARTWORK[1],
+                play_count=rng.randrange(10000),
+                like_count=rng.randrange(500),
+                unlike_count=rng.randrange(50),
+                date_added=now - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+                tempo=fixture.bpm,
+                musical_key=fixture.key,
+                duration=fixture.seconds,
+                status='ready'
+            ))
+        db.session.commit()
+        tracks = [
+            (track_id, f"uploads/{filename}", os.path.getsize(os.path.join(static, os.path.basename(filename))))
+            for track_id, filename in db.session.query(Track.id, Track.file)
+        ]
+    return tracks
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(folder, database, options, log, timeout=60):
+    """Start gunicorn on a free port from ``folder`` and wait until it serves pages."""
+    import requests
+
+    port = free_port()
+    # One JSON line per log record, so database errors can be counted
+    env = dict(os.environ, DATABASE_URI=f"sqlite:///{database}", LOG_FORMAT='json')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f"127.0.0.1:{port}",
+         '--workers', str(options.workers), '--threads', str(options.threads),
+         '--chdir', folder, '--pythonpath', REPO, 'app:app'],
+        stdout=log, stderr=subprocess.STDOUT, env=env
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}, see {log.name}")
+        try:
+            if requests.get(f"{base}/showcase", timeout=5).ok:
+                return process, base
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline:
+            stop_server(process)
+            raise RuntimeError(f"gunicorn did not serve pages within {timeout}s, see {log.name}")
+        time.sleep(0.2)
+
+
+def stop_server(process, grace=30):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(grace)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def send(session, base, kind, tracks, rng):
+    """Make one request of a kind, reading the whole response."""
+    if kind == 'home':
+        return session.get(f"{base}/", timeout=30)
+    if kind == 'showcase':
+        return session.get(f"{base}/showcase", params={'sort': rng.choice(SORTS)}, timeout=30)
+    track_id, path, size = rng.choice(tracks)
+    if kind in ('like', 'unlike'):
+        return session.post(f"{base}/track/{kind}/{track_id}", timeout=30)
+    offset = rng.randrange(max(1, size - STREAM_CHUNK))
+    return session.get(f"{base}/static/{path}", headers={'Range': f"bytes={offset}-{offset + STREAM_CHUNK - 1}"}, timeout=30)
+
+
+class LockProbe(threading.Thread):
+    """Times how long taking the database's write lock waits, until stopped.
+
+    Every PROBE_INTERVAL it begins and rolls back an immediate transaction,
+    which has to wait for any other writer to finish. Waits of PROBE_TIMEOUT
+    count as timeouts, as the app's own writes would fail with "database is
+    locked" after waiting as long.
+    """
+
+    def __init__(self, database):
+        super().__init__(name='lock-probe', daemon=True)
+        self.database = database
+        self.waits = []
+        self.timeouts = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        connection = sqlite3.connect(self.database, timeout=PROBE_TIMEOUT, isolation_level=None)
+        try:
+            while not self._stopped.is_set():
+                started = time.perf_counter()
+                try:
+                    connection.execute('BEGIN IMMEDIATE')
+                    self.waits.append(time.perf_counter() - started)
+                    connection.execute('ROLLBACK')
+                except sqlite3.OperationalError:
+                    self.timeouts += 1
+                self._stopped.wait(PROBE_INTERVAL)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def lock_errors(log_path, offset):
+    """Log lines since ``offset`` reporting a locked database, and the new offset."""
+    with open(log_path, errors='replace') as f:
+        f.seek(offset)
+        count = sum('database is locked' in line for line in f)
+        return count, f.tell()
+
+
+def latency(samples):
+    """Request count, error rate and latency percentiles of (seconds, status) samples."""
+    seconds = [elapsed for elapsed, _ in samples]
+    errors = sum(status is None or status >= 400 for _, status in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else None,
+        'p50_seconds': percentile(seconds, 50),
+        'p95_seconds': percentile(seconds, 95),
+        'p99_seconds': percentile(seconds, 99),
+        'max_seconds': max(seconds) if seconds else None,
+        'statuses': statuses
+    }
+
+
+def run_level(base, tracks, database, log_path, log_offset, concurrency, options):
+    """Drive ``concurrency`` clients for ``options.duration`` seconds and summarize what they saw.
+
+    Each client sends its next request as soon as the last one finished
+    (after ``options.think`` seconds). Returns the figures, the successful
+    likes and unlikes sent, and the new server log offset.
+    """
+    import requests
+
+    samples = []
+    kinds, weights = zip(*options.mix.items())
+    started = time.perf_counter()
+    measured_from = started + options.warmup
+    deadline = started + options.duration
+
+    def client(number):
+        rng = random.Random(f"{options.seed}-{concurrency}-{number}")
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                kind = rng.choices(kinds, weights)[0]
+                sent = time.perf_counter()
+                try:
+                    status = send(session, base, kind, tracks, rng).status_code
+                except requests.RequestException:
+                    status = None
+                samples.append((kind, sent, time.perf_counter() - sent, status))
+                if options.think:
+                    time.sleep(options.think)
+
+    probe = LockProbe(database)
+    probe.start()
+    clients = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    probe.stop()
+    errors, log_offset = lock_errors(log_path, log_offset)
+
+    measured = [sample for sample in samples if sample[1] >= measured_from]
+    elapsed = time.perf_counter() - measured_from
+    figures = latency([(seconds, status) for _, _, seconds, status in measured])
+    figures.update(
+        concurrency=concurrency,
+        throughput_per_second=len(measured) / elapsed,
+        kinds={
+            kind: latency([(seconds, status) for sample_kind, _, seconds, status in measured if sample_kind == kind])
+            for kind in kinds
+        },
+        lock_errors=errors,
+        lock_wait_p50_seconds=percentile(probe.waits, 50),
+        lock_wait_p95_seconds=percentile(probe.waits, 95),
+        lock_wait_max_seconds=max(probe.waits) if probe.waits else None,
+        lock_probe_timeouts=probe.timeouts
+    )
+    reactions = {
+        kind: sum(1 for sample_kind, _, _, status in samples if sample_kind == kind and status == 200)
+        for kind in ('like', 'unlike')
+    }
+    return figures, reactions, log_offset
+
+
+def reaction_totals(database):
+    with sqlite3.connect(database) as connection:
+        likes, unlikes = connection.execute('SELECT SUM(like_count), SUM(unlike_count) FROM tracks').fetchone()
+    return {'like': likes or 0, 'unlike': unlikes or 0}
+
+
+def format_latency(figures):
+    rate = f"{figures['error_rate']:.1%}" if figures['error_rate'] is not None else '-'
+    return (f"{figures['requests']:>7} requests  errors {rate:>6}  p50 {format_value('p50_seconds', figures['p50_seconds'])}"
+            f"  p95 {format_value('p95_seconds', figures['p95_seconds'])}  p99 {format_value('p99_seconds', figures['p99_seconds'])}"
+            f"  max {format_value('max_seconds', figures['max_seconds'])}")
+
+
+def report(figures):
+    print(f"c={figures['concurrency']:<4} {format_latency(figures)}  {figures['throughput_per_second']:.1f}/s")
+    for kind, kind_figures in figures['kinds'].items():
+        if kind_figures['requests']:
+            print(f"  {kind:<9}{format_latency(kind_figures)}")
+    print(f"  database: {figures['lock_errors']} locked errors logged, write lock wait"
+          f" p50 {format_value('lock_wait_p50_seconds', figures['lock_wait_p50_seconds'])}"
+          f" p95 {format_value('lock_wait_p95_seconds', figures['lock_wait_p95_seconds'])}"
+          f" max {format_value('lock_wait_max_seconds', figures['lock_wait_max_seconds'])},"
+          f" {figures['lock_probe_timeouts']} probe timeouts", flush=True)
+
+
+def main(argv=None):
+    """Seed a scratch database, serve the app with gunicorn and load test it at each concurrency."""
+    # Only warnings and errors, which include the database errors counted
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    args = parse_args(argv)
+    if find_spec('gunicorn') is None:
+        raise SystemExit("gunicorn is not installed (pip install -r requirements.txt)")
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'options': {key: getattr(args, key) for key in ('mix', 'concurrency', 'duration', 'warmup', 'think', 'tracks', 'files', 'seconds', 'workers', 'threads', 'seed')},
+        'levels': []
+    }
+    work = tempfile.mkdtemp(prefix='load-')
+    database = os.path.join(work, 'load.db')
+    static = os.path.join(REPO, 'static', 'uploads', f"loadtest-{os.getpid()}")
+    try:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            tracks = executor.submit(seed, work, database, static, args).result()
+        print(f"Seeded {len(tracks)} tracks; serving with {args.workers} worker(s) x {args.threads} threads", flush=True)
+        seeded = reaction_totals(database)
+        sent = {'like': 0, 'unlike': 0}
+        log_path = os.path.join(work, 'server.log')
+        with open(log_path, 'w') as log:
+            process, base = start_server(work, database, args, log)
+            try:
+                offset = lock_errors(log_path, 0)[1]
+                for concurrency in args.concurrency:
+                    figures, reactions, offset = run_level(base, tracks, database, log_path, offset, concurrency, args)
+                    for kind, count in reactions.items():
+                        sent[kind] += count
+                    results['levels'].append(figures)
+                    report(figures)
+            finally:
+                stop_server(process)
+
+        # Likes are counted by reading and rewriting the row, so concurrent ones can overwrite each other
+        stored = reaction_totals(database)
+        results['lost_updates'] = {kind: sent[kind] - (stored[kind] - seeded[kind]) for kind in sent}
+        print("Lost updates: " + ', '.join(f"{kind} {lost} of {sent[kind]}" for kind, lost in results['lost_updates'].items()))
+    finally:
+        if args.keep:
+            print(f"Database and server log kept in {work}, audio in {static}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+            shutil.rmtree(static, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
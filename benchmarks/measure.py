@@ -0,0 +1,198 @@
+import os
+import sys
+import math
+import time
+import ctypes
+import signal
+import resource
+import statistics
+import threading
+import traceback
+import multiprocessing
+from contextlib import nullcontext
+
+PR_SET_CHILD_SUBREAPER = 36
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def become_subreaper():
+    """Adopt orphaned descendants (Linux), so their CPU time is counted when they are reaped.
+
+    Processes started through a fork server, such as analysis and
+    separation workers, are not children of the process that uses them;
+    without this their CPU time would be lost when it exits.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def group_processes(pgid):
+    """(pid, resident bytes, CPU seconds) of every process in a process group, read from /proc.
+
+    The CPU time includes that of the processes' children they reaped.
+    """
+    processes = []
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return processes
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue  # Exited meanwhile
+        # Fields after the command name, from the state (3rd field, see proc(5))
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(fields[2]) == pgid and fields[0] != 'Z':
+            cpu = sum(int(ticks) for ticks in fields[11:15]) / CLOCK_TICKS
+            processes.append((int(pid), int(fields[21]) * PAGE_SIZE, cpu))
+    return processes
+
+
+class GroupSampler(threading.Thread):
+    """Samples the total resident memory of a process group until stopped."""
+
+    def __init__(self, pgid, interval=0.05):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.pgid = pgid
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, sum(rss for _, rss, _ in group_processes(self.pgid)))
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _child(connection, run, args, prepare):
+    # Own process group, so everything the case starts can be sampled and cleaned up
+    os.setpgid(0, 0)
+    try:
+        with (prepare(*args) if prepare is not None else nullcontext(args)) as run_args:
+            setup = sum(cpu for _, _, cpu in group_processes(os.getpid()))
+            started = time.perf_counter()
+            outcome = run(*run_args)
+            wall = time.perf_counter() - started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        connection.send({
+            'wall_seconds': wall,
+            'setup_cpu_seconds': setup,
+            'peak_rss_bytes': usage.ru_maxrss * 1024,
+            'outcome': outcome
+        })
+    except BaseException:
+        connection.send({'error': traceback.format_exc()})
+    finally:
+        connection.close()
+        # Exit right away: multiprocessing would wait for process pools the
+        # case left running, which the parent cleans up instead
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+def _reap_group(pgid, grace=2.0):
+    """Wait for the case's leftover processes to exit, killing them after ``grace`` seconds."""
+    deadline = time.monotonic() + grace
+    killed = None
+    while True:
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except ChildProcessError:
+            pass
+        if not group_processes(pgid):
+            return
+        if time.monotonic() > deadline and killed != signal.SIGKILL:
+            killed = signal.SIGTERM if killed is None else signal.SIGKILL
+            try:
+                os.killpg(pgid, killed)
+            except ProcessLookupError:
+                return
+            deadline = time.monotonic() + grace
+        time.sleep(0.05)
+
+
+def measure(run, args=(), prepare=None, timeout=None):
+    """Run ``run(*args)`` once in a forked child and measure it.
+
+    ``prepare(*args)``, if given, is a context manager run in the child
+    around the measurement (starting servers, warming up workers); what it
+    yields replaces ``args``. Returns the wall time of ``run``, the CPU
+    time of the child and every process it started (minus what they used
+    before ``run`` started), the peak RSS of the child and the peak total RSS of all its
+    processes, and ``run``'s return value as ``outcome``, or ``error``
+    with the traceback.
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = context.Process(target=_child, args=(sender, run, args, prepare))
+    process.start()
+    sender.close()
+    sampler = GroupSampler(process.pid)
+    sampler.start()
+    result = None
+    try:
+        if receiver.poll(timeout):
+            result = receiver.recv()
+        else:
+            result = {'error': f"Timed out after {timeout}s"}
+    except EOFError:
+        pass
+    finally:
+        if result is None or process.is_alive() and 'outcome' not in result:
+            # Timed out or interrupted
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        process.join()
+        _reap_group(process.pid)
+        sampler.stop()
+        receiver.close()
+    if result is None:
+        result = {'error': f"Benchmark process died with exit code {process.exitcode}"}
+
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+    result['cpu_seconds'] = max(0.0, cpu - result.pop('setup_cpu_seconds', 0.0))
+    result['peak_tree_rss_bytes'] = sampler.peak or None
+    return result
+
+
+def summarize(runs):
+    """Median wall and CPU time, highest peak memory and the median run's outcome of repeated runs."""
+    ok = [run for run in runs if 'error' not in run]
+    if not ok:
+        return {'error': runs[-1]['error'], 'runs': runs}
+    median = sorted(ok, key=lambda run: run['wall_seconds'])[(len(ok) - 1) // 2]
+    tree_peaks = [run['peak_tree_rss_bytes'] for run in ok if run.get('peak_tree_rss_bytes')]
+    return {
+        'wall_seconds': statistics.median(run['wall_seconds'] for run in ok),
+        'cpu_seconds': statistics.median(run['cpu_seconds'] for run in ok),
+        'peak_rss_bytes': max(run['peak_rss_bytes'] for run in ok),
+        'peak_tree_rss_bytes': max(tree_peaks) if tree_peaks else None,
+        'outcome': median['outcome'],
+        'failed_runs': len(runs) - len(ok),
+        'runs': runs
+    }
+
+
+def percentile(values, q):
+    """The ``q``-th percentile (0-100) of ``values``, by the nearest-rank method."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, math.ceil(q / 100 * len(ordered)))) - 1]
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from importlib import metadata
+from benchmarks.measure import become_subreaper, measure, summarize
+
+# In the order they run; defined in benchmarks.cases, which is only imported to run them
+SUITE_NAMES = ['analyze', 'convert', 'separate', 'endpoints']
+
+# Schema of the results files, bumped when it changes incompatibly
+RESULTS_VERSION = 1
+
+# Figures compared with the baseline: (key, smallest change that counts, whether higher is worse).
+# The floors keep noise in short timings from being reported
+METRICS = [
+    ('wall_seconds', 0.05, True),
+    ('cpu_seconds', 0.05, True),
+    ('peak_rss_bytes', 16 * 1024 ** 2, True),
+    ('peak_tree_rss_bytes', 16 * 1024 ** 2, True),
+]
+METRIC_LABELS = {'wall_seconds': 'wall', 'cpu_seconds': 'cpu', 'peak_rss_bytes': 'rss', 'peak_tree_rss_bytes': 'all processes'}
+OUTCOME_METRICS = [
+    ('errors', 0, True),
+    ('throughput_per_second', 0.01, False),
+    ('submit_p95_seconds', 0.01, True),
+    ('job_p50_seconds', 0.05, True),
+    ('job_p95_seconds', 0.05, True),
+]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Benchmark the audio tools on synthetic fixtures and compare with a baseline."
+    )
+    parser.add_argument('suites', nargs='*', default=SUITE_NAMES,
+                        help=f"Suites to run: {', '.join(SUITE_NAMES)} (default all)")
+    parser.add_argument('--quick', action='store_true', help="Shorter fixtures, one run per case, fewer clients")
+    parser.add_argument('--repeat', type=int, default=None, help="Runs per case; medians are reported (default 3, 1 with --quick)")
+    parser.add_argument('--seconds', type=float, default=None, help="Length of the accuracy and format fixtures (default 30, 10 with --quick)")
+    parser.add_argument('--lengths', type=float, nargs='+', default=None, help="Fixture lengths for scaling cases (default 10 60 240)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=None, help="Concurrent clients of the endpoints (default 1 4 8)")
+    parser.add_argument('--separation-preset', dest='separation_presets', action='append', default=[],
+                        help="Also separate with this preset's demucs model (repeatable; needs torch and demucs)")
+    parser.add_argument('--cold', action='store_true', help="Skip warming up librosa and the workers before measuring")
+    parser.add_argument('--timeout', type=float, default=1800, help="Seconds before a run is killed")
+    parser.add_argument('--fixtures', default=os.path.join('cache', 'benchmarks', 'fixtures'), help="Folder of the generated fixtures")
+    parser.add_argument('--output', default=None, help="Results file (default cache/benchmarks/results-<time>.json)")
+    parser.add_argument('--baseline', default=None, help="Results file to compare the new results with")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'), help="Only compare two results files")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative change reported as a regression (default 0.1)")
+    parser.add_argument('--keep', action='store_true', help="Keep the outputs and scratch app folder")
+    args = parser.parse_args(argv)
+    unknown = [suite for suite in args.suites if suite not in SUITE_NAMES]
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(unknown)}")
+    args.repeat = args.repeat or (1 if args.quick else 3)
+    args.seconds = args.seconds or (10 if args.quick else 30)
+    args.lengths = args.lengths or ([] if args.quick else [10, 60, 240])
+    args.concurrency = args.concurrency or ([1, 4] if args.quick else [1, 4, 8])
+    args.fixtures = os.path.abspath(args.fixtures)
+    return args
+
+
+def environment():
+    """What the results were measured on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip())
+    except OSError:
+        commit, dirty = None, None
+    versions = {}
+    for package in ('numpy', 'librosa', 'numba', 'torch', 'demucs', 'Flask'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+        'dirty': dirty,
+        'packages': versions
+    }
+
+
+def accuracy(cases):
+    """Share of each suite's cases getting each ``*_correct`` figure right."""
+    counts = {}
+    for entry in cases.values():
+        for key, value in entry.get('outcome', {}).items():
+            if key.endswith('_correct'):
+                right, total = counts.setdefault(entry['suite'], {}).get(key, (0, 0))
+                counts[entry['suite']][key] = (right + bool(value), total + 1)
+    return {
+        suite: {key: right / total for key, (right, total) in figures.items()}
+        for suite, figures in counts.items()
+    }
+
+
+def format_value(key, value):
+    if value is None:
+        return '-'
+    if key.endswith('_bytes'):
+        return f"{value / 1024 ** 2:.1f} MB"
+    if key.endswith('_seconds'):
+        return f"{value:.3f}s"
+    if isinstance(value, float):
+        return f"{value:.3g}"
+    return str(value)
+
+
+def format_entry(case_id, entry):
+    if 'error' in entry:
+        return f"{case_id:<50} FAILED {entry['error'].strip().splitlines()[-1]}"
+    figures = ' '.join(f"{label} {format_value(key, entry[key])}" for key, label in METRIC_LABELS.items())
+    outcome = ' '.join(f"{key}={format_value(key, value)}" for key, value in entry['outcome'].items()
+                       if not isinstance(value, (list, dict)))
+    return f"{case_id:<50} {figures}  {outcome}"
+
+
+def changed(old, new, floor, threshold, higher_is_worse):
+    """+1 if ``new`` is worse than ``old`` by more than the floor and threshold, -1 if better, else 0."""
+    difference = new - old
+    if abs(difference) <= floor or (old and abs(difference) / abs(old) <= threshold):
+        return 0
+    return 1 if (difference > 0) == higher_is_worse else -1
+
+
+def compare(baseline, results, threshold):
+    """Lines describing what changed since the baseline, and how many of them are regressions."""
+    lines, regressions = [], 0
+    for case_id, new in results['cases'].items():
+        old = baseline['cases'].get(case_id)
+        if old is None:
+            lines.append(f"  new        {case_id}")
+            continue
+        if 'error' in new or 'error' in old:
+            if 'error' in new and 'error' not in old:
+                regressions += 1
+                lines.append(f"  REGRESSED  {case_id} now fails")
+            elif 'error' in old and 'error' not in new:
+                lines.append(f"  fixed      {case_id} no longer fails")
+            continue
+
+        figures = [(key, old.get(key), new.get(key), floor, worse) for key, floor, worse in METRICS]
+        figures += [(key, old['outcome'].get(key), new['outcome'].get(key), floor, worse) for key, floor, worse in OUTCOME_METRICS]
+        for key, old_value, new_value, floor, higher_is_worse in figures:
+            if old_value is None or new_value is None:
+                continue
+            direction = changed(old_value, new_value, floor, threshold, higher_is_worse)
+            if direction:
+                regressions += direction > 0
+                change = f" ({(new_value - old_value) / old_value:+.0%})" if old_value else ''
+                lines.append(f"  {'REGRESSED' if direction > 0 else 'improved':<10} {case_id} {key} "
+                             f"{format_value(key, old_value)} -> {format_value(key, new_value)}{change}")
+        for key, value in new['outcome'].items():
+            if key.endswith('_correct') and old['outcome'].get(key) and not value:
+                regressions += 1
+                lines.append(f"  REGRESSED  {case_id} {key} no longer holds")
+
+    for case_id in baseline['cases']:
+        if case_id not in results['cases']:
+            lines.append(f"  missing    {case_id}")
+    for suite, figures in results.get('accuracy', {}).items():
+        for key, rate in figures.items():
+            old_rate = baseline.get('accuracy', {}).get(suite, {}).get(key)
+            if old_rate is not None and rate != old_rate:
+                lines.append(f"  {'accuracy':<10} {suite} {key} {old_rate:.0%} -> {rate:.0%}")
+    return lines, regressions
+
+
+def report_comparison(baseline_path, baseline, results, threshold):
+    lines, regressions = compare(baseline, results, threshold)
+    environment = baseline.get('environment', {})
+    print(f"\nCompared with {baseline_path} (commit {environment.get('commit') or 'unknown'}, {baseline.get('created', '?')}):")
+    print('\n'.join(lines) if lines else "  no changes beyond the threshold")
+    print(f"{regressions} regression{'' if regressions == 1 else 's'}")
+    return 1 if regressions else 0
+
+
+def load_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise SystemExit(f"{path} has results version {results.get('version')}, expected {RESULTS_VERSION}")
+    return results
+
+
+def main(argv=None):
+    """Run the benchmark suites, write the results as JSON and compare them with a baseline.
+
+    Returns 1 if the comparison found regressions, so CI jobs can fail on them.
+    """
+    # The app logs quietly unless asked otherwise; read when the endpoints import it
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    args = parse_args(argv)
+    if args.compare:
+        return report_comparison(args.compare[0], load_results(args.compare[0]), load_results(args.compare[1]), args.threshold)
+
+    from benchmarks.cases import SUITES
+    if not become_subreaper():
+        print("Note: CPU time of worker processes started through a fork server is not counted on this platform")
+    output = args.output or os.path.join('cache', 'benchmarks', f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    args.work = tempfile.mkdtemp(prefix='benchmarks-')
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'options': {key: getattr(args, key) for key in ('suites', 'quick', 'repeat', 'seconds', 'lengths', 'concurrency', 'separation_presets', 'cold')},
+        'cases': {}
+    }
+    try:
+        for suite in args.suites:
+            for case in SUITES[suite](args):
+                runs = [measure(case.run, case.args, case.prepare, timeout=args.timeout) for _ in range(args.repeat)]
+                entry = dict(summarize(runs), suite=case.suite, details=case.details)
+                if case.check is not None and 'error' not in entry:
+                    entry['outcome'].update(case.check(entry['outcome']))
+                results['cases'][case.id] = entry
+                print(format_entry(case.id, entry), flush=True)
+    finally:
+        if args.keep:
+            print(f"Outputs kept in {args.work}")
+        else:
+            shutil.rmtree(args.work, ignore_errors=True)
+
+    results['accuracy'] = accuracy(results['cases'])
+    for suite, figures in results['accuracy'].items():
+        print(f"{suite} accuracy: " + ', '.join(f"{key} {rate:.0%}" for key, rate in figures.items()))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        return report_comparison(args.baseline, load_results(args.baseline), results, args.threshold)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from flask import current_app
+from answer_cache import AnswerCache
+from outbound import get_outbound_client
+
+SYSTEM_PROMPT = (
+    "Your name is Alex. You are a music production expert who helps people learn about music production, "
+    "DAWs, mixing, and music theory, especially hip hop beatmaking. Try not to repeat yourself too much and "
+    "be funny sometimes. Make the experience of learning music production and hip hop beats as fun as possible"
+)
+
+
+class TogetherChatBackend:
+    """Streams completions from the Together API (or any OpenAI-compatible one at ``api_base``)."""
+
+    def __init__(self, api_base, api_key, model, client, options=None):
+        self.api_base = api_base.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.client = client
+        self.options = dict(options or {})
+
+    def stream(self, messages):
+        """Yield the answer to ``messages`` piece by piece as the model generates it."""
+        # Leaving the block early closes the connection, which stops the
+        # upstream generation when the visitor went away
+        with self.client.stream(
+            'POST', f"{self.api_base}/chat/completions",
+            headers={'Authorization': f"Bearer {self.api_key}"},
+            json={'model': self.model, 'messages': messages, 'stream': True, **self.options}
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    continue  # Read to the end so the connection can be reused
+                choices = json.loads(data).get('choices') or []
+                content = (choices[0].get('delta') or {}).get('content') if choices else None
+                if content:
+                    yield content
+
+
+class StubChatBackend:
+    """Local stand-in for the model, for development and load tests without an API key.
+
+    Answers with canned text that echoes the question, one word at a time,
+    at roughly the pace of a real streaming model.
+    """
+
+    def __init__(self, first_token_delay=0.2, token_delay=0.02):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    def stream(self, messages):
+        question = messages[-1]['content']
+        turn = sum(1 for message in messages if message['role'] == 'user')
+        answer = (
+            f"Alex here (stub backend). You asked: \"{question}\". This is question {turn} of our chat, "
+            f"and I can see {len(messages) - 2} earlier messages. Real answers need CHAT_BACKEND=together."
+        )
+        time.sleep(self.first_token_delay)
+        for index, word in enumerate(answer.split(' ')):
+            if index:
+                time.sleep(self.token_delay)
+            yield word if not index else ' ' + word
+
+
+class ConversationStore:
+    """Recent messages of each chat conversation, held in memory.
+
+    Each conversation keeps its last ``max_messages`` messages; the least
+    recently used conversations are dropped past ``max_conversations`` or
+    after ``ttl`` seconds idle, so memory stays bounded however many
+    visitors chat.
+    """
+
+    def __init__(self, max_messages, max_conversations, ttl):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._conversations = OrderedDict()  # chat id -> (last used, messages)
+        self._lock = threading.Lock()
+
+    def history(self, chat_id):
+        """Messages of a conversation, oldest first."""
+        with self._lock:
+            self._prune()
+            entry = self._conversations.get(chat_id)
+            return list(entry[1]) if entry else []
+
+    def append(self, chat_id, *messages):
+        with self._lock:
+            entry = self._conversations.pop(chat_id, None)
+            history = entry[1] if entry else deque(maxlen=self.max_messages)
+            history.extend(messages)
+            self._conversations[chat_id] = (time.time(), history)
+            self._prune()
+
+    def clear(self, chat_id):
+        with self._lock:
+            self._conversations.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        while self._conversations:
+            chat_id, (last_used, _) = next(iter(self._conversations.items()))
+            if len(self._conversations) <= self.max_conversations and last_used >= cutoff:
+                break
+            del self._conversations[chat_id]
+
+
+class ChatService:
+    """Answers chat messages with the conversation so far as context.
+
+    Opening questions go through the answer cache when there is one:
+    they are answered from it when the same or a very similar question
+    was answered before, and identical questions asked at the same time
+    share one model call. Follow-ups depend on the conversation, so they
+    always go to the model.
+    """
+
+    def __init__(self, backend, store, history_chars, cache=None, coalesce_timeout=60,
+                 system_prompt=SYSTEM_PROMPT):
+        self.backend = backend
+        self.store = store
+        self.history_chars = history_chars
+        self.cache = cache
+        self.coalesce_timeout = coalesce_timeout
+        self.system_prompt = system_prompt
+
+    def prompt(self, history, message):
+        """Messages sent to the model: system prompt, recent history and the new message."""
+        history = list(history)
+        # Drop the oldest messages until the context fits the budget
+        while history and sum(len(item['content']) for item in history) > self.history_chars:
+            history.pop(0)
+        return [{'role': 'system', 'content': self.system_prompt}, *history, {'role': 'user', 'content': message}]
+
+    def stream_answer(self, chat_id, message):
+        """Yield the answer piece by piece; the exchange is remembered once it ends.
+
+        If the caller stops early (the visitor pressed stop or left) the
+        partial answer is what gets remembered.
+        """
+        pieces = []
+        try:
+            for piece in self._answer(self.store.history(chat_id), message):
+                pieces.append(piece)
+                yield piece
+        finally:
+            if pieces:
+                self.store.append(
+                    chat_id,
+                    {'role': 'user', 'content': message},
+                    {'role': 'assistant', 'content': ''.join(pieces)}
+                )
+
+    def answer(self, chat_id, message):
+        return ''.join(self.stream_answer(chat_id, message))
+
+    def _answer(self, history, message):
+        if self.cache is None or history:
+            yield from self.backend.stream(self.prompt(history, message))
+            return
+
+        answer = self.cache.get(message)
+        event = None
+        if answer is None:
+            event = self.cache.claim(message)
+            if event is not None:
+                answer = self.cache.wait(message, event, self.coalesce_timeout)
+        if answer is not None:
+            yield answer
+            return
+
+        # Only complete answers are cached; a claim is released either way
+        pieces, complete = [], False
+        try:
+            for piece in self.backend.stream(self.prompt(history, message)):
+                pieces.append(piece)
+                yield piece
+            complete = True
+        finally:
+            if complete and pieces:
+                self.cache.put(message, ''.join(pieces))
+            if event is None:
+                self.cache.release(message)
+
+
+def create_backend(config):
+    if config['CHAT_BACKEND'] == 'stub':
+        return StubChatBackend()
+    if config['CHAT_BACKEND'] == 'together':
+        return TogetherChatBackend(
+            config['CHAT_API_BASE'], config['TOGETHER_API_KEY'], config['CHAT_MODEL'],
+            get_outbound_client(), config['CHAT_OPTIONS']
+        )
+    raise ValueError(f"Unknown chat backend: {config['CHAT_BACKEND']}")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_chat_service():
+    """Return the process-wide chat service, configured from the current app."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            config = current_app.config
+            _service = ChatService(
+                backend=create_backend(config),
+                store=ConversationStore(
+                    max_messages=config['CHAT_HISTORY_MESSAGES'],
+                    max_conversations=config['CHAT_MAX_CONVERSATIONS'],
+                    ttl=config['CHAT_CONVERSATION_TTL']
+                ),
+                history_chars=config['CHAT_HISTORY_CHARS'],
+                cache=AnswerCache(
+                    max_entries=config['CHAT_CACHE_MAX_ENTRIES'],
+                    ttl=config['CHAT_CACHE_TTL'],
+                    similarity=config['CHAT_CACHE_SIMILARITY']
+                ) if config['CHAT_CACHE_MAX_ENTRIES'] else None
+            )
+        return _service
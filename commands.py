@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import Track, MediaBlob
+from images import ArtworkThumbnailService, MISSING_ARTWORK
+from waveforms import WaveformPeaksService
+from storage import BlobStore
+from schema import upgrade_schema
+from utils import probe_audio
+from services import SEPARATION_SCRIPT, separation_args
+from database import REPLICA, is_file_sqlite, check_pragmas
+
+
+@click.command('backfill-thumbnails')
+@click.option('--force', is_flag=True, help='Regenerate thumbnails that already exist.')
+@with_appcontext
+def backfill_thumbnails(force):
+    """Generate artwork thumbnails for every existing track."""
+    service = ArtworkThumbnailService(
+        upload_folder=current_app.config['UPLOAD_FOLDER'],
+        thumbnail_folder=current_app.config['THUMBNAIL_FOLDER'],
+        widths=current_app.config['THUMBNAIL_WIDTHS'],
+        formats=current_app.config['THUMBNAIL_FORMATS']
+    )
+    click.echo(f"Formats: {', '.join(service.formats)} | Widths: {service.widths}")
+
+    filenames = set()
+    for track in Track.query.all():
+        filenames.update([track.artwork, track.artwork_secondary])
+
+    total = 0
+    for filename in sorted(name for name in filenames if service.source_path(name)):
+        written = service.generate(filename, force=force)
+        total += len(written)
+        click.echo(f"{filename}: {len(written)} thumbnails written")
+
+    click.echo(f"Done, {total} thumbnails written")
+
+
+@click.command('backfill-peaks')
+@click.option('--force', is_flag=True, help='Regenerate peaks that already exist.')
+@with_appcontext
+def backfill_peaks(force):
+    """Precompute waveform peaks for every existing track."""
+    service = WaveformPeaksService(
+        upload_folder=current_app.config['UPLOAD_FOLDER'],
+        peaks_folder=current_app.config['PEAKS_FOLDER'],
+        resolutions=current_app.config['PEAKS_RESOLUTIONS'],
+        sample_rate=current_app.config['PEAKS_SAMPLE_RATE'],
+        bits=current_app.config['PEAKS_BITS']
+    )
+    click.echo(f"Resolutions: {service.resolutions} samples per pixel")
+
+    total = failed = 0
+    for filename in sorted({track.file for track in Track.query.all() if track.file}):
+        try:
+            written = service.generate(filename, force=force)
+        except Exception as e:
+            failed += 1
+            click.echo(f"{filename}: failed ({str(e).strip()})")
+            continue
+        total += bool(written)
+        click.echo(f"{filename}: {'generated' if written else 'up to date'}")
+
+    click.echo(f"Done, peaks generated for {total} files, {failed} failed")
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db():
+    """Create missing tables and columns in the configured database."""
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(f"Added {change}")
+    click.echo(f"Done, {len(changes)} columns added")
+
+
+@click.command('check-database')
+@with_appcontext
+def check_database():
+    """Show each database engine's pool and check the SQLite tuning and replica routing took effect."""
+    problems = 0
+    # Primary first
+    for key, engine in sorted(db.engines.items(), key=lambda item: item[0] is not None):
+        pool = engine.pool
+        size = f"pool of {pool.size()} + {pool._max_overflow} overflow" if hasattr(pool, 'size') else type(pool).__name__
+        click.echo(f"{key or 'primary'}: {engine.url.render_as_string(hide_password=True)} ({engine.dialect.name}, {size})")
+        started = time.perf_counter()
+        with engine.connect() as connection:
+            connection.exec_driver_sql('SELECT 1')
+            click.echo(f"  connected and queried in {(time.perf_counter() - started) * 1000:.1f} ms")
+            if is_file_sqlite(engine.url):
+                for name, value, expected in check_pragmas(connection, current_app.config):
+                    problems += value != expected
+                    click.echo(f"  {name} = {value}" + ('' if value == expected else f"  MISMATCH, expected {expected}"))
+
+    # Fresh sessions, as the command's own is bound to its app context
+    for method, expected in (('GET', REPLICA if REPLICA in db.engines else None), ('POST', None)):
+        with current_app.test_request_context('/', method=method):
+            session = db.session.session_factory()
+            try:
+                bind = session.get_bind(mapper=Track)
+            finally:
+                session.close()
+        routed = next(key for key, engine in db.engines.items() if engine is bind)
+        problems += routed != expected
+        click.echo(f"{method} requests read from {routed or 'primary'}" + ('' if routed == expected else f"  MISMATCH, expected {expected or 'primary'}"))
+
+    if problems:
+        raise click.ClickException(f"{problems} setting{'s' if problems > 1 else ''} did not take effect")
+    click.echo("Database configuration OK")
+
+
+@click.command('migrate-blobs')
+@with_appcontext
+def migrate_blobs():
+    """Move existing track uploads into the content-addressed blob store."""
+    upgrade_schema()
+    store = BlobStore(current_app.config['UPLOAD_FOLDER'])
+    thumbnail_service = ArtworkThumbnailService(
+        upload_folder=current_app.config['UPLOAD_FOLDER'],
+        thumbnail_folder=current_app.config['THUMBNAIL_FOLDER'],
+        widths=current_app.config['THUMBNAIL_WIDTHS'],
+        formats=current_app.config['THUMBNAIL_FORMATS']
+    )
+
+    blob_names = {blob.filename for blob in MediaBlob.query.all()}
+    migrated = {}  # Legacy filename -> blob filename, for files shared by tracks
+    for track in Track.query.all():
+        for column in ('file', 'artwork', 'artwork_secondary'):
+            filename = getattr(track, column)
+            if not filename or filename in MISSING_ARTWORK or filename in blob_names:
+                continue
+
+            if filename in migrated:
+                store.retain(migrated[filename])
+                setattr(track, column, migrated[filename])
+                continue
+
+            file_path = store.path(filename)
+            if not os.path.isfile(file_path):
+                click.echo(f"Missing file for track {track.id}: {filename}")
+                continue
+
+            thumbnail_service.remove(filename)
+            migrated[filename] = store.put_path(file_path)
+            setattr(track, column, migrated[filename])
+            click.echo(f"{filename} -> {migrated[filename]}")
+
+    db.session.commit()
+    total = MediaBlob.query.count()
+    click.echo(f"Done, {len(migrated)} files migrated into {total} blobs")
+
+
+@click.command('benchmark-separation')
+@click.argument('audio_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--preset', 'presets', multiple=True, help='Preset to time (repeatable, default all).')
+@click.option('--two-stems', is_flag=True, help='Time vocals/instrumental separation instead of four stems.')
+@click.option('--repeat', default=1, show_default=True, help='Runs per preset; the fastest is reported.')
+@with_appcontext
+def benchmark_separation(audio_file, presets, two_stems, repeat):
+    """Time stem separation of AUDIO_FILE with each preset."""
+    all_presets = current_app.config['SEPARATION_PRESETS']
+    presets = presets or list(all_presets)
+    unknown = [name for name in presets if name not in all_presets]
+    if unknown:
+        raise click.BadParameter(f"Unknown presets: {', '.join(unknown)}", param_hint='--preset')
+
+    info = probe_audio(audio_file)
+    if info is None:
+        raise click.ClickException(f"Not a readable audio file: {audio_file}")
+    click.echo(f"{os.path.basename(audio_file)}: {info['duration']:.1f}s, "
+               f"{current_app.config['SEPARATION_WORKERS']} workers x {current_app.config['SEPARATION_THREADS']} threads")
+
+    for name in presets:
+        options = dict(
+            all_presets[name],
+            workers=current_app.config['SEPARATION_WORKERS'],
+            threads=current_app.config['SEPARATION_THREADS'],
+            window=current_app.config['SEPARATION_WINDOW'],
+            overlap=current_app.config['SEPARATION_OVERLAP'],
+            in_memory=current_app.config['SEPARATION_IN_MEMORY'],
+            two_stems='vocals' if two_stems else None
+        )
+        timings = []
+        for _ in range(repeat):
+            # Run the engine exactly as separation jobs do, model loading included
+            with tempfile.TemporaryDirectory(prefix='separation-benchmark-') as output_dir:
+                started = time.perf_counter()
+                process = subprocess.run(
+                    [sys.executable, SEPARATION_SCRIPT, audio_file, '--out', output_dir, *separation_args(options)],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE
+                )
+                elapsed = time.perf_counter() - started
+            if process.returncode != 0:
+                raise click.ClickException(f"{name} failed: {process.stderr.decode('utf-8', errors='replace')[-500:]}")
+            timings.append(elapsed)
+
+        best = min(timings)
+        click.echo(f"{name:<10} {options['model']:<12} {best:8.1f}s  {info['duration'] / best:5.2f}x realtime")
+
+
+# Run in a fresh interpreter: imports the modules given on the command line
+# and reports the time taken, the resident memory and which heavy libraries
+# ended up loaded; with --fork it also reports how much memory a process
+# forked afterwards (like a worker from the fork server) holds privately
+STARTUP_PROBE = """
+import os, sys, json, time
+
+def memory(pid='self'):
+    sizes = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                sizes[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return sizes.get('Rss', 0.0), sizes.get('Private_Clean', 0.0) + sizes.get('Private_Dirty', 0.0)
+
+fork = sys.argv[1] == 'fork'
+started = time.perf_counter()
+for name in sys.argv[2:]:
+    __import__(name)
+result = {'seconds': time.perf_counter() - started, 'rss': memory()[0]}
+result['heavy'] = sorted(name for name in ('torch', 'demucs', 'librosa', 'numba', 'scipy', 'yt_dlp', 'together')
+                         if name in sys.modules)
+if fork:
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_end, json.dumps(memory()).encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    result['forked_rss'], result['forked_private'] = json.loads(os.read(read_end, 4096))
+print(json.dumps(result))
+"""
+
+
+@click.command('benchmark-startup')
+@click.option('--repeat', default=3, show_default=True, help='Fresh interpreters per tier; the fastest is reported.')
+@with_appcontext
+def benchmark_startup(repeat):
+    """Compare import time and memory of a web worker and a preloaded analysis worker."""
+    tiers = [
+        ('web', 'nofork', ['app']),
+        ('worker', 'fork', current_app.config['WORKER_PRELOAD']),
+    ]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [current_app.root_path, os.environ.get('PYTHONPATH')])))
+
+    for name, fork, modules in tiers:
+        runs = []
+        for _ in range(repeat):
+            process = subprocess.run(
+                [sys.executable, '-c', STARTUP_PROBE, fork, *modules],
+                cwd=current_app.root_path, env=env, capture_output=True, text=True
+            )
+            if process.returncode != 0:
+                raise click.ClickException(f"{name} tier failed to import: {process.stderr[-500:]}")
+            runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+        best = min(runs, key=lambda run: run['seconds'])
+        click.echo(f"{name:<7} import {best['seconds']:6.2f}s  RSS {best['rss']:7.1f} MB  "
+                   f"heavy modules: {', '.join(best['heavy']) or 'none'}")
+        if 'forked_private' in best:
+            click.echo(f"{'':<7} forked worker RSS {best['forked_rss']:7.1f} MB, "
+                       f"{best['forked_private']:.1f} MB private (the rest shared copy-on-write)")
+
+
+# List of all CLI commands
+all_commands = [upgrade_db, check_database, backfill_thumbnails, backfill_peaks, migrate_blobs, benchmark_separation, benchmark_startup]
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    for command in all_commands:
+        app.cli.add_command(command)
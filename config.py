@@ -10,14 +10,86 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite:///music.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Database tuning: each worker process pools a connection per gunicorn
+    # thread (`--threads`) plus DATABASE_MAX_OVERFLOW for background work.
+    # SQLite connections get SQLITE_PRAGMAS and wait DATABASE_BUSY_TIMEOUT
+    # seconds for a locked database; DATABASE_REPLICA_URI (e.g. a PostgreSQL
+    # standby) serves the reads of GET requests. `flask check-database`
+    # shows what took effect
+    DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '16'))
+    DATABASE_MAX_OVERFLOW = 8
+    DATABASE_POOL_RECYCLE = 1800  # Seconds, for server databases closing idle connections
+    DATABASE_BUSY_TIMEOUT = 15
+    DATABASE_REPLICA_URI = os.getenv('DATABASE_REPLICA_URI')
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # Readers no longer wait for writers
+        'synchronous': 'NORMAL',  # Durable at checkpoints; safe from corruption in WAL mode
+        'cache_size': -8000,  # KiB of page cache per connection
+        'mmap_size': 128 * 1024 ** 2,
+        'temp_store': 'MEMORY',
+    }
+    
     # File upload settings
     UPLOAD_FOLDER = 'static/uploads'
     CONVERTED_FOLDER = 'static/converted'
     YOUTUBE_FOLDER = 'static/youtube'
+    THUMBNAIL_FOLDER = 'static/uploads/thumbnails'
+    RENDITION_FOLDER = 'static/uploads/renditions'
+    PEAKS_FOLDER = 'static/uploads/peaks'
+    PCM_CACHE_FOLDER = 'cache/pcm'
+    METRICS_FOLDER = 'cache/metrics'
+    PROFILE_FOLDER = 'cache/profiles'
+    
+    # Ingest pipeline settings (stages run in order after an admin upload)
+    INGEST_STAGES = ['validate', 'normalize', 'peaks', 'features', 'thumbnails']
+    INGEST_MAX_ATTEMPTS = 3
+    INGEST_RETRY_DELAY = 5  # Seconds, doubled after each failed attempt
+    
+    # Artwork thumbnail settings
+    THUMBNAIL_WIDTHS = [96, 192, 384, 768]
+    THUMBNAIL_FORMATS = ['avif', 'webp', 'jpeg']  # Preferred order, unsupported ones are skipped
+    THUMBNAIL_CACHE_MAX_AGE = 31536000  # 1 year, thumbnail URLs are versioned
+    
+    # Loudness settings (EBU R128)
+    LOUDNESS_TARGET = -14.0  # LUFS, used for replay gain and converter normalization
+    LOUDNESS_TRUE_PEAK_CEILING = -1.0  # dBTP, replay gain never boosts peaks above this
+    
+    # Waveform peaks settings
+    PEAKS_RESOLUTIONS = [256, 512, 1024, 2048, 4096]  # Samples per pixel, multiples of the first
+    PEAKS_SAMPLE_RATE = 44100
+    PEAKS_BITS = 8  # 8 or 16 bits per min/max value
+    PEAKS_CACHE_MAX_AGE = 86400  # Revalidated by ETag afterwards
     
     # API keys
     TOGETHER_API_KEY = os.getenv('TOGETHER_API_KEY')
     
+    # Guides chatbot
+    CHAT_BACKEND = os.getenv('CHAT_BACKEND', 'together')  # 'stub' answers locally without an API key
+    CHAT_API_BASE = os.getenv('CHAT_API_BASE', 'https://api.together.xyz/v1')  # Point at a mock server for testing
+    CHAT_MODEL = 'meta-llama/Llama-3.3-70B-Instruct-Turbo'
+    CHAT_OPTIONS = {'temperature': 0.7, 'top_p': 0.7, 'top_k': 50, 'repetition_penalty': 1}
+    CHAT_HISTORY_MESSAGES = 12  # Earlier messages remembered per conversation
+    CHAT_HISTORY_CHARS = 6000  # Oldest messages are left out of the prompt past this
+    CHAT_MAX_CONVERSATIONS = 1000  # Least recently used conversations are forgotten past this
+    CHAT_CONVERSATION_TTL = 3600  # Seconds an idle conversation is remembered
+    CHAT_CACHE_MAX_ENTRIES = 500  # Answers to opening questions kept for reuse (0 disables the cache)
+    CHAT_CACHE_TTL = 86400  # Seconds a cached answer is reused
+    CHAT_CACHE_SIMILARITY = 0.8  # TF-IDF cosine similarity from which a cached question counts as the same
+    
+    # Outbound calls (chat API, YouTube): keep-alive pool, timeouts and
+    # retries, plus per-host concurrency, rate limits (token bucket of
+    # `rate` calls per second in bursts of `burst`) and a circuit breaker
+    # that fails fast for `reset_after` seconds after `failures` in a row
+    OUTBOUND_POOL_SIZE = 20  # Keep-alive connections per host
+    OUTBOUND_TIMEOUT = (5, 60)  # Connect and read timeouts in seconds
+    OUTBOUND_RETRIES = 3
+    OUTBOUND_BACKOFF = 0.5  # Seconds, doubled per retry, randomized (full jitter)
+    OUTBOUND_DEFAULT_HOST = {'concurrency': 8, 'rate': 10, 'burst': 20, 'failures': 5, 'reset_after': 30}
+    OUTBOUND_HOSTS = {
+        'api.together.xyz': {'concurrency': 16, 'rate': 5, 'burst': 10},
+        'youtube': {'concurrency': 4, 'rate': 2, 'burst': 5},  # All yt-dlp lookups and downloads
+    }
+    
     # YouTube downloader configuration
     YDL_OPTS_BASE = {
         'format': 'bestaudio/best',
@@ -31,6 +103,91 @@ class Config:
         ],
         'prefer_ffmpeg': True,
     }
+    YDL_POOL_SIZE = 4  # Reused YoutubeDL instances
+    YDL_POOL_WAIT = 10  # Seconds a video lookup waits for a free instance before a 503
+    
+    # Background job settings (YouTube downloads and conversions)
+    JOB_CONCURRENCY = {'youtube': 4, 'convert': 4, 'analyze': 2, 'separate': 1}  # Jobs of each kind running at once
+    JOB_MAX_PENDING = 200  # Queued jobs per kind before new ones are refused with 503
+    JOB_RESULT_TTL = 600  # Seconds a finished job's result stays available
+    JOB_BLOCKING_WORKERS = 8  # Threads for blocking library calls such as yt-dlp
+    JOB_DIRECTORY_DB = 'instance/jobs.db'  # Job states shared by the worker processes, so any of them can answer /jobs/<id>
+    JOB_DIRECTORY_PROGRESS_INTERVAL = 1  # Seconds between shared progress updates; state and stage changes go out at once
+    
+    # Logging: LOG_LEVEL for everything, LOG_LEVELS per module (e.g.
+    # LOG_LEVELS = {'utils': 'DEBUG'}), written as 'text' or 'json' lines by
+    # a background thread; DEBUG lines are thinned to one in
+    # LOG_DEBUG_SAMPLE_EVERY per line of code
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = {'numba': 'WARNING'}  # numba's DEBUG output is bytecode dumps
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_DEBUG_SAMPLE_EVERY = 10
+    
+    # Profiling: admins get a cProfile/tracemalloc profile of a request, and
+    # of the analysis, conversion or separation it starts, by sending
+    # `X-Profile: 1`; PROFILING_ENABLED profiles every request to
+    # PROFILING_ENDPOINTS. Listed at /admin/profiles
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+    PROFILING_ENDPOINTS = ['audio.analyze_audio', 'audio.converter', 'audio.stem_separator', 'convert_video']
+    PROFILE_MAX_REQUESTS = 100  # Profiles of older requests are deleted
+    
+    # Metrics: every process writes its values to METRICS_FOLDER this often,
+    # and /metrics merges them (bearer token required if METRICS_TOKEN is set)
+    METRICS_FLUSH_INTERVAL = 5
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
+    # Admission control for the heavy tools, shared by all worker processes
+    # through a SQLite file. Per tool: requests queued or running at once
+    # (`queue`, of which `admin_reserve` only admins may use), per IP and
+    # per browser session, a per-IP rate (`per_minute` in bursts of
+    # `burst`) and the typical job length used to suggest Retry-After
+    ADMISSION_DB = 'instance/admission.db'
+    # Reverse proxies in front of the app whose X-Forwarded-For/-Proto/-Host
+    # headers are trusted; without this, every client behind a proxy shares
+    # the proxy's address and so one per-IP quota
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
+    ADMISSION_LIMITS = {
+        'separate': {'queue': 6, 'admin_reserve': 2, 'per_ip': 2, 'per_session': 1, 'per_minute': 4, 'burst': 4, 'seconds': 120},
+        'analyze': {'queue': 20, 'admin_reserve': 4, 'per_ip': 4, 'per_session': 2, 'per_minute': 20, 'burst': 10, 'seconds': 20},
+        'convert': {'queue': 20, 'admin_reserve': 4, 'per_ip': 4, 'per_session': 2, 'per_minute': 20, 'burst': 10, 'seconds': 15},
+        'youtube': {'queue': 20, 'admin_reserve': 4, 'per_ip': 6, 'per_session': 4, 'per_minute': 30, 'burst': 10, 'seconds': 30},
+        'mix': {'queue': 8, 'admin_reserve': 2, 'per_ip': 2, 'per_session': 2, 'per_minute': 30, 'burst': 10, 'seconds': 10},
+    }
+    
+    # CPU-heavy analysis runs in worker processes forked from a server that
+    # imported these modules once; web requests never import them
+    WORKER_PROCESSES = 2
+    WORKER_PRELOAD = ['numpy', 'scipy.signal', 'librosa', 'utils', 'loudness']
+    
+    # Decoded audio shared by the analyzer, converter, separator and remixer
+    PCM_CACHE_MAX_BYTES = 2 * 1024 ** 3  # Least recently used entries are evicted past this
+    
+    # Stem separation: typical tracks are separated in memory in one pass;
+    # long ones are split into windows that a pool of worker processes
+    # separates in parallel, then cross-faded back together
+    SEPARATION_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # Worker processes per separation
+    SEPARATION_THREADS = 2  # Torch threads per worker
+    SEPARATION_WINDOW = 60  # Seconds of audio per window
+    SEPARATION_OVERLAP = 2  # Seconds of cross-fade between windows
+    SEPARATION_IN_MEMORY = 360  # Tracks up to this many seconds are separated in one in-memory pass
+    
+    # Quality/speed presets: demucs model, random shifts averaged (0 = none),
+    # overlap between demucs segments, segment length in seconds and output format
+    SEPARATION_PRESETS = {
+        'fast': {
+            'description': 'Quickest results, fine for previews',
+            'model': 'htdemucs', 'shifts': 0, 'split_overlap': 0.1, 'segment': 7, 'format': 'mp3'
+        },
+        'balanced': {
+            'description': 'Good quality at a reasonable speed',
+            'model': 'htdemucs', 'shifts': 1, 'split_overlap': 0.25, 'segment': 7, 'format': 'mp3'
+        },
+        'best': {
+            'description': 'Fine-tuned models and lossless stems, several times slower',
+            'model': 'htdemucs_ft', 'shifts': 2, 'split_overlap': 0.25, 'segment': 7, 'format': 'flac'
+        },
+    }
+    SEPARATION_DEFAULT_PRESET = 'balanced'
     
     # Session settings
     SESSION_TIMEOUT = 300  # 5 minutes in seconds
@@ -42,6 +199,10 @@ class Config:
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(Config.CONVERTED_FOLDER, exist_ok=True)
         os.makedirs(Config.YOUTUBE_FOLDER, exist_ok=True)
+        os.makedirs(Config.THUMBNAIL_FOLDER, exist_ok=True)
+        os.makedirs(Config.RENDITION_FOLDER, exist_ok=True)
+        os.makedirs(Config.PEAKS_FOLDER, exist_ok=True)
+        os.makedirs(Config.PCM_CACHE_FOLDER, exist_ok=True)
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,115 @@
+import logging
+from functools import partial
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+# Bind key of the read replica's engine
+REPLICA = 'replica'
+
+# What SQLite reports back for pragmas set by name
+SYNCHRONOUS = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+TEMP_STORE = {'DEFAULT': 0, 'FILE': 1, 'MEMORY': 2}
+
+
+class RoutingSession(Session):
+    """Session sending the reads of GET and HEAD requests to the replica, if one is configured.
+
+    Everything else uses the primary: writes, reads in other requests, CLI
+    commands and background work, and every query after a session's first
+    write, so a request reads its own writes despite replication lag.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        if self.info.get('wrote') or REPLICA not in self._db.engines:
+            return False
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+            return False
+        return has_request_context() and request.method in ('GET', 'HEAD')
+
+
+def is_file_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(uri, config):
+    """SQLAlchemy engine options for a database URI.
+
+    The pool holds a connection per gunicorn thread plus some for
+    background work. SQLite writers wait for the lock instead of failing
+    at once; server databases have stale connections replaced before use.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and not is_file_sqlite(url):
+        return {}  # In-memory databases share a single connection
+    options = {
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW']
+    }
+    if url.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'timeout': config['DATABASE_BUSY_TIMEOUT']}
+    else:
+        options.update(pool_pre_ping=True, pool_recycle=config['DATABASE_POOL_RECYCLE'])
+    return options
+
+
+def set_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def expected_pragmas(config):
+    """Values SQLite should report for the tuned pragmas, by name."""
+    expected = {'busy_timeout': int(config['DATABASE_BUSY_TIMEOUT'] * 1000)}
+    for name, value in config['SQLITE_PRAGMAS'].items():
+        if name == 'synchronous':
+            value = SYNCHRONOUS.get(str(value).upper(), value)
+        elif name == 'temp_store':
+            value = TEMP_STORE.get(str(value).upper(), value)
+        elif isinstance(value, str):
+            value = value.lower()
+        expected[name] = value
+    return expected
+
+
+def check_pragmas(connection, config):
+    """(pragma, value, expected value) of every tuned pragma on a SQLite connection."""
+    return [
+        (name, connection.exec_driver_sql(f"PRAGMA {name}").scalar(), expected)
+        for name, expected in expected_pragmas(config).items()
+    ]
+
+
+def init_app(app):
+    """Configure the engines, with the replica if DATABASE_REPLICA_URI is set, and tune SQLite connections."""
+    from extensions import db
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+        engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    )
+    replica = app.config.get('DATABASE_REPLICA_URI')
+    if replica:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA] = dict(engine_options(replica, app.config), url=replica)
+    db.init_app(app)
+
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if is_file_sqlite(engine.url):
+                event.listen(engine, 'connect', partial(set_pragmas, app.config['SQLITE_PRAGMAS']))
+            logger.debug("Database %s: %s", key or 'primary', engine.url.render_as_string(hide_password=True))
@@ -0,0 +1,63 @@
+import json
+import threading
+from collections import deque
+
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event with a JSON payload."""
+    prefix = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventChannel:
+    """In-process publish/subscribe channel with a replayable history.
+
+    Every event gets an increasing id, so a subscriber that disconnects
+    can come back with the last id it saw and receive only what it
+    missed. Subscribers block on a condition variable rather than
+    polling, and the channel is closed once its final event is out.
+    """
+
+    def __init__(self, history=500):
+        self._events = deque(maxlen=history)
+        self._condition = threading.Condition()
+        self._last_id = 0
+        self.closed = False
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event, data, close=False):
+        """Append an event and wake every waiting subscriber."""
+        with self._condition:
+            if self.closed:
+                return
+            self._last_id += 1
+            self._events.append({'id': self._last_id, 'event': event, 'data': data})
+            if close:
+                self.closed = True
+            self._condition.notify_all()
+
+    def since(self, last_id, timeout=None):
+        """Events newer than ``last_id``, waiting up to ``timeout`` seconds for one."""
+        with self._condition:
+            if self._last_id <= last_id and not self.closed:
+                self._condition.wait(timeout)
+            return [event for event in self._events if event['id'] > last_id]
+
+    def stream(self, last_id=0, keepalive=15):
+        """Yield Server-Sent Events text until the channel is closed and drained."""
+        yield 'retry: 2000\n\n'
+        while True:
+            events = self.since(last_id, timeout=keepalive)
+            if not events:
+                if self.closed:
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                last_id = event['id']
+                yield sse_event(event['event'], event['data'], event['id'])
+            if self.closed and last_id >= self._last_id:
+                return
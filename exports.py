@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, request
+
+CHUNK_SIZE = 256 * 1024  # 256 KB
+
+# Zip format constants (stored entries only, see PKWARE APPNOTE.TXT)
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+DATA_DESCRIPTOR = struct.Struct('<IIII')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP64_OFFSET_EXTRA = struct.Struct('<HHQ')
+ZIP64_END = struct.Struct('<IQHHIIQQQQ')
+ZIP64_LOCATOR = struct.Struct('<IIQI')
+END_RECORD = struct.Struct('<IHHHHIIH')
+
+FLAGS = 0x0808  # Data descriptor follows the data, names are UTF-8
+ZIP32_LIMIT = 0xFFFFFFFF
+
+# CRCs are needed again for the central directory and for resumed
+# downloads, so remember them per (path, size, mtime); the least
+# recently used are forgotten past CRC_CACHE_ENTRIES
+CRC_CACHE_ENTRIES = 4096
+_crc_cache = OrderedDict()
+_crc_lock = threading.Lock()
+
+
+def _cached_crc(key):
+    with _crc_lock:
+        crc = _crc_cache.get(key)
+        if crc is not None:
+            _crc_cache.move_to_end(key)
+        return crc
+
+
+def _dos_datetime(timestamp):
+    """Convert a POSIX timestamp to zip's DOS (date, time) fields."""
+    t = time.localtime(max(timestamp, 315532800))  # Zip dates start in 1980
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_date, dos_time
+
+
+class ZipEntry:
+    """A single stored (uncompressed) member of a streamed zip."""
+
+    def __init__(self, arcname, path=None, data=None, mtime=None):
+        self.arcname = arcname
+        self.name_bytes = arcname.encode('utf-8')
+        self.path = path
+        self.data = data
+        if path is not None:
+            stat = os.stat(path)
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime if mtime is None else mtime
+            self.cache_key = (path, stat.st_size, stat.st_mtime_ns)
+        else:
+            self.size = len(data)
+            self.mtime = time.time() if mtime is None else mtime
+            self.cache_key = None
+        self.offset = 0  # Offset of the local header, set by ZipStream
+        self._crc = None
+
+    @property
+    def crc(self):
+        """CRC-32 of the entry's data, computed by reading it if not yet known."""
+        if self._crc is None:
+            cached = _cached_crc(self.cache_key) if self.cache_key else None
+            if cached is None:
+                cached = 0
+                for chunk in self.read(0, self.size):
+                    cached = zlib.crc32(chunk, cached)
+                self._remember_crc(cached)
+            self._crc = cached
+        return self._crc
+
+    def read(self, start, end):
+        """Yield the entry's data between two offsets."""
+        if self.data is not None:
+            yield self.data[start:end]
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError(f"{self.path} shrank while being exported")
+                remaining -= len(chunk)
+                yield chunk
+
+    def local_header(self):
+        dos_date, dos_time = _dos_datetime(self.mtime)
+        return LOCAL_HEADER.pack(
+            0x04034b50, 20, FLAGS, 0, dos_time, dos_date,
+            0, 0, 0,  # CRC and sizes are in the data descriptor
+            len(self.name_bytes), 0
+        ) + self.name_bytes
+
+    def data_descriptor(self):
+        return DATA_DESCRIPTOR.pack(0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self):
+        dos_date, dos_time = _dos_datetime(self.mtime)
+        extra = b''
+        offset = self.offset
+        if offset >= ZIP32_LIMIT:
+            extra = ZIP64_OFFSET_EXTRA.pack(0x0001, 8, offset)
+            offset = ZIP32_LIMIT
+        return CENTRAL_HEADER.pack(
+            0x02014b50, 45 if extra else 20, 45 if extra else 20, FLAGS, 0,
+            dos_time, dos_date, self.crc, self.size, self.size,
+            len(self.name_bytes), len(extra), 0, 0, 0,
+            0o100644 << 16, offset
+        ) + self.name_bytes + extra
+
+    def _remember_crc(self, crc):
+        self._crc = crc
+        if self.cache_key:
+            with _crc_lock:
+                _crc_cache[self.cache_key] = crc
+                _crc_cache.move_to_end(self.cache_key)
+                while len(_crc_cache) > CRC_CACHE_ENTRIES:
+                    _crc_cache.popitem(last=False)
+
+    def header_size(self):
+        return LOCAL_HEADER.size + len(self.name_bytes)
+
+    def central_size(self):
+        extra = ZIP64_OFFSET_EXTRA.size if self.offset >= ZIP32_LIMIT else 0
+        return CENTRAL_HEADER.size + len(self.name_bytes) + extra
+
+
+class ZipStream:
+    """A zip archive of stored entries that is generated on the fly.
+
+    Entries are never compressed, so the archive layout and total size are
+    known before any data is read. That allows a Content-Length up front and
+    serving arbitrary byte ranges (resumed downloads) without building the
+    archive: only the requested part is produced, with constant memory.
+    Individual entries must be smaller than 4 GB; the archive itself may be
+    larger (ZIP64 end records and offsets are written when needed).
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._segments = []
+        self._layout()
+
+    @property
+    def etag(self):
+        """Validator that changes whenever any member changes."""
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(entry.name_bytes)
+            if entry.cache_key:
+                digest.update(repr(entry.cache_key).encode('utf-8'))
+            else:
+                digest.update(entry.data)
+        return digest.hexdigest()
+
+    def iter_range(self, start=0, end=None):
+        """Yield the archive bytes in [start, end)."""
+        end = self.size if end is None else min(end, self.size)
+        for seg_start, seg_length, producer in self._segments:
+            seg_end = seg_start + seg_length
+            if seg_end <= start or seg_start >= end:
+                continue
+            lo = max(start, seg_start) - seg_start
+            hi = min(end, seg_end) - seg_start
+            for chunk in producer(lo, hi):
+                if chunk:
+                    yield chunk
+
+    def _layout(self):
+        """Assign offsets to every entry and build the list of byte segments."""
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset = self._add(offset, entry.header_size(), self._static(entry.local_header))
+            offset = self._add(offset, entry.size, self._data(entry))
+            offset = self._add(offset, DATA_DESCRIPTOR.size, self._static(entry.data_descriptor))
+
+        self.central_offset = offset
+        self.central_size = sum(entry.central_size() for entry in self.entries)
+        offset = self._add(offset, self.central_size, self._static(self._central_directory))
+
+        end_size = END_RECORD.size
+        if self._needs_zip64():
+            end_size += ZIP64_END.size + ZIP64_LOCATOR.size
+        self.size = self._add(offset, end_size, self._static(self._end_records))
+
+    def _add(self, offset, length, producer):
+        self._segments.append((offset, length, producer))
+        return offset + length
+
+    def _static(self, build):
+        """Producer for small metadata blocks, built only when requested."""
+        def produce(lo, hi):
+            yield build()[lo:hi]
+        return produce
+
+    def _data(self, entry):
+        """Producer for entry data that records the CRC on a full pass."""
+        def produce(lo, hi):
+            if lo != 0 or hi != entry.size or entry._crc is not None:
+                yield from entry.read(lo, hi)
+                return
+            crc = 0
+            for chunk in entry.read(0, entry.size):
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+            entry._remember_crc(crc)
+        return produce
+
+    def _needs_zip64(self):
+        return (len(self.entries) >= 0xFFFF or self.central_offset >= ZIP32_LIMIT
+                or self.central_size >= ZIP32_LIMIT)
+
+    def _central_directory(self):
+        return b''.join(entry.central_header() for entry in self.entries)
+
+    def _end_records(self):
+        count = len(self.entries)
+        records = b''
+        if self._needs_zip64():
+            zip64_end_offset = self.central_offset + self.central_size
+            records += ZIP64_END.pack(
+                0x06064b50, ZIP64_END.size - 12, 45, 45, 0, 0,
+                count, count, self.central_size, self.central_offset
+            )
+            records += ZIP64_LOCATOR.pack(0x07064b50, 0, zip64_end_offset, 1)
+        records += END_RECORD.pack(
+            0x06054b50, 0, 0,
+            min(count, 0xFFFF), min(count, 0xFFFF),
+            min(self.central_size, ZIP32_LIMIT), min(self.central_offset, ZIP32_LIMIT), 0
+        )
+        return records
+
+
+def manifest_entry(manifest, mtime=None):
+    """Build the JSON manifest member of an export."""
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+    return ZipEntry('manifest.json', data=data, mtime=mtime)
+
+
+def zip_response(archive, download_name):
+    """Stream a ZipStream as a download, honouring Range/If-Range requests."""
+    etag = archive.etag
+    start, end, status = 0, archive.size, 200
+
+    # Without If-Range any range is served; with it, only for the same archive
+    byte_range = request.range
+    if_range = request.if_range
+    unconditional = if_range.etag is None and if_range.date is None
+    if byte_range and (unconditional or if_range.etag == etag):
+        span = byte_range.range_for_length(archive.size)
+        if span is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{archive.size}"
+            return response
+        start, end = span
+        status = 206
+
+    response = Response(archive.iter_range(start, end), status=status,
+                        mimetype='application/zip', direct_passthrough=True)
+    response.headers['Content-Length'] = str(end - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Cache-Control'] = 'private, no-transform'
+    response.set_etag(etag)
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{end - 1}/{archive.size}"
+    return response
@@ -0,0 +1,171 @@
+import os
+import hashlib
+import logging
+import threading
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Pillow save arguments for each thumbnail format
+FORMAT_OPTIONS = {
+    'avif': {'format': 'AVIF', 'quality': 50},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+# Placeholder values stored on tracks without artwork
+MISSING_ARTWORK = ("No Artwork", "No Secondary Artwork")
+
+
+def format_supported(fmt):
+    """Check whether the installed Pillow can encode the given format."""
+    if fmt == 'jpeg':
+        return True
+    if fmt == 'webp':
+        return features.check('webp')
+    if fmt == 'avif':
+        # Pillow >= 11.2 ships AVIF (if built with libavif), older versions
+        # need the pillow-avif plugin. Older versions only warn about the
+        # unknown feature and report it missing, so look it up first
+        if 'avif' in features.modules:
+            return features.check_module('avif')
+        try:
+            import pillow_avif  # noqa: F401
+            return True
+        except ImportError:
+            return False
+    return False
+
+
+class ArtworkThumbnailService:
+    """Service for generating and locating resized artwork thumbnails."""
+
+    def __init__(self, upload_folder, thumbnail_folder, widths, formats):
+        self.upload_folder = upload_folder
+        self.thumbnail_folder = thumbnail_folder
+        self.widths = sorted(widths)
+        self.formats = [fmt for fmt in formats if fmt in FORMAT_OPTIONS and format_supported(fmt)]
+
+    def source_path(self, filename):
+        """Return the path of an uploaded artwork file, or None if it is missing."""
+        if not filename or filename in MISSING_ARTWORK:
+            return None
+        path = os.path.join(self.upload_folder, filename)
+        return path if os.path.isfile(path) else None
+
+    def version(self, filename):
+        """Return a short token that changes whenever the source artwork changes."""
+        path = self.source_path(filename)
+        if not path:
+            return None
+        stat = os.stat(path)
+        token = f"{filename}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()[:12]
+
+    def thumbnail_path(self, filename, width, fmt):
+        """Return the on-disk path of a thumbnail."""
+        stem = os.path.splitext(filename)[0]
+        ext = 'jpg' if fmt == 'jpeg' else fmt
+        return os.path.join(self.thumbnail_folder, f"{stem}_{width}w.{ext}")
+
+    def generate(self, filename, force=False):
+        """Generate every configured width/format for an artwork file.
+
+        Existing thumbnails newer than the source are kept, so calling this
+        repeatedly is cheap. Returns the list of thumbnail paths written.
+        """
+        source = self.source_path(filename)
+        if not source:
+            return []
+
+        os.makedirs(self.thumbnail_folder, exist_ok=True)
+        source_mtime = os.path.getmtime(source)
+        written = []
+
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            for width in self.widths:
+                targets = [
+                    (fmt, self.thumbnail_path(filename, width, fmt))
+                    for fmt in self.formats
+                ]
+                targets = [
+                    (fmt, path) for fmt, path in targets
+                    if force or not os.path.exists(path) or os.path.getmtime(path) < source_mtime
+                ]
+                if not targets:
+                    continue
+
+                resized = self._resize(image, width)
+                for fmt, path in targets:
+                    self._save(resized, path, fmt)
+                    written.append(path)
+
+        return written
+
+    def generate_async(self, filenames):
+        """Generate thumbnails for several artwork files in a background thread."""
+        filenames = [name for name in filenames if self.source_path(name)]
+        if not filenames:
+            return None
+
+        def run():
+            for filename in filenames:
+                try:
+                    written = self.generate(filename)
+                    logger.info("Generated %s thumbnails for %s", len(written), filename)
+                except Exception as e:
+                    logger.warning("Thumbnail generation failed for %s: %s", filename, e)
+
+        thumbnail_thread = threading.Thread(target=run)
+        thumbnail_thread.daemon = True
+        thumbnail_thread.start()
+        return thumbnail_thread
+
+    def ensure(self, filename, width, fmt):
+        """Return the path of one thumbnail, generating it on demand if needed."""
+        source = self.source_path(filename)
+        if not source or width not in self.widths or fmt not in self.formats:
+            return None
+
+        path = self.thumbnail_path(filename, width, fmt)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+            os.makedirs(self.thumbnail_folder, exist_ok=True)
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image)
+                self._save(self._resize(image, width), path, fmt)
+        return path
+
+    def remove(self, filename):
+        """Delete every thumbnail generated for an artwork file."""
+        if not filename or filename in MISSING_ARTWORK:
+            return
+        for width in self.widths:
+            for fmt in FORMAT_OPTIONS:
+                path = self.thumbnail_path(filename, width, fmt)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _resize(self, image, width):
+        """Resize an image to the target width, never upscaling."""
+        if image.width <= width:
+            return image.copy()
+        height = max(1, round(image.height * width / image.width))
+        return image.resize((width, height), Image.LANCZOS)
+
+    def _save(self, image, path, fmt):
+        """Save a thumbnail atomically so readers never see a partial file."""
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA')
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, **FORMAT_OPTIONS[fmt])
+        os.replace(tmp_path, path)
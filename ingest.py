@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+from flask import current_app
+from extensions import db
+from models import Track, IngestStageRun
+from tasks import ingest_jobs
+
+logger = logging.getLogger(__name__)
+
+# Registered stages, in no particular order; INGEST_STAGES picks and orders them
+STAGES = {}
+
+# Stages whose failure means the track cannot be published
+REQUIRED_STAGES = set()
+
+
+def stage(name, required=False):
+    """Register an ingest stage.
+
+    A stage receives the track and a ``force`` flag and returns a dict of
+    Track columns to update. Stages must be idempotent: when ``force`` is
+    false they may skip work whose output already exists.
+    """
+    def register(fn):
+        STAGES[name] = fn
+        if required:
+            REQUIRED_STAGES.add(name)
+        return fn
+    return register
+
+
+def upload_path(filename):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+
+@stage('validate', required=True)
+def validate_stage(track, force=False):
+    """Check that the audio decodes and record its duration."""
+    from utils import probe_audio
+    from PIL import Image
+    from routes.media import has_artwork
+
+    info = probe_audio(upload_path(track.file))
+    if not info:
+        raise ValueError(f"{track.file} is not a readable audio file")
+
+    for artwork in (track.artwork, track.artwork_secondary):
+        if has_artwork(artwork):
+            with Image.open(upload_path(artwork)) as image:
+                image.verify()
+
+    return {'duration': info['duration']}
+
+
+@stage('normalize')
+def normalize_stage(track, force=False):
+    """Build the MP3 streaming rendition of the audio file."""
+    from utils import convert_audio
+    from routes.media import rendition_filename
+
+    rendition = rendition_filename(track.file)
+    rendition_path = os.path.join(current_app.config['RENDITION_FOLDER'], rendition)
+    if force or not os.path.exists(rendition_path):
+        if not convert_audio(upload_path(track.file), rendition_path, 'mp3', tool='ingest'):
+            raise RuntimeError("ffmpeg could not build the MP3 rendition")
+    return {'rendition': rendition}
+
+
+@stage('peaks')
+def peaks_stage(track, force=False):
+    """Precompute waveform peaks for the player."""
+    from routes.media import get_peaks_service
+
+    get_peaks_service().generate(track.file, force=force)
+    return {}
+
+
+@stage('features')
+def features_stage(track, force=False):
+    """Detect tempo and key, and measure loudness for replay gain."""
+    from utils import analyze_audio_file
+    from loudness import replay_gain
+    from routes.media import get_pcm_cache
+    from workers import get_worker_pool
+
+    if not force and track.tempo and track.musical_key and track.loudness is not None:
+        return {}
+    # Runs in the worker tier, which already has librosa loaded
+    result = get_worker_pool().submit(analyze_audio_file, upload_path(track.file), pcm_cache=get_pcm_cache()).result()
+    if not result.get('success'):
+        raise RuntimeError(result.get('error', 'Analysis failed'))
+    return {
+        'tempo': result['tempo'],
+        'musical_key': result['key'],
+        'loudness': result['loudness'],
+        'true_peak': result['true_peak'],
+        'replay_gain': replay_gain(
+            result['loudness'], result['true_peak'],
+            current_app.config['LOUDNESS_TARGET'],
+            current_app.config['LOUDNESS_TRUE_PEAK_CEILING']
+        )
+    }
+
+
+@stage('thumbnails')
+def thumbnails_stage(track, force=False):
+    """Generate artwork thumbnails."""
+    from routes.media import get_thumbnail_service
+
+    service = get_thumbnail_service()
+    for artwork in (track.artwork, track.artwork_secondary):
+        service.generate(artwork, force=force)
+    return {}
+
+
+def enqueue(track_id, stages=None, force=False):
+    """Queue the ingest pipeline (or some of its stages) for a track."""
+    ingest_jobs.submit(run_pipeline, track_id, stages, force)
+
+
+def run_pipeline(track_id, stages=None, force=False, start=0, attempt=0):
+    """Run stages for one track, retrying failures with exponential backoff.
+
+    Stages that already completed are skipped unless ``force`` is set or
+    they are named explicitly, so re-queuing a track only redoes the
+    stages that failed. A failed stage is retried by queuing the rest of
+    the pipeline again after the backoff (``start`` is the stage to resume
+    from, ``attempt`` its attempts so far), so the ingest thread carries on
+    with other tracks meanwhile.
+    """
+    explicit = stages is not None
+    names = stages or current_app.config['INGEST_STAGES']
+    max_attempts = current_app.config['INGEST_MAX_ATTEMPTS']
+    retry_delay = current_app.config['INGEST_RETRY_DELAY']
+
+    track = db.session.get(Track, track_id)
+    if track is None:
+        return
+
+    Track.query.filter_by(id=track_id).update({Track.status: 'processing'}, synchronize_session=False)
+    db.session.commit()
+
+    for index in range(start, len(names)):
+        name = names[index]
+        tries = attempt if index == start else 0
+        run = IngestStageRun.query.filter_by(track_id=track_id, stage=name).first()
+        if run is None:
+            run = IngestStageRun(track_id=track_id, stage=name, status='pending', attempts=0)
+            db.session.add(run)
+        elif run.status == 'done' and not (force or explicit):
+            continue
+
+        run.status = 'running'
+        run.attempts = (run.attempts or 0) + 1
+        db.session.commit()
+
+        started = time.perf_counter()
+        try:
+            track = db.session.get(Track, track_id)
+            if track is None:
+                return  # Deleted while processing
+            updates = STAGES[name](track, force=force or explicit)
+            run.duration_ms = (time.perf_counter() - started) * 1000
+            for column, value in (updates or {}).items():
+                setattr(track, column, value)
+            run.status = 'done'
+            run.error = None
+            db.session.commit()
+            logger.info("Ingest stage %s for track %s took %.0f ms", name, track_id, run.duration_ms)
+        except Exception as e:
+            db.session.rollback()
+            run = IngestStageRun.query.filter_by(track_id=track_id, stage=name).first()
+            run.duration_ms = (time.perf_counter() - started) * 1000
+            run.status = 'failed'
+            run.error = str(e)[:500]
+            db.session.commit()
+            logger.exception("Ingest stage %s for track %s failed (attempt %s)", name, track_id, tries + 1)
+            if tries + 1 < max_attempts:
+                ingest_jobs.submit_later(retry_delay * (2 ** tries), run_pipeline, track_id, stages, force, index, tries + 1)
+                return
+            if name in REQUIRED_STAGES:
+                break
+
+    # A track is only published once every required stage has passed
+    failed_required = IngestStageRun.query.filter(
+        IngestStageRun.track_id == track_id,
+        IngestStageRun.stage.in_(REQUIRED_STAGES),
+        IngestStageRun.status == 'failed'
+    ).count()
+    Track.query.filter_by(id=track_id).update(
+        {Track.status: 'failed' if failed_required else 'ready'},
+        synchronize_session=False
+    )
+    db.session.commit()
@@ -0,0 +1,544 @@
+import os
+import re
+import time
+import json
+import uuid
+import signal
+import socket
+import sqlite3
+import asyncio
+import contextvars
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from events import EventChannel, sse_event
+from workers import get_worker_pool
+from admission import take_lease
+from metrics import is_alive
+import metrics
+import logs
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    snapshot TEXT NOT NULL,
+    finished INTEGER NOT NULL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (host, pid, cancel);
+"""
+
+# Lines of a subprocess's stdout kept for its caller; earlier ones are dropped
+OUTPUT_TAIL_LINES = 200
+
+
+class JobQueueFull(Exception):
+    """Raised when a job kind already has as many jobs waiting as it accepts."""
+
+    def __init__(self, kind, retry_after):
+        super().__init__(f"Too many {kind} jobs queued, try again later")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """Raised inside blocking job code that noticed the job was cancelled."""
+
+
+class Job:
+    """A unit of background work and its outcome.
+
+    State changes and progress are published on ``events`` so clients can
+    follow a job, detach and re-attach without affecting the work.
+    """
+
+    def __init__(self, kind, on_change=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.state = 'queued'  # queued / running / done / failed / cancelled
+        self.result = None
+        self.error = None
+        self.stage = None
+        self.percent = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        self.events = EventChannel()
+        self._task = None
+        self._on_change = on_change
+        self._publish('state', self.to_dict())
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def check_cancelled(self):
+        """Abort blocking work (run in the executor) once cancellation was requested."""
+        if self.cancel_requested.is_set():
+            raise JobCancelled(self.id)
+
+    def progress(self, stage, percent=None):
+        """Publish how far the job got; repeated whole-percent values are dropped."""
+        if percent is not None:
+            percent = max(0, min(100, int(percent)))
+        if stage == self.stage and percent == self.percent:
+            return
+        new_stage = stage != self.stage
+        self.stage, self.percent = stage, percent
+        self._publish('progress', {'stage': stage, 'percent': percent}, urgent=new_stage)
+
+    def set_state(self, state, error=None):
+        """Move the job to a new state and publish it; finished states close the channel."""
+        self.state = state
+        if error is not None:
+            self.error = error
+        if self.finished:
+            self.finished_at = time.time()
+        self._publish('state', self.to_dict(), close=self.finished)
+
+    def _publish(self, event, data, close=False, urgent=True):
+        self.events.publish(event, data, close=close)
+        if self._on_change is not None:
+            try:
+                self._on_change(self, urgent)
+            except Exception:
+                logger.exception("Could not share the state of job %s", self.id)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'stage': self.stage,
+            'percent': self.percent,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobDirectory:
+    """Snapshots of every web process's jobs, shared through a SQLite file.
+
+    A job runs in the process that accepted it, but with several gunicorn
+    workers the client's next request may reach another one. The owner
+    writes a snapshot of the job as it changes; the others answer status
+    and event requests from it and pass cancellations back through a flag
+    the owner polls. Jobs of processes that died are reported failed.
+
+    Snapshots are written by a background thread, so a busy database never
+    holds up the job loop. State and stage changes are written at once;
+    progress within a stage at most every ``progress_interval`` seconds.
+    """
+
+    def __init__(self, path, result_ttl, progress_interval=1.0):
+        self.path = path
+        self.result_ttl = result_ttl
+        self.progress_interval = progress_interval
+        self.host = socket.gethostname()
+        self._local = threading.local()
+        self._pending = {}  # job id -> job with changes not written yet
+        self._urgent = False
+        self._condition = threading.Condition()
+        self._writer = None
+        self._writer_pid = None
+
+    def publish(self, job, urgent=True):
+        """Have the job's current state recorded, as owned by this process, without waiting for it."""
+        with self._condition:
+            self._pending[job.id] = job
+            self._urgent = self._urgent or urgent
+            self._condition.notify()
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                self._writer = threading.Thread(target=self._write_pending, name='job-directory')
+                self._writer.daemon = True
+                self._writer.start()
+
+    def flush(self):
+        """Write every pending snapshot now."""
+        with self._condition:
+            jobs, self._pending, self._urgent = list(self._pending.values()), {}, False
+        if not jobs:
+            return
+        try:
+            self._connection().executemany(
+                "INSERT INTO jobs (id, host, pid, version, snapshot, finished, updated) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET version = excluded.version, snapshot = excluded.snapshot, "
+                "finished = excluded.finished, updated = excluded.updated",
+                [
+                    (job.id, self.host, os.getpid(), job.events.last_id, json.dumps(job.to_dict()), int(job.finished), time.time())
+                    for job in jobs
+                ]
+            )
+        except BaseException:
+            # Retry later, unless the job changed again meanwhile
+            with self._condition:
+                for job in jobs:
+                    self._pending.setdefault(job.id, job)
+            raise
+
+    def _write_pending(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                self._condition.wait_for(lambda: self._urgent, timeout=self.progress_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not share the state of running jobs")
+                time.sleep(self.progress_interval)
+
+    def get(self, job_id):
+        """A RemoteJob for a job of any process, or None if unknown or expired."""
+        row = self._connection().execute(
+            "SELECT host, pid, version, snapshot, finished FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        host, pid, version, snapshot, finished = row
+        snapshot = json.loads(snapshot)
+        if not finished and host == self.host and not is_alive(pid):
+            snapshot.update(state='failed', error='The server process running this job exited')
+            version += 1
+        return RemoteJob(self, job_id, version, snapshot)
+
+    def request_cancel(self, job_id):
+        """Ask the owner of an unfinished job to cancel it; False if there is no such job."""
+        cursor = self._connection().execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND finished = 0", (job_id,))
+        return cursor.rowcount > 0
+
+    def take_cancellations(self):
+        """Ids of this process's jobs other processes asked to cancel since the last call."""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE host = ? AND pid = ? AND cancel = 1", (self.host, os.getpid())
+            )]
+            db.executemany("UPDATE jobs SET cancel = 0 WHERE id = ?", [(job_id,) for job_id in ids])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return ids
+
+    def prune(self):
+        """Forget finished jobs past the result TTL, and jobs not updated in a day."""
+        now = time.time()
+        self._connection().execute(
+            "DELETE FROM jobs WHERE (finished = 1 AND updated < ?) OR updated < ?",
+            (now - self.result_ttl, now - 24 * 3600)
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(DIRECTORY_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+
+class RemoteJob:
+    """Read-only view of a job from its directory snapshot, for requests reaching another process."""
+
+    def __init__(self, directory, job_id, version, snapshot):
+        self.directory = directory
+        self.id = job_id
+        self.version = version
+        self.snapshot = snapshot
+        self.events = self  # Streams like an EventChannel
+
+    @property
+    def finished(self):
+        return self.snapshot['state'] in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return self.snapshot
+
+    def stream(self, last_id=0, keepalive=15, poll=0.5):
+        """Yield the job's state as Server-Sent Events whenever it changes, until it finished.
+
+        Event ids are the owner's channel ids, so clients can switch
+        between processes with Last-Event-ID. Only the latest state is
+        sent, which includes the progress.
+        """
+        yield 'retry: 2000\n\n'
+        job, idle = self, 0.0
+        while job is not None:
+            if job.version > last_id:
+                last_id = job.version
+                idle = 0.0
+                yield sse_event('state', job.snapshot, job.version)
+            if job.finished:
+                return
+            time.sleep(poll)
+            idle += poll
+            if idle >= keepalive:
+                idle = 0.0
+                yield ': keep-alive\n\n'
+            job = self.directory.get(self.id)
+
+
+class JobRunner:
+    """Runs job coroutines on an asyncio event loop in a background thread.
+
+    Each job kind gets its own concurrency limit (jobs beyond it wait their
+    turn on a semaphore) and a cap on how many jobs may wait; submissions
+    past that cap are refused with JobQueueFull so callers can push back
+    on clients instead of queueing without bound. With a ``directory``,
+    jobs can be followed and cancelled from any process on the host.
+    Blocking library calls
+    (yt-dlp) run on a shared thread pool via ``run_blocking``; CPU-heavy
+    Python code runs in the worker tier via ``run_in_worker``; subprocesses
+    should use ``run_process`` so cancelling a job kills them.
+    """
+
+    def __init__(self, limits, max_pending, result_ttl, executor_workers=8, worker_pool=None, directory=None):
+        self.limits = dict(limits)
+        self.worker_pool = worker_pool
+        self.directory = directory
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.executor_workers = executor_workers
+        self._jobs = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._executor = None
+        metrics.add_collector(self._collect_metrics)
+
+    def submit(self, kind, coro_fn, *args, on_finish=None):
+        """Schedule ``coro_fn(job, *args)`` and return the job without waiting.
+
+        ``on_finish(job)`` runs on the thread pool once the job ended in any
+        state, including cancellation before it started, so it is the place
+        to release resources the submitter acquired for the job. The
+        request's admission lease, if it has one, is held until then too.
+        """
+        self._ensure_started()
+        with self._lock:
+            self._prune()
+            waiting = sum(1 for job in self._jobs.values() if job.kind == kind and job.state == 'queued')
+            if waiting >= self.max_pending:
+                raise JobQueueFull(kind, retry_after=5)
+            job = Job(kind, on_change=self.directory.publish if self.directory else None)
+            self._jobs[job.id] = job
+
+        lease = take_lease() if has_app_context() else None
+        asyncio.run_coroutine_threadsafe(self._run(job, coro_fn, args, on_finish, lease), self._loop)
+        return job
+
+    def get(self, job_id):
+        """The job, or a RemoteJob view of one another process runs; None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.directory is not None:
+            return self.directory.get(job_id)
+        return job
+
+    def cancel(self, job_id):
+        """Request cancellation; returns False if the job is unknown or already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.directory is not None:
+            return self.directory.request_cancel(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested.set()
+        self._loop.call_soon_threadsafe(self._cancel_task, job)
+        return True
+
+    def stats(self):
+        """Number of queued and running jobs per kind."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                if not job.finished:
+                    per_kind = counts.setdefault(job.kind, {'queued': 0, 'running': 0})
+                    per_kind[job.state] += 1
+            return counts
+
+    async def run_blocking(self, fn, *args):
+        """Run a blocking callable on the runner's thread pool."""
+        context = contextvars.copy_context()  # Keeps the job's log correlation ids
+        return await self._loop.run_in_executor(self._executor, context.run, fn, *args)
+
+    async def run_in_worker(self, fn, *args, progress=None, **kwargs):
+        """Run a picklable function in the worker pool's processes.
+
+        ``progress(stage, percent)`` receives the progress the function
+        reports through its own ``progress`` keyword argument.
+        """
+        return await asyncio.wrap_future(self.worker_pool.submit(fn, *args, progress=progress, **kwargs))
+
+    async def run_process(self, *args, on_line=None):
+        """Run a subprocess without blocking the loop; kill it if the job is cancelled.
+
+        ``on_line`` is called with each line of output (stdout and stderr,
+        split on newlines and carriage returns so progress bars come through)
+        as it is produced. Returns the last OUTPUT_TAIL_LINES lines of stdout.
+        """
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True  # Own process group, so children die with it
+        )
+        stdout, stderr = deque(maxlen=OUTPUT_TAIL_LINES), deque(maxlen=20)
+        try:
+            await asyncio.gather(
+                self._read_lines(process.stdout, stdout.append, on_line),
+                self._read_lines(process.stderr, stderr.append, on_line)
+            )
+            await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            raise
+
+        if process.returncode != 0:
+            message = [line for line in stderr if line.strip()]
+            raise RuntimeError(f"{args[0]} exited with code {process.returncode}: {message[-1] if message else ''}")
+        return '\n'.join(stdout)
+
+    @staticmethod
+    async def _read_lines(stream, keep, on_line):
+        buffer = ''
+        while True:
+            chunk = await stream.read(4096)
+            if not chunk:
+                break
+            buffer += chunk.decode('utf-8', errors='replace')
+            *lines, buffer = re.split(r'[\r\n]', buffer)
+            for line in lines:
+                keep(line)
+                if on_line is not None:
+                    on_line(line)
+        if buffer:
+            keep(buffer)
+            if on_line is not None:
+                on_line(buffer)
+
+    def _cancel_task(self, job):
+        if job._task is not None:
+            job._task.cancel()
+
+    async def _run(self, job, coro_fn, args, on_finish, lease):
+        job._task = asyncio.current_task()
+        logs.job_id.set(job.id)  # The task has its own context, copied from the submitting request
+        started = None
+        semaphore = self._semaphores.setdefault(job.kind, asyncio.Semaphore(self.limits.get(job.kind, 2)))
+        try:
+            async with semaphore:
+                if job.cancel_requested.is_set():
+                    raise asyncio.CancelledError()
+                job.set_state('running')
+                started = time.perf_counter()
+                job.result = await coro_fn(job, *args)
+                job.set_state('done')
+        except (asyncio.CancelledError, JobCancelled):
+            job.set_state('cancelled')
+            logger.info("Job %s (%s) cancelled", job.id, job.kind)
+        except Exception as e:
+            job.set_state('failed', error=str(e))
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+        finally:
+            job._task = None
+            if started is not None:
+                metrics.observe('job_duration_seconds', time.perf_counter() - started, kind=job.kind, state=job.state)
+            if on_finish is not None or lease is not None:
+                self._loop.run_in_executor(self._executor, self._call_on_finish, on_finish, job, lease)
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        for kind in set(self.limits) | set(stats):
+            for state in ('queued', 'running'):
+                metrics.set_gauge('jobs', stats.get(kind, {}).get(state, 0), kind=kind, state=state)
+
+    def _call_on_finish(self, on_finish, job, lease):
+        try:
+            if on_finish is not None:
+                on_finish(job)
+        except Exception:
+            logger.exception("Cleanup for job %s failed", job.id)
+        finally:
+            if lease is not None:
+                lease.release()
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _watch_cancellations(self, interval=1.0):
+        """Cancel this process's jobs that requests to other processes asked to cancel."""
+        while True:
+            try:
+                for job_id in await self._loop.run_in_executor(self._executor, self.directory.take_cancellations):
+                    self.cancel(job_id)
+                await self._loop.run_in_executor(self._executor, self.directory.prune)
+            except Exception:
+                logger.exception("Could not check the job directory for cancellations")
+            await asyncio.sleep(interval)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='job-blocking')
+            self._loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._loop.run_forever, name='job-loop')
+            thread.daemon = True
+            thread.start()
+            if self.directory is not None:
+                asyncio.run_coroutine_threadsafe(self._watch_cancellations(), self._loop)
+
+
+def progress_reporter(job, stage, parse):
+    """Build an ``on_line`` callback that publishes the percentages ``parse`` finds in output."""
+    def on_line(line):
+        percent = parse(line)
+        if percent is not None:
+            job.progress(stage, percent)
+    return on_line
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """Return the process-wide job runner, configured from the current app."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(
+                limits=current_app.config['JOB_CONCURRENCY'],
+                max_pending=current_app.config['JOB_MAX_PENDING'],
+                result_ttl=current_app.config['JOB_RESULT_TTL'],
+                executor_workers=current_app.config['JOB_BLOCKING_WORKERS'],
+                worker_pool=get_worker_pool(),
+                directory=JobDirectory(
+                    current_app.config['JOB_DIRECTORY_DB'], current_app.config['JOB_RESULT_TTL'],
+                    progress_interval=current_app.config['JOB_DIRECTORY_PROGRESS_INTERVAL']
+                )
+            )
+        return _runner
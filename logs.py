@@ -0,0 +1,204 @@
+import os
+import re
+import sys
+import copy
+import json
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+# Correlation ids of the request and job a record was logged for
+request_id = contextvars.ContextVar('request_id', default=None)
+job_id = contextvars.ContextVar('job_id', default=None)
+
+# Request ids accepted from an X-Request-ID header (e.g. set by the proxy)
+REQUEST_ID = re.compile(r'^\w[\w.-]{0,63}$')
+
+# Attributes of every LogRecord; anything else was passed with ``extra``
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id', 'job_id'}
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the request and job they were logged for."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        record.job_id = job_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through one in ``every`` DEBUG records of each call site.
+
+    The first record of a call site always gets through, so one-off debug
+    lines still show up while those in loops or on every request are
+    thinned out.
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            seen = self._counts[key]
+            self._counts[key] = seen + 1
+        return seen % self.every == 0
+
+
+class BackgroundHandler(QueueHandler):
+    """Hands records to the listener thread, which does the formatting and writing."""
+
+    def prepare(self, record):
+        # Resolve the message and traceback while their objects still exist
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """``time LEVEL logger [request job] message key=value...``"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s %(ids)s%(message)s%(fields)s')
+
+    def format(self, record):
+        ids = [value[:8] for value in (record.request_id, record.job_id) if value]
+        record.ids = f"[{' '.join(ids)}] " if ids else ''
+        fields = extra_fields(record)
+        record.fields = ''.join(f" {key}={value}" for key, value in fields.items())
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        if record.request_id:
+            entry['request_id'] = record.request_id
+        if record.job_id:
+            entry['job_id'] = record.job_id
+        entry.update(extra_fields(record))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES and key not in ('ids', 'fields')}
+
+
+FORMATTERS = {'text': TextFormatter, 'json': JsonFormatter}
+
+# How this process was configured, handed on to worker processes
+settings = None
+_listener = None
+
+
+def configure(level='INFO', levels=None, format='text', sample_every=1):
+    """Send all logging through a queue to a background thread writing to stderr.
+
+    ``levels`` sets the level of individual loggers (modules), e.g.
+    ``{'utils': 'DEBUG'}``. Callers only pay for building the records of
+    enabled levels and putting them on the queue.
+    """
+    global settings, _listener
+    if _listener is not None:
+        _listener.stop()
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(FORMATTERS[format]())
+    records = queue.SimpleQueue()
+    handler = BackgroundHandler(records)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(sample_every))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(records, stream)
+    _listener.start()
+    settings = {'level': level, 'levels': dict(levels or {}), 'format': format, 'sample_every': sample_every}
+
+
+@atexit.register
+def _stop_listener():
+    # Write out what is still queued
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # The listener thread doesn't survive a fork (gunicorn --preload); start the child's own
+    global _listener
+    if settings is not None:
+        _listener = None
+        configure(**settings)
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def correlation():
+    """The current request and job ids, to carry over to another thread or process."""
+    return request_id.get(), job_id.get()
+
+
+def restore_correlation(ids):
+    request_id.set(ids[0])
+    job_id.set(ids[1])
+
+
+def init_app(app):
+    """Configure logging from the app and give every request a correlation id."""
+    from flask import g, request
+
+    configure(
+        level=app.config['LOG_LEVEL'],
+        levels=app.config['LOG_LEVELS'],
+        format=app.config['LOG_FORMAT'],
+        sample_every=app.config['LOG_DEBUG_SAMPLE_EVERY']
+    )
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming if REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        request_id.set(g.request_id)
+
+    @app.after_request
+    def return_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+    @app.teardown_request
+    def clear_request_id(error=None):
+        # Server threads are reused; don't tag their next work with this request
+        request_id.set(None)
@@ -0,0 +1,150 @@
+import numpy as np
+from waveforms import decode_pcm
+
+# Files are decoded at the rate ITU-R BS.1770 publishes its filters for
+SAMPLE_RATE = 48000
+
+# 400 ms gating blocks overlapping by 75%, built from 100 ms steps
+STEPS_PER_BLOCK = 4
+
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU below the absolute-gated loudness
+
+# True peak is measured on a 4x oversampled signal
+OVERSAMPLE = 4
+OVERLAP = 32  # Samples carried between blocks so the resampler has context
+
+
+def k_weighting(sample_rate):
+    """ITU-R BS.1770 K-weighting filters (high shelf, high pass) for any sample rate.
+
+    The analog prototypes are those libebur128 uses; at 48 kHz they give
+    the coefficients published in the standard.
+    """
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = np.array([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0])
+    shelf_a = np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass_b = np.array([1.0, -2.0, 1.0])
+    highpass_a = np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf_b, shelf_a, highpass_b, highpass_a
+
+
+def block_loudness(mean_square):
+    """Loudness in LUFS of channel-summed mean square energy."""
+    return -0.691 + 10 * np.log10(np.maximum(mean_square, 1e-12))
+
+
+class LoudnessMeter:
+    """Streaming EBU R128 integrated loudness and true peak meter.
+
+    Feed decoded int16 blocks of shape (samples, channels) in order; memory
+    use is bounded by the block size plus one float per 100 ms of audio.
+    """
+
+    def __init__(self, channels=2, sample_rate=SAMPLE_RATE):
+        self.channels = channels
+        self.step = sample_rate // 10
+        self._filters = k_weighting(sample_rate)
+        self._shelf_state = np.zeros((2, channels))
+        self._highpass_state = np.zeros((2, channels))
+        self._pending = np.zeros((0, channels))
+        self._steps = []  # Channel-summed energy of each 100 ms step
+        self._tail = np.zeros((0, channels))
+        self._peak = 0.0
+
+    def feed(self, block):
+        from scipy.signal import lfilter
+
+        samples = block.reshape(-1, self.channels).astype(np.float64) / 32768.0
+        if not len(samples):
+            return
+
+        self._measure_true_peak(samples)
+
+        shelf_b, shelf_a, highpass_b, highpass_a = self._filters
+        weighted, self._shelf_state = lfilter(shelf_b, shelf_a, samples, axis=0, zi=self._shelf_state)
+        weighted, self._highpass_state = lfilter(highpass_b, highpass_a, weighted, axis=0, zi=self._highpass_state)
+
+        weighted = np.concatenate((self._pending, weighted))
+        whole = len(weighted) - len(weighted) % self.step
+        if whole:
+            steps = (weighted[:whole] ** 2).reshape(-1, self.step, self.channels).sum(axis=(1, 2))
+            self._steps.extend(steps.tolist())
+        self._pending = weighted[whole:]
+
+    def integrated(self):
+        """Gated integrated loudness in LUFS, or None for silence or very short audio."""
+        if len(self._steps) < STEPS_PER_BLOCK:
+            return None
+
+        steps = np.array(self._steps) / self.step
+        # Each block averages four consecutive steps, advancing one step at a time
+        blocks = np.convolve(steps, np.ones(STEPS_PER_BLOCK) / STEPS_PER_BLOCK, mode='valid')
+        loudness = block_loudness(blocks)
+
+        gated = blocks[loudness > ABSOLUTE_GATE]
+        if not len(gated):
+            return None
+        threshold = block_loudness(gated.mean()) + RELATIVE_GATE
+
+        gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > threshold)]
+        return float(block_loudness(gated.mean()))
+
+    def true_peak(self):
+        """Maximum true peak in dBTP."""
+        return float(20 * np.log10(max(self._peak, 1e-12)))
+
+    def _measure_true_peak(self, samples):
+        from scipy.signal import resample_poly
+
+        context = np.concatenate((self._tail, samples))
+        upsampled = resample_poly(context, OVERSAMPLE, 1, axis=0)
+        # Only trust the middle of the window, where the interpolation filter
+        # has real samples on both sides; the edges are covered by the
+        # neighbouring blocks
+        start = max(len(self._tail) - OVERLAP // 2, 0) * OVERSAMPLE
+        end = max(len(context) - OVERLAP // 2, 0) * OVERSAMPLE
+        if end > start:
+            self._peak = max(self._peak, float(np.abs(upsampled[start:end]).max()))
+        self._peak = max(self._peak, float(np.abs(samples).max()))
+        self._tail = context[-OVERLAP:]
+
+
+def measure_loudness(file_path, pcm=None, sample_rate=SAMPLE_RATE):
+    """Measure integrated loudness and true peak of an audio file in one streaming pass.
+
+    ``pcm`` may hold the file's already decoded stereo int16 samples at
+    ``sample_rate`` (e.g. from the PCM cache), which are read instead.
+    """
+    if pcm is None:
+        blocks = decode_pcm(file_path, sample_rate, channels=2)
+    else:
+        blocks = (pcm[start:start + sample_rate * 10] for start in range(0, len(pcm), sample_rate * 10))
+    meter = LoudnessMeter(channels=2, sample_rate=sample_rate)
+    for block in blocks:
+        meter.feed(block)
+    return {
+        'loudness': meter.integrated(),
+        'true_peak': meter.true_peak()
+    }
+
+
+def replay_gain(loudness, true_peak, target, ceiling=-1.0):
+    """Gain in dB that brings a track to the target loudness without clipping.
+
+    Boosts are limited so the true peak stays below ``ceiling``.
+    """
+    if loudness is None:
+        return None
+    gain = target - loudness
+    if true_peak is not None:
+        gain = min(gain, ceiling - true_peak)
+    return round(gain, 2)
@@ -0,0 +1,346 @@
+import os
+import json
+import glob
+import time
+import fcntl
+import atexit
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from page views to minutes-long stem separations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Every metric the app records: type and help text
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, by endpoint and method.'),
+    'stage_duration_seconds': ('histogram', 'Time spent in each stage of analysis, conversion and separation.'),
+    'ffmpeg_duration_seconds': ('histogram', 'Wall time of ffmpeg conversions, by tool.'),
+    'conversion_bytes_total': ('counter', 'Bytes read and written by conversions, by tool and direction.'),
+    'job_duration_seconds': ('histogram', 'Running time of background jobs, by kind and final state.'),
+    'jobs': ('gauge', 'Background jobs queued or running, by kind and state.'),
+    'cache_lookups_total': ('counter', 'Cache lookups, by cache and result.'),
+    'process_resident_memory_bytes': ('gauge', 'Resident memory of each web and worker process.'),
+}
+
+# Counters and histograms of exited processes, summed, in the metrics folder
+EXITED_FILE = 'exited.json'
+
+
+class Metrics:
+    """Counters, gauges and histograms of this process, merged across processes.
+
+    Values are kept in memory and written every ``flush_interval`` seconds
+    to one JSON file per process in ``folder``, so web workers and analysis
+    workers all show up in ``collect``, which merges the files. When a
+    process is gone, its counters and histograms are added to the totals
+    in ``EXITED_FILE`` and its file is removed, so they keep counting and
+    a new process given the same pid starts from its own values; gauges
+    of exited processes are dropped. Collectors added with
+    ``add_collector`` run before every flush to refresh gauges such as
+    queue depths.
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.role = 'web'
+        self.flush_interval = 5
+        self._values = {}  # (name, labels) -> number, or [bucket counts, sum, count]
+        self._collectors = []
+        self._pid = os.getpid()
+        self._flusher = None
+        self._lock = threading.Lock()
+        self._claimed = False  # Whether this process's file holds its own values yet
+
+    def configure(self, folder, role='web', flush_interval=5):
+        """Start writing this process's values to ``folder``."""
+        self.folder = folder
+        self.role = role
+        self.flush_interval = flush_interval
+        os.makedirs(folder, exist_ok=True)
+        self._start_flusher()
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def inc(self, name, amount=1, **labels):
+        self._record(name, labels, lambda old: (old or 0) + amount)
+
+    def set(self, name, value, **labels):
+        self._record(name, labels, lambda old: value)
+
+    def observe(self, name, value, **labels):
+        def update(old):
+            counts, total, count = old or ([0] * (len(DURATION_BUCKETS) + 1), 0.0, 0)
+            counts[next((i for i, bound in enumerate(DURATION_BUCKETS) if value <= bound), len(DURATION_BUCKETS))] += 1
+            return [counts, total + value, count + 1]
+        self._record(name, labels, update)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the time spent in the block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def flush(self):
+        """Write this process's current values for ``collect`` to find."""
+        if self.folder is None:
+            return
+        if self._pid != os.getpid():
+            self._after_fork()
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception:
+                logger.exception("Metrics collector failed")
+        self.set('process_resident_memory_bytes', resident_memory(), pid=str(os.getpid()), role=self.role)
+
+        with self._lock:
+            values = [[name, dict(labels), value] for (name, labels), value in self._values.items()]
+        path = os.path.join(self.folder, f"{os.getpid()}.json")
+        if not self._claimed:
+            # A file already there is from an exited process that had our pid
+            with self._exited_lock():
+                self._fold_exited(path)
+            self._claimed = True
+        write_json(path, {'pid': os.getpid(), 'role': self.role, 'values': values})
+
+    def collect(self):
+        """Values of all processes, merged: {(name, labels): value}."""
+        self.flush()
+        merged = {}
+        exited = []
+        for path in glob.glob(os.path.join(self.folder, '[0-9]*.json')):
+            snapshot = read_json(path)
+            if snapshot is None:
+                continue  # Replaced or removed while being read
+            if is_alive(snapshot['pid']):
+                merge_values(merged, snapshot['values'])
+            else:
+                exited.append(path)
+        if exited:
+            with self._exited_lock():
+                for path in exited:
+                    self._fold_exited(path)
+        with self._exited_lock():
+            merge_values(merged, (read_json(os.path.join(self.folder, EXITED_FILE)) or {}).get('values', []))
+        return merged
+
+    def render(self):
+        """All processes' values in the Prometheus text exposition format."""
+        by_name = {}
+        for (name, labels), value in self.collect().items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = METRICS[name]
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in sorted(by_name[name]):
+                if kind != 'histogram':
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(DURATION_BUCKETS + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else format_value(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    @contextmanager
+    def _exited_lock(self):
+        # Serialises folding across processes, so no file is added to the totals twice
+        with open(os.path.join(self.folder, 'exited.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _fold_exited(self, path):
+        """Add the counters and histograms of an exited process's file to the exited totals and remove it.
+
+        Must hold ``_exited_lock``; a file another process folded first is gone.
+        """
+        snapshot = read_json(path)
+        if snapshot is None:
+            return
+        exited_path = os.path.join(self.folder, EXITED_FILE)
+        totals = {}
+        merge_values(totals, (read_json(exited_path) or {}).get('values', []))
+        merge_values(totals, snapshot['values'], gauges=False)
+        write_json(exited_path, {'values': [[name, dict(labels), value] for (name, labels), value in totals.items()]})
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        logger.debug("Folded the metrics of exited process %s", snapshot['pid'])
+
+    def _record(self, name, labels, update):
+        if self._pid != os.getpid():
+            self._after_fork()
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self._values[key] = update(self._values.get(key))
+
+    def _after_fork(self):
+        # A forked child starts from its parent's values; they are the parent's to report
+        self._pid = os.getpid()
+        self._values = {}
+        self._lock = threading.Lock()
+        self._claimed = False
+        self._flusher = None
+        if self.folder is not None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_periodically, name='metrics-flush')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Writing metrics failed: %s", e)
+
+
+def merge_values(merged, values, gauges=True):
+    """Add snapshot values, [name, labels, value] each, into {(name, labels): value}."""
+    for name, labels, value in values:
+        kind = METRICS[name][0]
+        if kind == 'gauge' and not gauges:
+            continue
+        key = (name, tuple(sorted(labels.items())))
+        old = merged.get(key)
+        if kind == 'histogram':
+            if old is not None:
+                value = [[a + b for a, b in zip(old[0], value[0])], old[1] + value[1], old[2] + value[2]]
+        elif old is not None:
+            value = old + value
+        merged[key] = value
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def resident_memory():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, in KiB on Linux
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{escape_label(value)}"' for label, value in labels) + '}'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class StageTimer:
+    """Times consecutive stages of one piece of work into ``stage_duration_seconds``.
+
+    ``start(stage)`` ends the previous stage; repeated calls for the stage
+    already running (progress updates) are ignored.
+    """
+
+    def __init__(self, tool):
+        self.tool = tool
+        self.stage = None
+        self._started = None
+
+    def start(self, stage):
+        if stage == self.stage:
+            return
+        self.stop()
+        self.stage, self._started = stage, time.perf_counter()
+
+    def stop(self):
+        if self.stage is not None:
+            observe('stage_duration_seconds', time.perf_counter() - self._started, tool=self.tool, stage=self.stage)
+            self.stage = None
+
+
+# The registry of this process
+registry = Metrics()
+inc = registry.inc
+set_gauge = registry.set
+observe = registry.observe
+timer = registry.timer
+add_collector = registry.add_collector
+
+
+@atexit.register
+def _flush_at_exit():
+    if registry.folder is not None and registry._pid == os.getpid():
+        try:
+            registry.flush()
+        except Exception:
+            pass
+
+
+def init_app(app):
+    """Record request latencies and write this web process's metrics."""
+    from flask import g, request
+
+    registry.configure(app.config['METRICS_FOLDER'], role='web', flush_interval=app.config['METRICS_FLUSH_INTERVAL'])
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint, method=request.method)
+            inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
@@ -29,6 +29,45 @@ class Track(db.Model):
     like_count = db.Column(db.Integer, default=0)  # New field for likes
     unlike_count = db.Column(db.Integer, default=0)  # New field for unlikes
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    tempo = db.Column(db.Integer, nullable=True)  # Detected BPM
+    musical_key = db.Column(db.String(10), nullable=True)  # Detected key, e.g. "Am"
+    rendition = db.Column(db.String(200), nullable=True)  # MP3 streaming copy of the audio file
+    duration = db.Column(db.Float, nullable=True)  # Seconds, from ffprobe
+    loudness = db.Column(db.Float, nullable=True)  # Integrated loudness, LUFS (EBU R128)
+    true_peak = db.Column(db.Float, nullable=True)  # dBTP
+    replay_gain = db.Column(db.Float, nullable=True)  # dB the player applies to reach the target loudness
+    status = db.Column(db.String(20), default='ready')  # processing / ready / failed
 
     def __repr__(self):
-        return f'<Track {self.name}>'
\ No newline at end of file
+        return f'<Track {self.name}>'
+
+# Content-addressed media file shared by tracks and audio tool uploads
+class MediaBlob(db.Model):
+    __tablename__ = 'media_blobs'
+
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the file contents
+    filename = db.Column(db.String(200), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, default=0, nullable=False)
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MediaBlob {self.filename} refs={self.refcount}>'
+
+
+# Timing and outcome of one ingest pipeline stage for a track
+class IngestStageRun(db.Model):
+    __tablename__ = 'ingest_stage_runs'
+    __table_args__ = (db.UniqueConstraint('track_id', 'stage'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'), nullable=False, index=True)
+    stage = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending / running / done / failed
+    attempts = db.Column(db.Integer, default=0)
+    duration_ms = db.Column(db.Float, nullable=True)  # Wall time of the last attempt
+    error = db.Column(db.String(500), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<IngestStageRun {self.track_id}:{self.stage} {self.status}>'
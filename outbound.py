@@ -0,0 +1,259 @@
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Responses worth another attempt: throttling and temporary upstream trouble
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling a host that is failing or whose limits are exhausted."""
+
+    def __init__(self, host, reason, retry_after):
+        super().__init__(f"{host} is unavailable ({reason}), try again in {int(retry_after) + 1}s")
+        self.host = host
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average, in bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Take a token, waiting up to ``timeout`` seconds; returns the wait still needed, 0 on success."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return 0
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stops calls to a host after ``failures`` consecutive failures.
+
+    While open, calls fail fast for ``reset_after`` seconds; then one trial
+    call is let through (half-open), and its outcome closes the circuit or
+    opens it again.
+    """
+
+    def __init__(self, failures, reset_after):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = 'closed'  # closed / open / half-open
+        self._failure_count = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """0 if a call may go ahead, else the seconds until the next trial call."""
+        with self._lock:
+            if self.state == 'closed':
+                return 0
+            remaining = self._opened_at + self.reset_after - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half-open'
+                return 0
+            return max(remaining, 1.0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failure_count = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failure_count += 1
+            if self.state == 'half-open' or self._failure_count >= self.failures:
+                if self.state != 'open':
+                    logger.warning("Circuit opened after %s failures", self._failure_count)
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class HostLimiter:
+    """Concurrency limit, rate limit and circuit breaker of one upstream host."""
+
+    def __init__(self, host, concurrency, rate, burst, failures, reset_after, wait=10):
+        self.host = host
+        self.wait = wait
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failures, reset_after)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self.concurrency = concurrency
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the host's connections for the duration of the block."""
+        retry_after = self.breaker.allow()
+        if retry_after:
+            raise UpstreamUnavailable(self.host, 'circuit open', retry_after)
+        retry_after = self.bucket.acquire(self.wait)
+        if retry_after:
+            raise UpstreamUnavailable(self.host, 'rate limited', retry_after)
+        if not self._slots.acquire(timeout=self.wait):
+            raise UpstreamUnavailable(self.host, 'too many concurrent requests', 1)
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {'state': self.breaker.state, 'in_use': self.in_use, 'concurrency': self.concurrency}
+
+
+class OutboundClient:
+    """Shared client for calls leaving the app (chat API, YouTube).
+
+    HTTP goes through one ``requests`` session whose keep-alive pools are
+    reused across requests. Every call, HTTP or not (``call`` wraps
+    library calls such as yt-dlp), is subject to its host's concurrency
+    limit, token bucket and circuit breaker, and failed attempts are
+    retried with exponential backoff and full jitter.
+    """
+
+    def __init__(self, hosts, default_host, pool_size=20, timeout=(5, 60), retries=3, backoff=0.5, max_backoff=10):
+        self.hosts = hosts
+        self.default_host = default_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(hosts) + 4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, host):
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(host, **{**self.default_host, **self.hosts.get(host, {})})
+            return self._limiters[host]
+
+    def call(self, host, fn, *args, is_failure=lambda e: True, retries=None, **kwargs):
+        """Call ``fn`` under ``host``'s limits, retrying exceptions ``is_failure`` accepts."""
+        limiter = self.limiter(host)
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                with limiter.slot():
+                    result = fn(*args, **kwargs)
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                if not is_failure(e):
+                    # The host answered; the request itself was at fault
+                    limiter.breaker.record_success()
+                    raise
+                limiter.breaker.record_failure()
+                if attempt == retries:
+                    raise
+                self._sleep(attempt)
+                continue
+            limiter.breaker.record_success()
+            return result
+
+    def request(self, method, url, **kwargs):
+        """Make an HTTP request and read the whole response."""
+        with self.stream(method, url, **kwargs) as response:
+            response.content  # Read before the connection goes back to the pool
+            return response
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        """Make an HTTP request and yield the response while its body is streamed.
+
+        Connection errors, timeouts and throttling or gateway statuses are
+        retried (honouring Retry-After) until the response starts; the
+        host's concurrency slot is held until the block ends.
+        """
+        host = urlsplit(url).hostname
+        limiter = self.limiter(host)
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            with limiter.slot():
+                try:
+                    response = self.session.request(method, url, stream=True, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    limiter.breaker.record_failure()
+                    if attempt == self.retries:
+                        raise
+                    retry_after = None
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                        if response.status_code in RETRY_STATUSES or response.status_code >= 500:
+                            limiter.breaker.record_failure()
+                        else:
+                            limiter.breaker.record_success()
+                        with response:
+                            yield response
+                        return
+                    limiter.breaker.record_failure()
+                    retry_after = response.headers.get('Retry-After')
+                    response.content  # Drain so the connection is reused for the retry
+                    response.close()
+            self._sleep(attempt, retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {host: limiter.stats() for host, limiter in self._limiters.items()}
+
+    def _sleep(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            try:
+                delay = max(delay, min(float(retry_after), self.max_backoff))
+            except ValueError:
+                pass
+        time.sleep(delay)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_outbound_client():
+    """Return the process-wide outbound client, configured from the current app."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = current_app.config
+            _client = OutboundClient(
+                hosts=config['OUTBOUND_HOSTS'],
+                default_host=config['OUTBOUND_DEFAULT_HOST'],
+                pool_size=config['OUTBOUND_POOL_SIZE'],
+                timeout=config['OUTBOUND_TIMEOUT'],
+                retries=config['OUTBOUND_RETRIES'],
+                backoff=config['OUTBOUND_BACKOFF']
+            )
+        return _client
@@ -0,0 +1,167 @@
+import os
+import re
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from waveforms import decode_pcm
+import metrics
+
+# Blob store uploads are named after the SHA-256 of their content
+CONTENT_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_key(file_path):
+    """Cache key for an audio file.
+
+    Blob store files already carry their content hash in the name; any
+    other file is keyed by its path, size and modification time, which
+    changes whenever the file is rewritten.
+    """
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    if CONTENT_HASH.match(stem):
+        return stem
+    stat = os.stat(file_path)
+    identity = f"{os.path.realpath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+class PcmCache:
+    """Decoded audio shared by the tools that read the same upload.
+
+    Audio is decoded once per file, sample rate and channel count into a
+    raw int16 file, and handed out as read-only memory-mapped arrays:
+    readers get zero-copy views and the OS page cache does the rest. The
+    least recently used entries are evicted once the folder grows past
+    ``max_bytes``; views already handed out stay valid after eviction.
+    Readers that open a cache file by path themselves (ffmpeg, separation
+    workers) hold it with ``pinned``, which eviction in any process
+    respects.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def path(self, key, sample_rate, channels):
+        return os.path.join(self.folder, f"{key}_{sample_rate}_{channels}.pcm")
+
+    @contextmanager
+    def pinned(self, file_path, sample_rate, channels=2):
+        """Path of a file's cached raw samples, kept from eviction until the block ends.
+
+        Yields None if they haven't been decoded yet. The pin is a shared
+        lock on the cache file, so it holds across processes and goes away
+        with the process that took it.
+        """
+        path = self.path(content_key(file_path), sample_rate, channels)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            yield None
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if not _same_file(fd, path):
+                yield None  # Evicted between opening and locking
+                return
+            os.utime(path)  # Mark as recently used
+            yield path
+        finally:
+            os.close(fd)
+
+    def lookup(self, file_path, sample_rate, channels=2):
+        """Cached samples of a file, or None if they haven't been decoded yet."""
+        with self.pinned(file_path, sample_rate, channels) as path:
+            # Once mapped, the samples outlive the file's eviction
+            return self._open(path, channels) if path else None
+
+    def get(self, file_path, sample_rate, channels=2):
+        """Samples of a file as int16, (samples, channels) or 1-D for mono; decodes on a miss."""
+        samples = self.lookup(file_path, sample_rate, channels)
+        metrics.inc('cache_lookups_total', cache='pcm', result='miss' if samples is None else 'hit')
+        if samples is not None:
+            return samples
+
+        path = self.path(content_key(file_path), sample_rate, channels)
+        with _decode_lock(path):
+            # Another thread may have finished the same decode meanwhile
+            samples = self.lookup(file_path, sample_rate, channels)
+            if samples is None:
+                os.makedirs(self.folder, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        for block in decode_pcm(file_path, sample_rate, channels=channels):
+                            f.write(block.tobytes())
+                    # Mapped before it is published, so other processes' eviction can't take it away
+                    samples = self._open(tmp_path, channels)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                self.evict(keep=path)
+        return samples
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in ``max_bytes``."""
+        entries = []
+        for filename in os.listdir(self.folder):
+            if filename.endswith('.pcm'):
+                path = os.path.join(self.folder, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep or not _remove_unpinned(path):
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def _open(self, path, channels):
+        if not os.path.getsize(path):
+            return np.zeros(0 if channels == 1 else (0, channels), dtype=np.int16)
+        samples = np.memmap(path, dtype='<i2', mode='r')
+        return samples if channels == 1 else samples.reshape(-1, channels)
+
+
+def _same_file(fd, path):
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def _remove_unpinned(path):
+    """Remove a cache file unless a reader has it pinned; whether it is gone."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return True
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        if _same_file(fd, path):
+            os.remove(path)
+        return True
+    finally:
+        os.close(fd)
+
+
+# Decodes of the same file are serialised; paths share a fixed set of locks
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def _decode_lock(path):
+    return _locks[hash(path) % len(_locks)]
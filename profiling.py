@@ -0,0 +1,200 @@
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+import contextvars
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Folder the profiles of the current request and its jobs go to, while it is profiled
+current = contextvars.ContextVar('profile_folder', default=None)
+
+_local = threading.local()
+_tracing = 0
+_tracing_lock = threading.Lock()
+# Held by the capture running in this process; Python 3.12+ allows one active profiler
+_profiler_lock = threading.Lock()
+
+
+class Capture:
+    """cProfile and tracemalloc capture of one piece of work.
+
+    ``stop`` writes ``<name>.prof`` (pstats, e.g. for snakeviz) and
+    ``<name>.json`` (wall and CPU time, peak memory) to ``folder``. Only
+    one capture runs per process: work nested inside one is part of its
+    profile, and a capture started while another thread's runs is skipped
+    (``running`` stays False) rather than waiting or failing.
+    """
+
+    def __init__(self, folder, name, **details):
+        self.folder = folder
+        self.name = name
+        self.details = details
+        self._profiler = None
+
+    @property
+    def running(self):
+        return self._profiler is not None
+
+    def start(self):
+        global _tracing
+        if getattr(_local, 'active', False):
+            return self
+        if not _profiler_lock.acquire(blocking=False):
+            logger.debug("Not profiling %s, another profile is being captured", self.name)
+            return self
+        _local.active = True
+        with _tracing_lock:
+            if not _tracing:
+                tracemalloc.start()
+            _tracing += 1
+            self._baseline = tracemalloc.get_traced_memory()[0]
+            if _tracing == 1:
+                tracemalloc.reset_peak()
+        self._started, self._cpu_started = time.perf_counter(), time.process_time()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        return self
+
+    def stop(self, error=None):
+        global _tracing
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        wall, cpu = time.perf_counter() - self._started, time.process_time() - self._cpu_started
+        with _tracing_lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            _tracing -= 1
+            if not _tracing:
+                tracemalloc.stop()
+        _local.active = False
+        _profiler_lock.release()
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(self.folder, f"{self.name}.prof"))
+            with open(os.path.join(self.folder, f"{self.name}.json"), 'w') as f:
+                json.dump(dict(
+                    self.details,
+                    name=self.name,
+                    created=time.time(),
+                    pid=os.getpid(),
+                    wall_seconds=wall,
+                    cpu_seconds=cpu,
+                    peak_memory_bytes=max(0, peak - self._baseline),
+                    error=error
+                ), f)
+        except OSError:
+            logger.exception("Writing profile %s to %s failed", self.name, self.folder)
+        self._profiler = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop(error=repr(exc) if exc is not None else None)
+        return False
+
+
+def profiled(name):
+    """Capture a profile of each call made while the current request is profiled."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            folder = current.get()
+            if folder is None:
+                return fn(*args, **kwargs)
+            with Capture(folder, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def list_profiles(root):
+    """Profiles under ``root``, newest request first: [{'id', 'created', 'profiles': [...]}]."""
+    requests = []
+    for profile_id in os.listdir(root) if os.path.isdir(root) else []:
+        folder = os.path.join(root, profile_id)
+        profiles = []
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(folder, filename)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        if profiles:
+            profiles.sort(key=lambda profile: profile['created'])
+            requests.append({'id': profile_id, 'created': profiles[0]['created'], 'profiles': profiles})
+    requests.sort(key=lambda request: request['created'], reverse=True)
+    return requests
+
+
+def summarize(path, limit=40):
+    """The functions of a .prof file taking the most cumulative time, as text."""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def prune(root, keep):
+    """Delete the profiles of all but the ``keep`` most recent requests."""
+    if not os.path.isdir(root):
+        return
+    folders = sorted(
+        (os.path.join(root, name) for name in os.listdir(root)),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for folder in folders[keep:]:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def init_app(app):
+    """Profile requests an admin asks for with ``X-Profile: 1``, or all tool requests if enabled."""
+    from flask import g, request
+    from flask_login import current_user
+
+    def wanted():
+        if app.config['PROFILING_ENABLED'] and request.endpoint in app.config['PROFILING_ENDPOINTS']:
+            return True
+        return request.headers.get('X-Profile') == '1' and current_user.is_authenticated and current_user.is_admin
+
+    @app.before_request
+    def start_profile():
+        if not wanted():
+            return
+        root = os.path.abspath(app.config['PROFILE_FOLDER'])
+        # Clients choose request ids, so they may repeat; the suffix keeps profiles apart
+        profile_id = f"{g.request_id}-{uuid.uuid4().hex[:8]}"
+        folder = os.path.join(root, profile_id)
+        profile = Capture(
+            folder, 'request',
+            method=request.method, path=request.path, endpoint=request.endpoint, request_id=g.request_id
+        ).start()
+        if not profile.running:
+            return  # Another request is being profiled
+        prune(root, app.config['PROFILE_MAX_REQUESTS'] - 1)
+        current.set(folder)
+        g.profile, g.profile_id = profile, profile_id
+
+    @app.after_request
+    def return_profile_id(response):
+        if 'profile' in g:
+            response.headers['X-Profile-ID'] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def stop_profile(error=None):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.stop(error=repr(error) if error is not None else None)
+            current.set(None)
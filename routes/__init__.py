@@ -1,9 +1,15 @@
 from routes.audio import audio_bp
+from routes.media import media_bp
+from routes.admin import admin_bp
+from routes.api import api_bp
+from routes.jobs import jobs_bp
+from routes.chat import chat_bp
+from routes.metrics import metrics_bp
 
 # List of all blueprints
-all_blueprints = [audio_bp]
+all_blueprints = [audio_bp, media_bp, admin_bp, api_bp, jobs_bp, chat_bp, metrics_bp]
 
 def register_blueprints(app):
     """Register all blueprints with the Flask app."""
     for blueprint in all_blueprints:
-        app.register_blueprint(blueprint) 
\ No newline at end of file
+        app.register_blueprint(blueprint)
\ No newline at end of file
@@ -0,0 +1,194 @@
+import os
+import json
+from flask import Blueprint, Response, request, jsonify, current_app, render_template, send_from_directory, abort
+from werkzeug.security import safe_join
+from flask_login import login_required
+from extensions import db
+from models import Track, IngestStageRun
+from decorators import admin_required
+from storage import BlobStore
+import ingest
+from routes.media import has_artwork, schedule_purge
+from chat import get_chat_service
+from admission import get_admission_controller
+import profiling
+
+# Create blueprint
+admin_bp = Blueprint('admin_api', __name__, url_prefix='/admin')
+
+
+def parse_track_ids(values):
+    """Split a list of track ids from JSON into (ids, values that are not ids).
+
+    Only JSON integers are ids; strings, floats and booleans are invalid
+    rather than coerced, so ``"7"``, ``1.5`` and ``true`` never act on a track.
+    """
+    ids, invalid = [], []
+    for value in values or []:
+        if isinstance(value, int) and not isinstance(value, bool):
+            ids.append(value)
+        else:
+            invalid.append(value)
+    return list(dict.fromkeys(ids)), invalid
+
+
+def id_results(requested, invalid, found, status):
+    """Per-id status map: found ids get the status, the rest are reported missing or invalid.
+
+    Invalid values are keyed by their JSON text, so ``"7"`` cannot collide with the id 7.
+    """
+    results = {json.dumps(value): 'invalid' for value in invalid}
+    results.update((str(track_id), status if track_id in found else 'not_found') for track_id in requested)
+    return results
+
+
+def bulk_delete_tracks(track_ids):
+    """Delete tracks in one transaction and queue their unreferenced files for removal."""
+    track_ids, invalid = parse_track_ids(track_ids)
+    rows = db.session.query(
+        Track.id, Track.file, Track.artwork, Track.artwork_secondary
+    ).filter(Track.id.in_(track_ids)).all()
+    found = {row.id for row in rows}
+
+    filenames = []
+    for row in rows:
+        filenames.append(row.file)
+        filenames.extend(name for name in (row.artwork, row.artwork_secondary) if has_artwork(name))
+
+    store = BlobStore(current_app.config['UPLOAD_FOLDER'])
+    orphans = store.release_many(filenames)
+    IngestStageRun.query.filter(IngestStageRun.track_id.in_(found)).delete(synchronize_session=False)
+    Track.query.filter(Track.id.in_(found)).delete(synchronize_session=False)
+    db.session.commit()
+
+    schedule_purge(orphans)
+    return id_results(track_ids, invalid, found, 'deleted')
+
+
+def bulk_reset_counter(track_ids, column):
+    """Zero a like/unlike counter for many tracks with one UPDATE."""
+    track_ids, invalid = parse_track_ids(track_ids)
+    found = {row.id for row in db.session.query(Track.id).filter(Track.id.in_(track_ids))}
+    Track.query.filter(Track.id.in_(found)).update({column: 0}, synchronize_session=False)
+    db.session.commit()
+    return id_results(track_ids, invalid, found, 'cleared')
+
+
+def queue_ingest(track_ids, stages=None, reset=None):
+    """Reset derived columns with one UPDATE and queue ingest stages for the tracks found."""
+    track_ids, invalid = parse_track_ids(track_ids)
+    found = {row.id for row in db.session.query(Track.id).filter(Track.id.in_(track_ids))}
+    if reset:
+        Track.query.filter(Track.id.in_(found)).update(reset, synchronize_session=False)
+        db.session.commit()
+
+    for track_id in sorted(found):
+        ingest.enqueue(track_id, stages=stages)
+    return id_results(track_ids, invalid, found, 'queued')
+
+
+BULK_OPERATIONS = {
+    'delete': bulk_delete_tracks,
+    'clear-likes': lambda ids: bulk_reset_counter(ids, Track.like_count),
+    'clear-unlikes': lambda ids: bulk_reset_counter(ids, Track.unlike_count),
+    'reanalyze': lambda ids: queue_ingest(ids, ['features'], {
+        Track.tempo: None, Track.musical_key: None,
+        Track.loudness: None, Track.true_peak: None, Track.replay_gain: None
+    }),
+    'retranscode': lambda ids: queue_ingest(ids, ['normalize'], {Track.rendition: None}),
+    'reingest': lambda ids: queue_ingest(ids),
+}
+
+
+@admin_bp.route('/bulk/<operation>', methods=['POST'])
+@login_required
+@admin_required
+def bulk_operation(operation):
+    """Run one bulk operation over the selected tracks and report per-id status."""
+    if operation not in BULK_OPERATIONS:
+        return jsonify({'success': False, 'message': f'Unknown operation: {operation}'}), 404
+
+    data = request.get_json(silent=True) or {}
+    track_ids = data.get('track_ids', [])
+    if not track_ids:
+        return jsonify({'success': False, 'message': 'No tracks selected'}), 400
+
+    try:
+        results = BULK_OPERATIONS[operation](track_ids)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+    return jsonify({'success': True, 'operation': operation, 'results': results})
+
+
+@admin_bp.route('/tracks/<int:track_id>/ingest')
+@login_required
+@admin_required
+def ingest_status(track_id):
+    """Report a track's processing status and per-stage timings."""
+    track = Track.query.get_or_404(track_id)
+    runs = IngestStageRun.query.filter_by(track_id=track_id).all()
+    return jsonify({
+        'success': True,
+        'status': track.status,
+        'stages': [{
+            'stage': run.stage,
+            'status': run.status,
+            'attempts': run.attempts,
+            'duration_ms': run.duration_ms,
+            'error': run.error
+        } for run in runs]
+    })
+
+
+@admin_bp.route('/chat/cache', methods=['GET', 'DELETE'])
+@login_required
+@admin_required
+def chat_cache():
+    """Report the chatbot answer cache's hit rate, or empty it with DELETE."""
+    cache = get_chat_service().cache
+    if cache is None:
+        return jsonify({'success': False, 'message': 'The answer cache is disabled'}), 404
+    if request.method == 'DELETE':
+        cache.clear()
+    return jsonify({'success': True, 'cache': cache.stats()})
+
+
+@admin_bp.route('/admission', methods=['GET'])
+@login_required
+@admin_required
+def admission_stats():
+    """Report how much of each heavy tool's capacity is in use, across all workers."""
+    return jsonify({'success': True, 'tools': get_admission_controller().stats()})
+
+
+@admin_bp.route('/profiles', methods=['GET'])
+@login_required
+@admin_required
+def profiles():
+    """List the captured request profiles, newest first."""
+    root = os.path.abspath(current_app.config['PROFILE_FOLDER'])
+    return render_template('admin_profiles.html', requests=profiling.list_profiles(root))
+
+
+@admin_bp.route('/profiles/<profile_id>/<name>.prof', methods=['GET'])
+@login_required
+@admin_required
+def download_profile(profile_id, name):
+    """Download a profile in pstats format."""
+    root = os.path.abspath(current_app.config['PROFILE_FOLDER'])
+    return send_from_directory(
+        root, f"{profile_id}/{name}.prof", as_attachment=True, download_name=f"{profile_id}-{name}.prof"
+    )
+
+
+@admin_bp.route('/profiles/<profile_id>/<name>.txt', methods=['GET'])
+@login_required
+@admin_required
+def profile_summary(profile_id, name):
+    """The functions a profile spent the most cumulative time in, as plain text."""
+    path = safe_join(os.path.abspath(current_app.config['PROFILE_FOLDER']), profile_id, f"{name}.prof")
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return Response(profiling.summarize(path), mimetype='text/plain')
@@ -0,0 +1,39 @@
+import os
+from flask import Blueprint, request, jsonify, current_app, send_file
+from models import Track
+from routes.media import get_peaks_service
+
+# Create blueprint
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+
+@api_bp.route('/tracks/<int:track_id>/peaks')
+def track_peaks(track_id):
+    """Serve precomputed waveform peaks for a track.
+
+    ``resolution`` is in samples per pixel and must be one of
+    PEAKS_RESOLUTIONS; ``format=json`` returns the peaks as JSON instead
+    of the binary audiowaveform format.
+    """
+    track = Track.query.filter_by(id=track_id, status='ready').first_or_404()
+    service = get_peaks_service()
+
+    resolution = request.args.get('resolution', service.resolutions[0], type=int)
+    if resolution not in service.resolutions:
+        return jsonify({
+            'success': False,
+            'message': f"Unsupported resolution, use one of {service.resolutions}"
+        }), 400
+
+    path = service.peaks_path(track.file, resolution)
+    if not os.path.isfile(path):
+        return jsonify({'success': False, 'message': 'Peaks have not been generated for this track'}), 404
+
+    if request.args.get('format') == 'json':
+        response = jsonify(service.read(path))
+        response.add_etag()
+        response.make_conditional(request)
+    else:
+        response = send_file(path, mimetype='application/octet-stream', conditional=True)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['PEAKS_CACHE_MAX_AGE']}"
+    return response
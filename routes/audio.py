@@ -1,34 +1,58 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, url_for
+from flask import Blueprint, Response, render_template, request, jsonify, current_app, url_for
 from models import Track
-from utils import analyze_audio_file, save_uploaded_file, cleanup_file
+from utils import analyze_audio_file
 from services import AudioConversionService, StemSeparationService
+from storage import BlobStore
+from extensions import db
+from jobs import get_job_runner, JobQueueFull
+from routes.jobs import queue_full_response
+from routes.media import get_pcm_cache
+from admission import admission_controlled, take_lease
 import os
-import sys
-import traceback
+import math
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Create blueprint
 audio_bp = Blueprint('audio', __name__, url_prefix='/audio')
 
+async def analysis_job(job, input_path, pcm_cache):
+    """Job body: analyze a stored upload, publishing each analysis step."""
+    result = await get_job_runner().run_in_worker(
+        analyze_audio_file, input_path, pcm_cache=pcm_cache, progress=job.progress
+    )
+    if not result.get('success', False):
+        raise RuntimeError(result.get('error', 'Analysis failed'))
+    return result
+
+
+def release_upload(app, stored_filename):
+    """Drop a job's reference to its stored upload."""
+    with app.app_context():
+        BlobStore(app.config['UPLOAD_FOLDER']).discard(stored_filename)
+
+
 @audio_bp.route('/analyze', methods=['GET', 'POST'])
+@admission_controlled('analyze')
 def analyze_audio():
     """Analyze audio to detect key and tempo."""
     if request.method == 'POST':
-        print("=== ANALYZE AUDIO ENDPOINT CALLED ===")
-        print(f"Request files: {list(request.files.keys())}")
+        logger.debug("Request files: %s", list(request.files.keys()))
         
         if 'audio_file' not in request.files:
-            print("No audio_file in request.files")
+            logger.info("No audio_file in request.files")
             return jsonify({
                 'success': False,
                 'error': 'No file selected'
             }), 400
 
         audio_file = request.files['audio_file']
-        print(f"Audio file name: {audio_file.filename}")
-        print(f"Audio file content type: {audio_file.content_type}")
+        logger.debug("Audio file %s (%s)", audio_file.filename, audio_file.content_type)
         
         if audio_file.filename == '':
-            print("Empty filename")
+            logger.info("Empty filename")
             return jsonify({
                 'success': False,
                 'error': 'No file selected'
@@ -37,105 +61,81 @@ def analyze_audio():
         # Check file extension
         allowed_extensions = ['.mp3', '.wav', '.flac', '.mid', '.midi', '.xml', '.mxl', '.abc']
         file_ext = os.path.splitext(audio_file.filename.lower())[1]
-        print(f"File extension: {file_ext}")
         
         if file_ext not in allowed_extensions:
-            print(f"Unsupported file format: {file_ext}")
+            logger.info("Unsupported file format: %s", file_ext)
             return jsonify({
                 'success': False,
                 'error': f'Unsupported file format. Please use one of: {", ".join(allowed_extensions)}'
             }), 400
         
         try:
-            # Save the uploaded file
-            print("Saving uploaded file...")
-            file_uuid, input_path = save_uploaded_file(audio_file, current_app.config['UPLOAD_FOLDER'])
-            print(f"File saved to: {input_path}")
-            
-            # Free up memory from the raw audio file
-            del audio_file
-            import gc
-            gc.collect()
+            # Store the upload, identical files share one copy on disk. The
+            # job releases it once the analysis finished
+            upload_folder = current_app.config['UPLOAD_FOLDER']
+            store = BlobStore(upload_folder)
+            stored_filename = store.put(audio_file)
+            db.session.commit()
             
+            app = current_app._get_current_object()
             try:
-                print("Starting audio analysis...")
-                # Call the actual audio analysis function
-                print("Calling analyze_audio_file function...")
-                
-                result = analyze_audio_file(input_path)
-                print("Analysis result:", result)
-                
-                # Use Flask's Response object directly
-                from flask import Response
-                import json
-                
-                response = Response(
-                    response=json.dumps(result),
-                    status=200 if result.get('success', False) else 500,
-                    mimetype="application/json"
+                job = get_job_runner().submit(
+                    'analyze', analysis_job, os.path.join(upload_folder, stored_filename), get_pcm_cache(),
+                    on_finish=lambda job: release_upload(app, stored_filename)
                 )
-                
-                return response
-                
-            except Exception as analysis_error:
-                print(f"Analysis exception: {str(analysis_error)}")
-                traceback.print_exc(file=sys.stdout)
-                return jsonify({
-                    'success': False,
-                    'error': f"Analysis failed: {str(analysis_error)}"
-                }), 500
-            finally:
-                # Clean up the input file
-                print(f"Cleaning up input file: {input_path}")
-                cleanup_file(input_path)
-                
+            except JobQueueFull:
+                release_upload(app, stored_filename)
+                raise
+            
+            # The client follows the job for the result
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status_url': url_for('jobs.job_status', job_id=job.id),
+                'events_url': url_for('jobs.job_events', job_id=job.id)
+            }), 202
+            
+        except JobQueueFull as e:
+            return queue_full_response(e)
         except Exception as e:
-            print(f"File handling exception: {str(e)}")
-            traceback.print_exc(file=sys.stdout)
+            logger.exception("File handling exception")
             return jsonify({
                 'success': False,
                 'error': f"File handling error: {str(e)}"
             }), 500
-        finally:
-            # Final cleanup
-            import gc
-            gc.collect()
 
     latest_track = Track.query.order_by(Track.date_added.desc()).first()
     return render_template('analyze.html', latest_track=latest_track)
 
 
 @audio_bp.route('/converter', methods=['GET', 'POST'])
+@admission_controlled('convert')
 def converter():
     """Convert audio files between formats."""
     if request.method == 'POST':
-        print("=== CONVERTER ENDPOINT CALLED ===")
-        print(f"Request files: {list(request.files.keys())}")
-        print(f"Request form: {list(request.form.keys())}")
+        logger.debug("Request files: %s, form: %s", list(request.files.keys()), list(request.form.keys()))
         
         if 'audio_file' not in request.files:
-            print("No audio_file in request.files")
+            logger.info("No audio_file in request.files")
             return jsonify({
                 'success': False,
                 'error': 'No file selected'
             }), 400
                 
         audio_file = request.files['audio_file']
-        print(f"Audio file name: {audio_file.filename}")
-        print(f"Audio file content type: {audio_file.content_type}")
+        logger.debug("Audio file %s (%s)", audio_file.filename, audio_file.content_type)
         
         if audio_file.filename == '':
-            print("Empty filename")
+            logger.info("Empty filename")
             return jsonify({
                 'success': False,
                 'error': 'No file selected'
             }), 400
 
         target_format = request.form.get('target_format')
-        print(f"Target format: {target_format}")
         
         if target_format not in ['mp3', 'wav', 'flac']:
-            print(f"Invalid format: {target_format}")
+            logger.info("Invalid format: %s", target_format)
             return jsonify({
                 'success': False,
                 'error': 'Invalid format selected'
@@ -145,18 +145,27 @@ def converter():
             # Initialize the conversion service
             conversion_service = AudioConversionService(
                 current_app.config['UPLOAD_FOLDER'],
-                current_app.config['CONVERTED_FOLDER']
+                current_app.config['CONVERTED_FOLDER'],
+                pcm_cache=get_pcm_cache()
             )
             
-            # Use the service to convert the file
-            result = conversion_service.convert_file(audio_file, target_format)
+            # Loudness normalization happens in the same ffmpeg pass
+            loudness_target = None
+            if request.form.get('normalize') == 'true':
+                loudness_target = current_app.config['LOUDNESS_TARGET']
             
-            # Return the result directly
-            return jsonify(result)
+            # Queue the conversion; the client follows the job for the result
+            result = conversion_service.submit_conversion(audio_file, target_format, loudness_target)
+            if not result['success']:
+                return jsonify(result)
+            result['status_url'] = url_for('jobs.job_status', job_id=result['job_id'])
+            result['events_url'] = url_for('jobs.job_events', job_id=result['job_id'])
+            return jsonify(result), 202
             
+        except JobQueueFull as e:
+            return queue_full_response(e)
         except Exception as e:
-            print(f"Conversion route exception: {str(e)}")
-            traceback.print_exc(file=sys.stdout)
+            logger.exception("Conversion route exception")
             return jsonify({
                 'success': False,
                 'error': f"Conversion error: {str(e)}"
@@ -167,25 +176,24 @@ def converter():
 
 
 @audio_bp.route('/separator', methods=['GET', 'POST'])
+@admission_controlled('separate')
 def stem_separator():
     """Separate audio into stems."""
     if request.method == 'POST':
-        print("=== SEPARATOR ENDPOINT CALLED ===")
-        print(f"Request files: {list(request.files.keys())}")
+        logger.debug("Request files: %s", list(request.files.keys()))
         
         if 'audio_file' not in request.files:
-            print("No audio_file in request.files")
+            logger.info("No audio_file in request.files")
             return jsonify({
                 'success': False,
                 'error': 'No file selected'
             }), 400
 
         audio_file = request.files['audio_file']
-        print(f"Audio file name: {audio_file.filename}")
-        print(f"Audio file content type: {audio_file.content_type}")
+        logger.debug("Audio file %s (%s)", audio_file.filename, audio_file.content_type)
         
         if audio_file.filename == '':
-            print("Empty filename")
+            logger.info("Empty filename")
             return jsonify({
                 'success': False,
                 'error': 'No file selected'
@@ -194,44 +202,103 @@ def stem_separator():
         # Check file extension
         allowed_extensions = ['.mp3', '.wav', '.flac', '.m4a']
         file_ext = os.path.splitext(audio_file.filename.lower())[1]
-        print(f"File extension: {file_ext}")
         
         if file_ext not in allowed_extensions:
-            print(f"Unsupported file format: {file_ext}")
+            logger.info("Unsupported file format: %s", file_ext)
             return jsonify({
                 'success': False,
                 'error': f'Unsupported file format. Please use one of: {", ".join(allowed_extensions)}'
             }), 400
 
+        preset = request.form.get('preset') or current_app.config['SEPARATION_DEFAULT_PRESET']
+        if preset not in current_app.config['SEPARATION_PRESETS']:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown preset. Please use one of: {", ".join(current_app.config["SEPARATION_PRESETS"])}'
+            }), 400
+        
+        # Most users only want an acapella or an instrumental
+        two_stems = 'vocals' if request.form.get('stems') == 'vocals' else None
+
         try:
             # Use the stem separation service
             separation_service = StemSeparationService(
                 upload_folder=current_app.config['UPLOAD_FOLDER'],
-                converted_folder=current_app.config['CONVERTED_FOLDER']
+                converted_folder=current_app.config['CONVERTED_FOLDER'],
+                pcm_cache=get_pcm_cache()
             )
             
-            result = separation_service.separate_stems(audio_file)
-            
-            if result['success']:
-                return jsonify(result)
-            else:
-                return jsonify(result), 500
+            # Queue the separation; the client follows the job for the stems
+            result = separation_service.submit_separation(audio_file, preset, two_stems)
+            result['status_url'] = url_for('jobs.job_status', job_id=result['job_id'])
+            result['events_url'] = url_for('jobs.job_events', job_id=result['job_id'])
+            return jsonify(result), 202
+        except JobQueueFull as e:
+            return queue_full_response(e)
         except Exception as e:
-            print(f"Separation route exception: {str(e)}")
-            traceback.print_exc(file=sys.stdout)
+            logger.exception("Separation route exception")
             return jsonify({
                 'success': False,
                 'error': f"Separation error: {str(e)}"
             }), 500
 
     latest_track = Track.query.order_by(Track.date_added.desc()).first()
-    return render_template('separator.html', latest_track=latest_track)
+    return render_template(
+        'separator.html',
+        latest_track=latest_track,
+        presets=current_app.config['SEPARATION_PRESETS'],
+        default_preset=current_app.config['SEPARATION_DEFAULT_PRESET']
+    )
+
+
+@audio_bp.route('/separator/<session_id>/mix')
+@admission_controlled('mix', methods=('GET',))
+def mix_stems(session_id):
+    """Render a mix of a separation's stems as a streamed WAV.
+
+    Query parameters: ``<stem>=<gain in dB>`` per stem, plus ``mute`` and
+    ``solo`` (repeatable) naming stems to silence or isolate. The
+    admission lease is held until the mix has been sent.
+    """
+    try:
+        session_id = str(uuid.UUID(session_id))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid session'}), 404
+    
+    gains_db = {}
+    for name, value in request.args.items():
+        if name not in ('mute', 'solo', 'download'):
+            try:
+                gains_db[name] = float(value)
+            except ValueError:
+                gains_db[name] = math.nan
+            if not math.isfinite(gains_db[name]):
+                return jsonify({'success': False, 'error': f'Invalid gain for {name}'}), 400
+    
+    separation_service = StemSeparationService(
+        upload_folder=current_app.config['UPLOAD_FOLDER'],
+        converted_folder=current_app.config['CONVERTED_FOLDER'],
+        pcm_cache=get_pcm_cache()
+    )
+    mix = separation_service.render_mix(
+        session_id, gains_db, set(request.args.getlist('mute')), set(request.args.getlist('solo'))
+    )
+    if mix is None:
+        return jsonify({'success': False, 'error': 'Stems not found, they may have been cleaned up'}), 404
+    
+    size, chunks = mix
+    response = Response(chunks, mimetype='audio/wav', headers={'Content-Length': str(size)})
+    lease = take_lease()
+    if lease is not None:
+        response.call_on_close(lease.release)
+    if request.args.get('download'):
+        response.headers['Content-Disposition'] = 'attachment; filename="mix.wav"'
+    return response
 
 
 @audio_bp.route('/cleanup_stems/<session_id>', methods=['POST'])
 def cleanup_stems(session_id):
     """Clean up stem separation session files."""
-    print(f"=== CLEANUP_STEMS ENDPOINT CALLED for session {session_id} ===")
     
     # Use the stem separation service
     separation_service = StemSeparationService(
@@ -240,7 +307,7 @@ def cleanup_stems(session_id):
     )
     
     result = separation_service.cleanup_session(session_id)
-    print(f"Cleanup result: {result}")
+    logger.debug("Cleanup of stems %s: %s", session_id, result)
     
     if result['success']:
         return jsonify(result)
@@ -251,7 +318,6 @@ def cleanup_stems(session_id):
 @audio_bp.route('/test-json', methods=['GET'])
 def test_json():
     """Test route to verify JSON responses are working correctly."""
-    print("=== TEST JSON ENDPOINT CALLED ===")
     return jsonify({
         'success': True,
         'message': 'JSON response is working correctly'
@@ -261,7 +327,6 @@ def test_json():
 @audio_bp.route('/test', methods=['GET'])
 def test_route():
     """Test route to verify the blueprint is registered correctly."""
-    print("=== TEST ROUTE CALLED ===")
     return jsonify({
         'success': True,
         'message': 'Blueprint is registered correctly'
@@ -0,0 +1,77 @@
+import uuid
+import logging
+from flask import Blueprint, Response, request, jsonify, session
+from chat import get_chat_service
+from events import sse_event
+from outbound import UpstreamUnavailable
+from routes.jobs import queue_full_response
+
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+chat_bp = Blueprint('chat', __name__, url_prefix='/api/chat')
+
+ERROR_ANSWER = "Sorry, I encountered an error. Please try again."
+
+
+def current_chat_id():
+    """Id of the visitor's conversation, kept in their session cookie."""
+    if 'chat_id' not in session:
+        session['chat_id'] = str(uuid.uuid4())
+    return session['chat_id']
+
+
+def stream_events(service, chat_id, message):
+    """Relay the answer as Server-Sent Events: ``token`` pieces, then ``done`` or ``error``."""
+    yield 'retry: 2000\n\n'
+    try:
+        for piece in service.stream_answer(chat_id, message):
+            yield sse_event('token', {'text': piece})
+    except UpstreamUnavailable as e:
+        yield sse_event('error', {'answer': "Alex is busy right now, please try again in a moment.", 'retry_after': e.retry_after})
+        return
+    except Exception:
+        logger.exception("Chat stream error")
+        yield sse_event('error', {'answer': ERROR_ANSWER})
+        return
+    yield sse_event('done', {})
+
+
+@chat_bp.route('', methods=['POST'])
+def chat():
+    """Answer a message in the context of the visitor's conversation.
+
+    With ``"stream": true`` (or an ``Accept: text/event-stream`` header)
+    the answer is streamed as it is generated; otherwise it is returned as
+    JSON once complete.
+    """
+    data = request.get_json(silent=True) or {}
+    user_message = str(data.get('message', '')).strip()
+    if not user_message:
+        return jsonify({"answer": "Please type a question first."}), 400
+
+    service = get_chat_service()
+    chat_id = current_chat_id()
+
+    if data.get('stream') or request.accept_mimetypes.best == 'text/event-stream':
+        return Response(
+            stream_events(service, chat_id, user_message),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    try:
+        return jsonify({"answer": service.answer(chat_id, user_message)})
+    except UpstreamUnavailable as e:
+        return queue_full_response(e)
+    except Exception:
+        logger.exception("Chat error")
+        return jsonify({"answer": ERROR_ANSWER}), 500
+
+
+@chat_bp.route('', methods=['DELETE'])
+def reset_chat():
+    """Forget the visitor's conversation and start a new one."""
+    if 'chat_id' in session:
+        get_chat_service().store.clear(session.pop('chat_id'))
+    return jsonify({'success': True})
@@ -0,0 +1,56 @@
+import math
+from flask import Blueprint, Response, request, jsonify
+from jobs import get_job_runner
+
+# Create blueprint
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+def queue_full_response(error):
+    """503 response telling the client when to retry a refused job or upstream call."""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+@jobs_bp.route('/<job_id>')
+def job_status(job_id):
+    """Report the state of a background job and its result once finished."""
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+
+@jobs_bp.route('/<job_id>/events')
+def job_events(job_id):
+    """Stream a job's progress and state changes as Server-Sent Events.
+
+    Reconnecting clients send the last event id they saw (EventSource does
+    this itself via Last-Event-ID) and only receive what they missed; a
+    finished job replays its final state and ends the stream.
+    """
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        last_id = int(last_id)
+    except ValueError:
+        last_id = 0
+
+    return Response(
+        job.events.stream(last_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job, killing its subprocesses."""
+    if not get_job_runner().cancel(job_id):
+        return jsonify({'success': False, 'error': 'Job not found or already finished'}), 404
+    return jsonify({'success': True})
@@ -0,0 +1,120 @@
+import os
+from flask import Blueprint, current_app, abort, redirect, url_for, send_file
+from images import ArtworkThumbnailService, MIME_TYPES, MISSING_ARTWORK
+from waveforms import WaveformPeaksService
+from pcm_cache import PcmCache
+from storage import BlobStore
+from tasks import file_deleter
+
+# Create blueprint
+media_bp = Blueprint('media', __name__, url_prefix='/media')
+
+
+def get_thumbnail_service():
+    """Build the thumbnail service from the current app configuration."""
+    return ArtworkThumbnailService(
+        upload_folder=current_app.config['UPLOAD_FOLDER'],
+        thumbnail_folder=current_app.config['THUMBNAIL_FOLDER'],
+        widths=current_app.config['THUMBNAIL_WIDTHS'],
+        formats=current_app.config['THUMBNAIL_FORMATS']
+    )
+
+
+def get_peaks_service():
+    """Build the waveform peaks service from the current app configuration."""
+    return WaveformPeaksService(
+        upload_folder=current_app.config['UPLOAD_FOLDER'],
+        peaks_folder=current_app.config['PEAKS_FOLDER'],
+        resolutions=current_app.config['PEAKS_RESOLUTIONS'],
+        sample_rate=current_app.config['PEAKS_SAMPLE_RATE'],
+        bits=current_app.config['PEAKS_BITS']
+    )
+
+
+def get_pcm_cache():
+    """Build the decoded audio cache from the current app configuration."""
+    return PcmCache(
+        folder=current_app.config['PCM_CACHE_FOLDER'],
+        max_bytes=current_app.config['PCM_CACHE_MAX_BYTES']
+    )
+
+
+def has_artwork(filename):
+    """Check whether an artwork column holds a real file rather than a placeholder."""
+    return bool(filename) and filename not in MISSING_ARTWORK
+
+
+def track_media(track):
+    """Return every stored filename a track references."""
+    filenames = [track.file]
+    filenames.extend(name for name in (track.artwork, track.artwork_secondary) if has_artwork(name))
+    return filenames
+
+
+def rendition_filename(audio_filename):
+    """Name of the MP3 rendition derived from a stored audio file."""
+    return os.path.splitext(audio_filename)[0] + '.mp3'
+
+
+def purge_media(orphans):
+    """Delete orphaned blobs with their thumbnails, renditions and peaks."""
+    store = BlobStore(current_app.config['UPLOAD_FOLDER'])
+    thumbnail_service = get_thumbnail_service()
+    peaks_service = get_peaks_service()
+    for filename in store.purge(orphans):
+        thumbnail_service.remove(filename)
+        peaks_service.remove(filename)
+        rendition_path = os.path.join(current_app.config['RENDITION_FOLDER'], rendition_filename(filename))
+        if os.path.exists(rendition_path):
+            os.remove(rendition_path)
+
+
+def schedule_purge(orphans):
+    """Hand orphaned files to the background deleter once the transaction committed."""
+    orphans = [name for name in orphans if name]
+    if orphans:
+        file_deleter.submit(purge_media, orphans)
+
+
+@media_bp.route('/artwork/<filename>/<version>/<int:width>.<fmt>')
+def artwork_thumbnail(filename, version, width, fmt):
+    """Serve a resized artwork thumbnail with long-lived cache headers."""
+    service = get_thumbnail_service()
+    current_version = service.version(filename)
+    if not current_version:
+        abort(404)
+
+    # Stale versions point at the current one instead of serving new bytes
+    # under an old immutable URL
+    if version != current_version:
+        return redirect(url_for('media.artwork_thumbnail', filename=filename,
+                                version=current_version, width=width, fmt=fmt))
+
+    path = service.ensure(filename, width, fmt)
+    if not path:
+        abort(404)
+
+    response = send_file(path, mimetype=MIME_TYPES[fmt], conditional=True)
+    response.headers['Cache-Control'] = (
+        f"public, max-age={current_app.config['THUMBNAIL_CACHE_MAX_AGE']}, immutable"
+    )
+    return response
+
+
+@media_bp.app_template_global()
+def artwork_srcset(filename, fmt):
+    """Build a srcset attribute value for an artwork file in one format."""
+    service = get_thumbnail_service()
+    version = service.version(filename)
+    if not version or fmt not in service.formats:
+        return ''
+    return ', '.join(
+        f"{url_for('media.artwork_thumbnail', filename=filename, version=version, width=width, fmt=fmt)} {width}w"
+        for width in service.widths
+    )
+
+
+@media_bp.app_template_global()
+def artwork_formats():
+    """Return the (format, mime type) pairs thumbnails are generated in."""
+    return [(fmt, MIME_TYPES[fmt]) for fmt in get_thumbnail_service().formats]
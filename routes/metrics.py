@@ -0,0 +1,18 @@
+import hmac
+from flask import Blueprint, Response, request, current_app
+import metrics
+
+# Create blueprint
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def export_metrics():
+    """Expose the metrics of all web and worker processes to Prometheus.
+
+    With METRICS_TOKEN set, scrapers must send it as a bearer token.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
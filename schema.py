@@ -0,0 +1,32 @@
+from sqlalchemy import inspect, text
+from extensions import db
+
+
+def upgrade_schema():
+    """Create missing tables and add columns introduced since the database was created.
+
+    The app has no migration history, so new nullable or defaulted columns
+    are added in place with ALTER TABLE. Returns the list of changes made.
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect
+    changes = []
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}"
+                default = column.default
+                if default is not None and default.is_scalar:
+                    literal = column.type.literal_processor(dialect)
+                    ddl += f" DEFAULT {literal(default.arg) if literal else default.arg}"
+
+                conn.execute(text(ddl))
+                changes.append(f"{table.name}.{column.name}")
+
+    return changes
@@ -0,0 +1,354 @@
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from waveforms import decode_pcm
+from pcm_cache import PcmCache
+from profiling import Capture
+
+SAMPLE_RATE = 44100  # All demucs models work at 44.1 kHz stereo
+CHANNELS = 2
+ENCODER_ARGS = {
+    'mp3': ['-codec:a', 'libmp3lame', '-b:a', '320k'],
+    'flac': ['-codec:a', 'flac'],
+    'wav': ['-codec:a', 'pcm_s16le'],
+}
+
+# Imported once by the fork server the window workers are forked from
+PRELOAD = ['__main__', 'numpy', 'torch', 'demucs.pretrained', 'demucs.apply']
+
+# Model and input samples, loaded once per worker process by _init_worker
+_model = None
+_pcm = None
+
+
+def plan_windows(total, window, overlap):
+    """(start, end) sample ranges covering ``total`` samples.
+
+    Consecutive windows share exactly ``overlap`` samples, and the last one
+    is always longer than the overlap so its fade-in fits.
+    """
+    if total <= window:
+        return [(0, total)]
+    windows = []
+    start = 0
+    while start + window < total:
+        windows.append((start, start + window))
+        start += window - overlap
+    windows.append((start, total))
+    return windows
+
+
+def crossfade_weights(length, overlap, first, last):
+    """Per-sample weight of one window; overlapping ramps sum to one."""
+    weights = np.ones(length, dtype=np.float32)
+    ramp = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+    if not first:
+        weights[:overlap] = ramp
+    if not last:
+        weights[-overlap:] = ramp[::-1]
+    return weights
+
+
+def _init_worker(model_name, threads, pcm_path=None, total=None):
+    global _model, _pcm
+    import torch
+    from demucs.pretrained import get_model
+    # Each worker gets a fixed share of the cores instead of every process
+    # spawning a thread per core and fighting over them
+    torch.set_num_threads(threads)
+    _model = get_model(model_name)
+    _model.eval()
+    if pcm_path is not None:
+        # Mapped once, so the input stays readable even if the PCM cache
+        # evicts it while the separation is still running
+        _pcm = np.memmap(pcm_path, dtype='<i2', mode='r', shape=(total, CHANNELS))
+
+
+def separate_array(pcm, mean, std, options):
+    """Separate int16 samples of shape (samples, channels) with the loaded model.
+
+    Returns the source names and a (sources, channels, samples) array. In
+    two-stem mode every other source is summed into ``no_<stem>`` right
+    away, so only two stems are kept, moved around and encoded.
+    """
+    import torch
+    from demucs.apply import apply_model
+
+    wav = torch.from_numpy(pcm.T.astype(np.float32) / 32768.0)
+    # Normalise with statistics of the whole track, as demucs does for a
+    # single pass, so every window is scaled the same way
+    wav = (wav - mean) / std
+    with torch.no_grad():
+        sources = apply_model(
+            _model, wav[None], device='cpu', split=True, progress=False,
+            shifts=options['shifts'], overlap=options['split_overlap'], segment=options['segment']
+        )[0]
+    sources = (sources * std + mean).numpy()
+
+    names = list(_model.sources)
+    two_stems = options['two_stems']
+    if two_stems is None:
+        return names, sources
+    index = names.index(two_stems)
+    rest = sources.sum(axis=0) - sources[index]
+    return [two_stems, f"no_{two_stems}"], np.stack((sources[index], rest))
+
+
+def _separate_window(start, end, mean, std, options):
+    """Separate one window of the input. Runs in a worker process."""
+    return separate_array(_pcm[start:end], mean, std, options)
+
+
+def level_stats(pcm, block=SAMPLE_RATE * 10):
+    """Mean and standard deviation of the mono downmix of int16 stereo samples."""
+    total_sum, total_squares = 0.0, 0.0
+    for start in range(0, len(pcm), block):
+        mono = pcm[start:start + block].mean(axis=1) / 32768.0
+        total_sum += float(mono.sum())
+        total_squares += float(np.square(mono).sum())
+    mean = total_sum / len(pcm)
+    return mean, max((total_squares / len(pcm) - mean ** 2) ** 0.5, 1e-8)
+
+
+def encode_stem(samples, output_path, output_format='mp3', block=SAMPLE_RATE * 10):
+    """Encode a (channels, samples) float array through ffmpeg's stdin."""
+    process = subprocess.Popen(
+        ['ffmpeg', '-y', '-v', 'error', '-f', 'f32le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS),
+         '-i', '-', *ENCODER_ARGS[output_format], output_path],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    try:
+        for offset in range(0, samples.shape[1], block):
+            process.stdin.write(np.ascontiguousarray(samples[:, offset:offset + block].T, dtype='<f4').tobytes())
+    finally:
+        process.stdin.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg could not encode {output_path}: {stderr.decode('utf-8', errors='replace')}")
+
+
+def encode_stems(sources, paths, output_format='mp3'):
+    """Encode every stem straight to its final path, one ffmpeg process each, in parallel."""
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        futures = [pool.submit(encode_stem, sources[index], path, output_format) for index, path in enumerate(paths)]
+        for future in futures:
+            future.result()
+
+
+class SeparationEngine:
+    """Separates audio files into stems, in memory or over a pool of worker processes.
+
+    The input is decoded once. Inputs up to ``in_memory`` seconds stay in
+    memory and are separated in this process in a single pass, with all the
+    threads of the pool. Longer inputs spill to a temporary file and are
+    split into overlapping windows that the workers separate independently;
+    the windows are then cross-faded together in a memory-mapped output, so
+    peak memory depends on the window size and the windows in flight, not
+    on track length. Either way the stems are encoded directly into the
+    output directory and their exact paths returned.
+
+    With a ``pcm_cache`` the input is read from (or decoded once into) the
+    shared cache of decoded audio instead, whatever its length.
+
+    ``window`` and ``overlap`` are in seconds; ``threads`` is the number of
+    torch threads each of the ``workers`` processes may use. ``segment``,
+    ``shifts`` and ``split_overlap`` are passed on to demucs, which splits
+    every window further. With ``two_stems`` set to a source name only that
+    source and the sum of the others are produced.
+    """
+
+    def __init__(self, model='htdemucs', workers=2, threads=2, window=60, overlap=2, segment=7,
+                 shifts=1, split_overlap=0.25, two_stems=None, output_format='mp3', in_memory=360,
+                 pcm_cache=None):
+        self.model = model
+        self.pcm_cache = pcm_cache
+        self.in_memory = int(in_memory * SAMPLE_RATE)
+        self.workers = max(1, workers)
+        self.threads = max(1, threads)
+        self.window = int(window * SAMPLE_RATE)
+        self.overlap = int(overlap * SAMPLE_RATE)
+        self.options = {
+            'segment': segment,
+            'shifts': shifts,
+            'split_overlap': split_overlap,
+            'two_stems': two_stems
+        }
+        self.output_format = output_format
+        if self.overlap * 2 >= self.window:
+            raise ValueError("Separation window must be more than twice the overlap")
+        if output_format not in ENCODER_ARGS:
+            raise ValueError(f"Unsupported stem format: {output_format}")
+
+    def separate(self, input_path, output_dir, progress=None):
+        """Write one file per stem into ``output_dir``; returns {stem: path}."""
+        report = progress or (lambda stage, percent: None)
+        os.makedirs(output_dir, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(prefix='separation-') as work_dir, ExitStack() as stack:
+            report('decode', 0)
+            pcm_path = None
+            if self.pcm_cache is not None:
+                pcm = self.pcm_cache.get(input_path, SAMPLE_RATE, CHANNELS)
+                # Pinned until the workers are done mapping the cache file
+                pcm_path = stack.enter_context(self.pcm_cache.pinned(input_path, SAMPLE_RATE, CHANNELS))
+            if pcm_path is not None:
+                total = len(pcm)
+                mean, std = level_stats(pcm) if total else (0.0, 1.0)
+                if total > self.in_memory:
+                    pcm = None  # Windowed; the workers map the cache file themselves
+            else:
+                # No cache, or its entry was already evicted again
+                pcm_path = os.path.join(work_dir, 'input.pcm')
+                pcm, total, mean, std = self._decode(input_path, pcm_path)
+            if not total:
+                raise RuntimeError("The input contains no audio")
+
+            report('separate', 0)
+            if pcm is not None:
+                sources, stems = self._separate_in_memory(pcm, mean, std)
+                del pcm
+            else:
+                sources, stems = self._separate(pcm_path, total, mean, std, work_dir, report)
+            report('separate', 100)
+
+            report('encode', 0)
+            paths = [os.path.join(output_dir, f"{name}.{self.output_format}") for name in sources]
+            encode_stems(stems, paths, self.output_format)
+            report('encode', 100)
+            return dict(zip(sources, paths))
+
+    def _decode(self, input_path, pcm_path):
+        """Decode the input once, with its sample count and level statistics.
+
+        Samples are kept in memory up to the in-memory limit; past it they
+        spill to ``pcm_path`` and None is returned in their place.
+        """
+        blocks, spill = [], None
+        total, total_sum, total_squares = 0, 0.0, 0.0
+        try:
+            for block in decode_pcm(input_path, SAMPLE_RATE, channels=CHANNELS):
+                mono = block.mean(axis=1) / 32768.0
+                total += len(block)
+                total_sum += float(mono.sum())
+                total_squares += float(np.square(mono).sum())
+
+                if spill is None:
+                    blocks.append(block)
+                    if total <= self.in_memory:
+                        continue
+                    spill = open(pcm_path, 'wb')
+                    for pending in blocks:
+                        spill.write(pending.tobytes())
+                    blocks = None
+                else:
+                    spill.write(block.tobytes())
+        finally:
+            if spill is not None:
+                spill.close()
+
+        if not total:
+            return None, 0, 0.0, 1.0
+        mean = total_sum / total
+        std = max((total_squares / total - mean ** 2) ** 0.5, 1e-8)
+        pcm = np.concatenate(blocks) if blocks is not None else None
+        return pcm, total, mean, std
+
+    def _separate_in_memory(self, pcm, mean, std):
+        # One pass in this process: no pool start-up, no windows to
+        # cross-fade and no temporary files
+        _init_worker(self.model, self.workers * self.threads)
+        return separate_array(pcm, mean, std, self.options)
+
+    def _separate(self, pcm_path, total, mean, std, work_dir, report):
+        windows = plan_windows(total, self.window, self.overlap)
+        sources, output = None, None
+        done = 0
+
+        def accumulate(index, result):
+            nonlocal sources, output
+            sources, separated = result
+            start, end = windows[index]
+            if output is None:
+                shape = (separated.shape[0], CHANNELS, total)
+                output = np.memmap(os.path.join(work_dir, 'stems.f32'), dtype=np.float32, mode='w+', shape=shape)
+            weights = crossfade_weights(end - start, self.overlap, index == 0, index == len(windows) - 1)
+            output[:, :, start:end] += separated * weights
+
+        # Workers fork from a clean server process that imported torch and
+        # demucs once, so they neither inherit this process's threads nor
+        # each pay the imports, and share the libraries copy-on-write
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(PRELOAD)
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(windows)), mp_context=context,
+                                 initializer=_init_worker, initargs=(self.model, self.threads, pcm_path, total)) as pool:
+            pending = {}
+            queue = list(enumerate(windows))
+            while queue or pending:
+                # Keep at most two windows per worker in flight to bound memory
+                while queue and len(pending) < self.workers * 2:
+                    index, (start, end) = queue.pop(0)
+                    future = pool.submit(_separate_window, start, end, mean, std, self.options)
+                    pending[future] = index
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    accumulate(pending.pop(future), future.result())
+                    done += 1
+                    report('separate', 100 * done // len(windows))
+
+        output.flush()
+        return sources, output
+
+
+def main(argv=None):
+    """Command line entry point, run by separation jobs in a child process.
+
+    Prints ``progress <stage> <percent>`` lines and finally one
+    ``stem <name> <path>`` line per stem.
+    """
+    parser = argparse.ArgumentParser(description="Separate an audio file into stems.")
+    parser.add_argument('input')
+    parser.add_argument('--out', required=True, help="Directory for the stem files")
+    parser.add_argument('--model', default='htdemucs')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--window', type=float, default=60, help="Window length in seconds")
+    parser.add_argument('--overlap', type=float, default=2, help="Cross-fade between windows in seconds")
+    parser.add_argument('--segment', type=float, default=None, help="Demucs segment length in seconds")
+    parser.add_argument('--shifts', type=int, default=1, help="Random shifts averaged by demucs")
+    parser.add_argument('--split-overlap', type=float, default=0.25, help="Overlap between demucs segments")
+    parser.add_argument('--two-stems', default=None, help="Only separate this stem from the rest")
+    parser.add_argument('--format', default='mp3', choices=sorted(ENCODER_ARGS))
+    parser.add_argument('--in-memory', type=float, default=360, help="Longest input in seconds separated in one in-memory pass")
+    parser.add_argument('--pcm-cache', default=None, help="Folder of the shared decoded audio cache")
+    parser.add_argument('--pcm-cache-bytes', type=int, default=2 * 1024 ** 3)
+    parser.add_argument('--profile', default=None, help="Folder to write a cProfile/tracemalloc profile of the run to")
+    args = parser.parse_args(argv)
+
+    def report(stage, percent):
+        print(f"progress {stage} {percent}", flush=True)
+
+    engine = SeparationEngine(
+        args.model, args.workers, args.threads, args.window, args.overlap, args.segment,
+        shifts=args.shifts, split_overlap=args.split_overlap, two_stems=args.two_stems, output_format=args.format,
+        in_memory=args.in_memory,
+        pcm_cache=PcmCache(args.pcm_cache, args.pcm_cache_bytes) if args.pcm_cache else None
+    )
+    if args.profile:
+        with Capture(args.profile, 'separate', input=args.input):
+            stems = engine.separate(args.input, args.out, progress=report)
+    else:
+        stems = engine.separate(args.input, args.out, progress=report)
+    for name, path in stems.items():
+        print(f"stem {name} {path}", flush=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,124 +1,144 @@
 import os
-import gc
+import re
+import sys
 import uuid
 import time
+import shutil
+import logging
 import threading
-import torch
-from flask import url_for
-from utils import save_uploaded_file, cleanup_file, convert_audio
+from contextlib import nullcontext
+from flask import current_app
+from extensions import db
+from utils import cleanup_file, ffmpeg_convert_args, ffmpeg_progress_parser, probe_audio, record_conversion, PCM_SAMPLE_RATE
+from storage import BlobStore
+from mixing import StemMixer, stem_gains
+from jobs import get_job_runner, progress_reporter, JobQueueFull
+from metrics import StageTimer
+import profiling
+
+logger = logging.getLogger(__name__)
 
 class AudioConversionService:
     """Service for handling audio file conversions."""
     
-    def __init__(self, upload_folder, converted_folder):
+    def __init__(self, upload_folder, converted_folder, pcm_cache=None):
         self.upload_folder = upload_folder
         self.converted_folder = converted_folder
+        self.pcm_cache = pcm_cache
     
-    def convert_file(self, audio_file, target_format):
-        """Convert an uploaded audio file to the target format."""
-        input_path = None
-        output_path = None
+    def submit_conversion(self, audio_file, target_format, loudness_target=None):
+        """Store an uploaded audio file and queue its conversion to the target format.
+
+        Returns as soon as the job is queued; the job result holds the
+        download URL. Raises JobQueueFull when too many conversions wait.
+        """
+        # Validate input
+        if not audio_file or not hasattr(audio_file, 'filename') or not audio_file.filename:
+            logger.warning("Invalid file: audio_file is None or has no filename")
+            return {
+                'success': False,
+                'error': 'Invalid file'
+            }
+            
+        # Validate target format
+        if target_format not in ['mp3', 'wav', 'flac']:
+            logger.warning("Invalid format: %s", target_format)
+            return {
+                'success': False,
+                'error': f'Invalid format: {target_format}'
+            }
+        
+        # Store the upload, identical files share one copy on disk. The job
+        # releases it once the conversion finished
+        logger.debug("Saving uploaded file: %s", audio_file.filename)
+        store = BlobStore(self.upload_folder)
+        stored_filename = store.put(audio_file)
+        db.session.commit()
+        
+        # Create output path
+        file_uuid = str(uuid.uuid4())
+        original_name = os.path.splitext(audio_file.filename)[0]
+        output_filename = f"{original_name}.{target_format}"  # User-friendly name
+        server_output_filename = f"{file_uuid}_{output_filename}"  # Server storage name
+        output_path = os.path.join(self.converted_folder, server_output_filename)
+        os.makedirs(self.converted_folder, exist_ok=True)
+        logger.debug("Output path: %s", output_path)
         
         try:
-            print("=== CONVERT_FILE METHOD CALLED ===")
-            # Validate input
-            if not audio_file or not hasattr(audio_file, 'filename') or not audio_file.filename:
-                print("Invalid file: audio_file is None or has no filename")
-                return {
-                    'success': False,
-                    'error': 'Invalid file'
-                }
-                
-            # Validate target format
-            if target_format not in ['mp3', 'wav', 'flac']:
-                print(f"Invalid format: {target_format}")
-                return {
-                    'success': False,
-                    'error': f'Invalid format: {target_format}'
-                }
-            
-            # Save the uploaded file
-            print(f"Saving uploaded file: {audio_file.filename}")
-            file_uuid, input_path = save_uploaded_file(audio_file, self.upload_folder)
-            print(f"File saved to: {input_path}")
-            
-            # Verify the file was saved
-            if not os.path.exists(input_path):
-                print(f"File not saved: {input_path}")
-                return {
-                    'success': False,
-                    'error': 'Failed to save uploaded file'
-                }
-            
-            # Create output path
-            original_filename = audio_file.filename
-            original_name = os.path.splitext(original_filename)[0]
-            output_filename = f"{original_name}.{target_format}"  # User-friendly name
-            server_output_filename = f"{file_uuid}_{output_filename}"  # Server storage name
-            output_path = os.path.join(self.converted_folder, server_output_filename)
-            print(f"Output path: {output_path}")
-            
-            # Ensure the output directory exists
-            print(f"Ensuring output directory exists: {os.path.dirname(output_path)}")
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            app = current_app._get_current_object()
+            job = get_job_runner().submit(
+                'convert', self._run_conversion,
+                stored_filename, output_path, output_filename, target_format, loudness_target,
+                on_finish=lambda job: self._release_upload(app, stored_filename)
+            )
+        except JobQueueFull:
+            self._release_upload(current_app._get_current_object(), stored_filename)
+            raise
+        
+        return {
+            'success': True,
+            'job_id': job.id
+        }
+    
+    async def _run_conversion(self, job, stored_filename, output_path, output_filename, target_format, loudness_target):
+        """Job body: run ffmpeg without blocking the event loop."""
+        runner = get_job_runner()
+        input_path = os.path.join(self.upload_folder, stored_filename)
+        try:
+            job.progress('probe')
+            info = await runner.run_blocking(probe_audio, input_path)
+            if not info:
+                raise RuntimeError('The uploaded file is not a readable audio file')
             
-            # Convert the file
-            print(f"Converting file from {input_path} to {output_path}")
-            if convert_audio(input_path, output_path, target_format):
-                # Verify the output file was created
-                if not os.path.exists(output_path):
-                    print(f"Output file not created: {output_path}")
-                    return {
-                        'success': False,
-                        'error': 'Conversion completed but output file not found'
-                    }
-                
-                print(f"File converted successfully: {output_path}")
+            # Reuse audio another tool already decoded, but only when it is
+            # exactly the source's samples (16-bit, same rate and layout) and
+            # there are no tags or cover art that only the original carries.
+            # The pin keeps the cached file from eviction while ffmpeg reads it
+            pin = nullcontext()
+            if self.pcm_cache is not None and self._pcm_matches(info):
+                pin = self.pcm_cache.pinned(input_path, PCM_SAMPLE_RATE, channels=2)
+            with pin as cached_path:
+                source_path, input_args = input_path, ()
+                if cached_path:
+                    source_path, input_args = cached_path, ('-f', 's16le', '-ar', str(PCM_SAMPLE_RATE), '-ac', '2')
                 
-                # Generate download URL - use a direct approach without url_for
-                try:
-                    # Hardcode the URL path
-                    download_url = f"/static/converted/{server_output_filename}"
-                    print(f"Generated URL: {download_url}")
-                except Exception as url_error:
-                    print(f"Error generating URL: {str(url_error)}")
-                    import traceback
-                    traceback.print_exc()
-                    return {
-                        'success': False,
-                        'error': f'Error generating download URL: {str(url_error)}'
-                    }
-                
-                # Schedule cleanup
-                print(f"Scheduling cleanup for: {output_path}")
-                self._schedule_file_cleanup(output_path, 15)  # 15 seconds
-                
-                return {
-                    'success': True,
-                    'download_url': download_url,
-                    'filename': output_filename
-                }
-            else:
-                print("Conversion failed")
-                return {
-                    'success': False,
-                    'error': 'Conversion failed'
-                }
-        
-        except Exception as e:
-            print(f"Conversion error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+                logger.debug("Converting file from %s to %s", source_path, output_path)
+                job.progress('convert', 0)
+                started = time.perf_counter()
+                await runner.run_process(
+                    *ffmpeg_convert_args(source_path, output_path, target_format, loudness_target, progress=True,
+                                         input_args=input_args),
+                    on_line=progress_reporter(job, 'convert', ffmpeg_progress_parser(info['duration']))
+                )
+                record_conversion('convert', time.perf_counter() - started, source_path, output_path)
+            if not os.path.exists(output_path):
+                raise RuntimeError('Conversion completed but output file not found')
+            logger.info("File converted: %s", output_path)
+            
+            # Schedule cleanup
+            self._schedule_file_cleanup(output_path, 60)
             return {
-                'success': False,
-                'error': f'Conversion error: {str(e)}'
+                'download_url': f"/static/converted/{os.path.basename(output_path)}",
+                'filename': output_filename
             }
-        
-        finally:
-            # Clean up input file
-            if input_path and os.path.exists(input_path):
-                print(f"Cleaning up input file: {input_path}")
-                cleanup_file(input_path)
+        except BaseException:
+            # Don't leave half-written output behind on failure or cancellation
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+    
+    @staticmethod
+    def _pcm_matches(info):
+        """Whether converting the cached PCM gives the same output as converting the source."""
+        return (
+            info['sample_rate'] == PCM_SAMPLE_RATE and info['channels'] == 2
+            and info['sample_format'] in ('s16', 's16p') and not info['has_metadata']
+        )
+    
+    def _release_upload(self, app, stored_filename):
+        """Drop the conversion's reference to its stored upload."""
+        with app.app_context():
+            BlobStore(self.upload_folder).discard(stored_filename)
     
     def _schedule_file_cleanup(self, file_path, delay_seconds):
         """Schedule a file for deletion after a delay."""
@@ -131,115 +151,166 @@ class AudioConversionService:
         cleanup_thread.start()
 
 
+# Names the separator shows for the model's sources
+STEM_DISPLAY_NAMES = {'other': 'melody', 'no_vocals': 'instrumental'}
+
+# Separation runs in its own process, see separation.py
+SEPARATION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'separation.py')
+
+
+def separation_args(options):
+    """Command line options for separation.py from a preset plus engine settings."""
+    args = [
+        "--model", options['model'],
+        "--shifts", str(options['shifts']),
+        "--split-overlap", str(options['split_overlap']),
+        "--format", options['format'],
+        "--workers", str(options['workers']),
+        "--threads", str(options['threads']),
+        "--window", str(options['window']),
+        "--overlap", str(options['overlap']),
+        "--in-memory", str(options['in_memory'])
+    ]
+    if options.get('pcm_cache'):
+        args += ["--pcm-cache", options['pcm_cache'], "--pcm-cache-bytes", str(options['pcm_cache_bytes'])]
+    if options.get('segment'):
+        args += ["--segment", str(options['segment'])]
+    if options.get('two_stems'):
+        args += ["--two-stems", options['two_stems']]
+    return args
+
+
 class StemSeparationService:
     """Service for handling stem separation."""
     
-    def __init__(self, upload_folder, converted_folder):
+    def __init__(self, upload_folder, converted_folder, pcm_cache=None):
         self.upload_folder = upload_folder
         self.converted_folder = converted_folder
+        self.pcm_cache = pcm_cache
+    
+    def submit_separation(self, audio_file, preset, two_stems=None):
+        """Store an uploaded audio file and queue its separation into stems.
+
+        ``preset`` names an entry of SEPARATION_PRESETS; ``two_stems='vocals'``
+        only splits vocals from an instrumental. Returns as soon as the job is
+        queued; the job result holds the stem URLs. Raises JobQueueFull when
+        too many separations wait.
+        """
+        # Store the upload, identical files share one copy on disk. The job
+        # releases it once demucs finished
+        store = BlobStore(self.upload_folder)
+        stored_filename = store.put(audio_file)
+        db.session.commit()
+        
+        # Name the output folder after this request since stored inputs are shared
+        output_dir = str(uuid.uuid4())
+        options = dict(
+            current_app.config['SEPARATION_PRESETS'][preset],
+            workers=current_app.config['SEPARATION_WORKERS'],
+            threads=current_app.config['SEPARATION_THREADS'],
+            window=current_app.config['SEPARATION_WINDOW'],
+            overlap=current_app.config['SEPARATION_OVERLAP'],
+            in_memory=current_app.config['SEPARATION_IN_MEMORY'],
+            two_stems=two_stems
+        )
+        if self.pcm_cache is not None:
+            options.update(pcm_cache=self.pcm_cache.folder, pcm_cache_bytes=self.pcm_cache.max_bytes)
+        try:
+            app = current_app._get_current_object()
+            job = get_job_runner().submit(
+                'separate', self._run_separation, stored_filename, output_dir, options,
+                on_finish=lambda job: self._release_upload(app, stored_filename)
+            )
+        except JobQueueFull:
+            self._release_upload(current_app._get_current_object(), stored_filename)
+            raise
+        
+        return {
+            'success': True,
+            'job_id': job.id
+        }
     
-    def separate_stems(self, audio_file):
-        """Separate an audio file into stems."""
-        import demucs.separate
+    async def _run_separation(self, job, stored_filename, output_dir, options):
+        """Job body: run the separation engine in a child process and collect the stem URLs."""
+        runner = get_job_runner()
+        input_path = os.path.join(self.upload_folder, stored_filename)
+        session_path = os.path.join(self.converted_folder, 'htdemucs', output_dir)
         
-        input_path = None
+        # The engine's progress lines mark where its stages start
+        stages = StageTimer('separate')
         
+        def on_line(line):
+            match = re.match(r'progress (\w+) (\d+)', line)
+            if match:
+                stages.start(match.group(1))
+                job.progress(match.group(1), int(match.group(2)))
+        
+        job.progress('decode', 0)
         try:
-            # Save the uploaded file
-            file_uuid, input_path = save_uploaded_file(audio_file, self.upload_folder)
-            output_dir = file_uuid + "_" + os.path.splitext(os.path.basename(input_path))[0]
-            
-            # Clear memory
-            del audio_file
-            gc.collect()
-            
-            # Configure demucs for separation
-            demucs.separate.main([
-                "--mp3",
-                "-n", "htdemucs",
-                "--segment", "7",
-                "-d", "cpu",
-                "--overlap", "0.1",
-                "--out", self.converted_folder,
-                input_path
-            ])
-            
-            # Generate URLs for stems
-            stem_paths = {}
-            source_stems = ['drums', 'bass', 'vocals', 'other']
-            display_stems = ['drums', 'bass', 'vocals', 'melody']
-            
-            # Find output directory
-            possible_dirs = [
-                output_dir,
-                file_uuid,
-                os.path.splitext(os.path.basename(input_path))[0]
-            ]
-            
-            found_dir = None
-            for dir_name in possible_dirs:
-                check_path = os.path.join(self.converted_folder, 'htdemucs', dir_name)
-                if os.path.exists(check_path):
-                    found_dir = dir_name
-                    break
-            
-            if not found_dir:
-                raise Exception("Output directory not found")
-            
-            # Get stem URLs
-            for source_stem, display_stem in zip(source_stems, display_stems):
-                stem_filename = f"{source_stem}.mp3"
-                full_path = os.path.join(self.converted_folder, 'htdemucs', found_dir, stem_filename)
-                if os.path.exists(full_path):
-                    relative_path = os.path.join('htdemucs', found_dir, stem_filename)
-                    stem_paths[display_stem] = url_for('static', filename=f'converted/{relative_path}')
-            
-            # Force garbage collection
-            gc.collect()
-            try:
-                if hasattr(torch, 'cuda') and torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-            except Exception as e:
-                print(f"Warning: Could not clear CUDA cache: {str(e)}")
-            
-            return {
-                'success': True,
-                'stems': stem_paths,
-                'session_id': found_dir
-            }
-            
-        except Exception as e:
-            print(f"Separation error: {str(e)}")
-            import traceback
-            print(f"Full error details: {traceback.format_exc()}")
-            return {
-                'success': False,
-                'error': 'Failed to process audio file. Please try again with a different file.'
-            }
+            # A child process keeps torch out of the web worker and can be
+            # killed, with its worker pool, if the job is cancelled
+            profile_folder = profiling.current.get()
+            output = await runner.run_process(
+                sys.executable, SEPARATION_SCRIPT, input_path,
+                "--out", session_path,
+                *separation_args(options),
+                *(("--profile", profile_folder) if profile_folder else ()),
+                on_line=on_line
+            )
+        except BaseException:
+            if os.path.exists(session_path):
+                shutil.rmtree(session_path, ignore_errors=True)
+            raise
         finally:
-            # Clean up input file regardless of success or failure
-            if input_path and os.path.exists(input_path):
-                print(f"Cleaning up input file: {input_path}")
-                cleanup_file(input_path)
+            stages.stop()
+        
+        # Generate URLs for stems
+        stem_paths = {}
+        for line in output.splitlines():
+            if line.startswith('stem '):
+                _, stem, path = line.split(' ', 2)
+                stem_paths[STEM_DISPLAY_NAMES.get(stem, stem)] = f"/static/converted/htdemucs/{output_dir}/{os.path.basename(path)}"
+        
+        if not stem_paths:
+            raise Exception("Separation produced no stems")
+        
+        return {
+            'stems': stem_paths,
+            'session_id': output_dir
+        }
+    
+    def _release_upload(self, app, stored_filename):
+        """Drop the separation's reference to its stored upload."""
+        with app.app_context():
+            BlobStore(self.upload_folder).discard(stored_filename)
+    
+    def render_mix(self, session_id, gains_db, muted=(), soloed=()):
+        """Mix a separation's stems with per-stem gain in dB, mutes and solos.
+
+        Stems are named as the separator shows them. Returns the WAV size
+        and a generator of its chunks, or None if the session is gone.
+        """
+        session_path = os.path.join(self.converted_folder, 'htdemucs', session_id)
+        if not os.path.isdir(session_path):
+            return None
+        
+        mixer = StemMixer(session_path, self.pcm_cache)
+        stems = {STEM_DISPLAY_NAMES.get(stem, stem): stem for stem in mixer.stems()}
+        gains = stem_gains(list(stems), gains_db, muted, soloed)
+        return mixer.render(dict(zip(stems.values(), gains)))
     
     def cleanup_session(self, session_id):
         """Clean up stem separation session files."""
         try:
-            print(f"=== CLEANUP_SESSION METHOD CALLED for session {session_id} ===")
             output_dir = os.path.join(self.converted_folder, 'htdemucs', session_id)
-            print(f"Checking if directory exists: {output_dir}")
             
             if os.path.exists(output_dir):
-                print(f"Directory exists, removing: {output_dir}")
-                import shutil
                 shutil.rmtree(output_dir)
-                print(f"Successfully removed directory: {output_dir}")
+                logger.debug("Removed separation session %s", output_dir)
                 return {'success': True}
             
-            print(f"Directory does not exist: {output_dir}")
+            logger.debug("Separation session already removed: %s", output_dir)
             return {'success': True, 'message': 'Directory already cleaned'}
         except Exception as e:
-            print(f"Cleanup error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Cleanup of separation session %s failed", session_id)
             return {'success': False, 'error': str(e)} 
\ No newline at end of file
@@ -36,34 +36,14 @@ function getSelectedTrackIds() {
             return;
         }
 
-        try {
-            const response = await fetch('/download_tracks', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ track_ids: trackIds })
-            });
-
-            const data = await response.json();
-
-            if (data.success && data.files) {
-                // Download each file
-                data.files.forEach(file => {
-                    const link = document.createElement('a');
-                    link.href = file.url;
-                    link.download = file.name + '.mp3'; // Assuming MP3 format
-                    document.body.appendChild(link);
-                    link.click();
-                    document.body.removeChild(link);
-                });
-            } else {
-                alert(data.message || 'Error preparing downloads');
-            }
-        } catch (error) {
-            console.error('Error:', error);
-            alert('Error downloading tracks');
-        }
+        // The server streams every selected track as a single zip, which the
+        // browser can pause and resume like any other download
+        const link = document.createElement('a');
+        link.href = '/download_tracks/export?ids=' + encodeURIComponent(trackIds.join(','));
+        link.download = 'nobz-tracks.zip';
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
     }
 
     function deleteSelected() {
@@ -96,6 +76,49 @@ function getSelectedTrackIds() {
         }
     }
 
+    function bulkAction(operation, description) {
+        const trackIds = getSelectedTrackIds();
+        if (trackIds.length === 0) {
+            alert('Please select tracks first');
+            return;
+        }
+
+        if (!confirm(`Are you sure you want to ${description} ${trackIds.length} track(s)?`)) {
+            return;
+        }
+
+        fetch('/admin/bulk/' + operation, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ track_ids: trackIds })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                alert('Error: ' + data.message);
+                return;
+            }
+
+            // Summarise the per-track results, e.g. "3 queued, 1 not_found"
+            const counts = {};
+            Object.values(data.results).forEach(status => {
+                counts[status] = (counts[status] || 0) + 1;
+            });
+            const summary = Object.entries(counts).map(([status, count]) => `${count} ${status}`).join(', ');
+            alert(`Done: ${summary}`);
+
+            if (operation.startsWith('clear')) {
+                location.reload();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('Error running bulk operation');
+        });
+    }
+
 // Add event listeners for remove artwork buttons
 document.addEventListener('DOMContentLoaded', function() {
     const removeButtons = document.querySelectorAll('.remove-artwork-btn');
@@ -132,6 +155,9 @@ async function removeArtwork(event) {
                     '.admin-track-artwork-small' : '.admin-track-artwork-secondary-small');
                 const img = artworkContainer.querySelector('img');
                 
+                // Drop the thumbnail sources so the placeholder below is shown
+                artworkContainer.querySelectorAll('picture source').forEach(source => source.remove());
+                
                 // Update the image source to the default "No Artwork" image
                 img.src = artworkType === 'primary' ? 
                     '/static/uploads/No Artwork' : 
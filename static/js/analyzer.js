@@ -9,6 +9,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const resultsSection = document.querySelector('.results-section');
     const tempoValue = document.querySelector('.tempo-value');
     const keyValue = document.querySelector('.key-value');
+    const loudnessValue = document.querySelector('.loudness-value');
 
     console.log('Analyzer JS loaded');
     console.log('Elements found:', {
@@ -103,6 +104,59 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 3000);
     }
 
+    function showProgress(stage, percent) {
+        statusText.textContent = describeProgress(stage, percent);
+        if (percent !== null && percent !== undefined) {
+            progressBar.style.width = `${percent}%`;
+        }
+    }
+
+    function showResults(data) {
+        progressBar.style.width = '100%';
+        statusText.textContent = 'Analysis complete!';
+        
+        // Display results
+        resultsSection.style.display = 'flex';
+        tempoValue.textContent = `${data.tempo} BPM`;
+        keyValue.textContent = data.key;
+        if (loudnessValue) {
+            loudnessValue.textContent = data.loudness !== null && data.loudness !== undefined
+                ? `${data.loudness.toFixed(1)} LUFS`
+                : '--';
+        }
+        
+        // Hide progress after a delay
+        setTimeout(() => {
+            analysisStatus.style.display = 'none';
+        }, 3000);
+    }
+
+    // Follow an analysis job; it is remembered for this tab so a reload
+    // re-attaches to it instead of analyzing the file again
+    async function followAnalysis(eventsUrl) {
+        analysisStatus.style.display = 'block';
+        statusText.style.color = '#F5F5DC';
+        analyzeBtn.disabled = true;
+        try {
+            const result = await followJob(eventsUrl, {
+                onProgress: showProgress,
+                storageKey: 'analyzer-job'
+            });
+            showResults(result);
+        } catch (error) {
+            console.error('Analysis error:', error);
+            showError(error.message || 'Error during analysis');
+        } finally {
+            analyzeBtn.disabled = !selectedFile;
+        }
+    }
+
+    const pendingAnalysis = resumeJob('analyzer-job');
+    if (pendingAnalysis) {
+        statusText.textContent = 'Resuming analysis...';
+        followAnalysis(pendingAnalysis);
+    }
+
     analyzeBtn.addEventListener('click', async () => {
         console.log('Analyze button clicked');
         if (!selectedFile) {
@@ -118,13 +172,12 @@ document.addEventListener('DOMContentLoaded', function() {
         analysisStatus.style.display = 'block';
         progressBar.style.width = '0%';
         statusText.style.color = '#F5F5DC';
-        statusText.textContent = 'Analyzing...';
+        statusText.textContent = 'Uploading...';
         analyzeBtn.disabled = true;
         resultsSection.style.display = 'none';
 
         try {
             console.log('Starting analysis...');
-            progressBar.style.width = '50%';
             
             // Add a timestamp to the URL to prevent caching
             const timestamp = new Date().getTime();
@@ -134,46 +187,29 @@ document.addEventListener('DOMContentLoaded', function() {
             });
             
             console.log('Response received:', response.status);
-            console.log('Response headers:', [...response.headers.entries()]);
-            
-            if (!response.ok) {
-                throw new Error('Server error: ' + response.status);
-            }
             
             // Try to parse as JSON
             const data = await response.json().catch(error => {
                 console.error('JSON parse error:', error);
-                throw new Error('Failed to parse server response');
+                throw new Error('Server error: ' + response.status);
             });
             
             console.log('Parsed data:', data);
 
-            if (data && data.success) {
-                progressBar.style.width = '100%';
-                statusText.textContent = 'Analysis complete!';
-                
-                // Display results
-                resultsSection.style.display = 'flex';
-                tempoValue.textContent = `${data.tempo} BPM`;
-                keyValue.textContent = data.key;
-                
-                // Reset form
-                fileInput.value = '';
-                selectedFile = null;
-                fileMsg.textContent = '';
-                
-                // Hide progress after a delay
-                setTimeout(() => {
-                    analysisStatus.style.display = 'none';
-                }, 3000);
-            } else {
-                showError(data && data.error ? data.error : 'Analysis failed');
+            if (!data || !data.success) {
+                throw new Error(data && data.error ? data.error : 'Analysis failed');
             }
+            
+            // Reset form; the analysis runs in the background
+            fileInput.value = '';
+            selectedFile = null;
+            fileMsg.textContent = '';
+            statusText.textContent = 'Queued...';
+            await followAnalysis(data.events_url);
         } catch (error) {
             console.error('Analysis error:', error);
             showError(error.message || 'Error during analysis');
-        } finally {
             analyzeBtn.disabled = false;
         }
     });
-});
\ No newline at end of file
+});
@@ -159,6 +159,10 @@ window.addEventListener('DOMContentLoaded', function() {
         var formData = new FormData();
         formData.append('audio_file', selectedFile);
         formData.append('target_format', selectedFormat);
+        var normalizeCheckbox = document.getElementById('normalize-loudness');
+        if (normalizeCheckbox && normalizeCheckbox.checked) {
+            formData.append('normalize', 'true');
+        }
         
         // Show conversion status
         conversionStatus.style.display = 'block';
@@ -168,9 +172,6 @@ window.addEventListener('DOMContentLoaded', function() {
         statusText.style.color = '#F5F5DC'; // Reset color
         convertButton.setAttribute('disabled', 'disabled');
         
-        // Animate progress bar to show activity
-        progressBar.style.width = '50%';
-        
         console.log('Sending conversion request...');
         
         // Add a timestamp to the URL to prevent caching
@@ -195,6 +196,27 @@ window.addEventListener('DOMContentLoaded', function() {
                 throw new Error('Failed to parse server response');
             });
         })
+        .then(function(data) {
+            if (!data || !data.success) {
+                return data;
+            }
+            // The conversion runs in the background; follow its job
+            statusText.textContent = 'Queued...';
+            return followJob(data.events_url, {
+                onProgress: function(stage, percent) {
+                    statusText.textContent = describeProgress(stage, percent);
+                    if (percent !== null && percent !== undefined) {
+                        progressBar.style.width = percent + '%';
+                    }
+                }
+            }).then(function(result) {
+                return {
+                    success: true,
+                    download_url: result.download_url,
+                    filename: result.filename
+                };
+            });
+        })
         .then(function(data) {
             console.log('Data received:', data);
             if (data && data.success) {
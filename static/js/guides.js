@@ -8,8 +8,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const stopResponseBtn = document.getElementById('stopResponseBtn');
 
     let isWaitingForResponse = false;
-    let shouldStopTyping = false;
-    let currentTypewriterTimeout = null;
+    let currentRequest = null;
 
     // Initially disable the stop button since no response is in progress
     stopResponseBtn.disabled = true;
@@ -19,47 +18,27 @@ document.addEventListener('DOMContentLoaded', function() {
         chatMessages.scrollTop = chatMessages.scrollHeight;
     }
 
-    // Type out the message gradually with stop functionality
-    function typeMessage(messageDiv, message, index = 0) {
-        if (shouldStopTyping) {
-            shouldStopTyping = false;
-            return;
-        }
-
-        if (index < message.length) {
-            messageDiv.innerHTML = message.slice(0, index + 1);
-            index++;
-            currentTypewriterTimeout = setTimeout(() => typeMessage(messageDiv, message, index), 50);
-        } else {
-            currentTypewriterTimeout = null;
-            isWaitingForResponse = false;
-        }
+    // Turn the bot's plain text answer into HTML
+    function formatAnswer(message) {
+        message = message.replace(/\n/g, '<br>');
+        message = message.replace(/Alex/g, '<strong>Alex</strong>');
+        // Convert markdown lists to HTML
+        message = message.replace(/^\s*[\-\*]\s(.+)/gm, '<li>$1</li>');
+        message = message.replace(/(<li>.*<\/li>)/s, '<ul>$1</ul>');
+        // Convert numbered lists
+        message = message.replace(/^\s*\d+\.\s(.+)/gm, '<li>$1</li>');
+        message = message.replace(/(<li>.*<\/li>)/s, '<ol>$1</ol>');
+        return message;
     }
 
     // Add message to chat
     function addMessage(message, isUser = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = isUser ? 'user-message' : 'bot-message';
-        
-        if (!isUser) {
-            message = message.replace(/\n/g, '<br>');
-            message = message.replace(/Alex/g, '<strong>Alex</strong>');
-            // Convert markdown lists to HTML
-            message = message.replace(/^\s*[\-\*]\s(.+)/gm, '<li>$1</li>');
-            message = message.replace(/(<li>.*<\/li>)/s, '<ul>$1</ul>');
-            // Convert numbered lists
-            message = message.replace(/^\s*\d+\.\s(.+)/gm, '<li>$1</li>');
-            message = message.replace(/(<li>.*<\/li>)/s, '<ol>$1</ol>');
-        }
-
+        messageDiv.innerHTML = isUser ? message : formatAnswer(message);
         chatMessages.appendChild(messageDiv);
         scrollToBottom();
-
-        if (!isUser) {
-            typeMessage(messageDiv, message);
-        } else {
-            messageDiv.innerHTML = message;
-        }
+        return messageDiv;
     }
 
     // Show loading indicator
@@ -80,12 +59,35 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    // Send message to API
+    // Read Server-Sent Events from a fetch response, calling onEvent(event, data)
+    async function readEvents(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+            frames.forEach(frame => {
+                let event = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                if (data) onEvent(event, JSON.parse(data));
+            });
+        }
+    }
+
+    // Send message to API and show the answer as it streams in
     async function sendMessage(message) {
         if (!message.trim() || isWaitingForResponse) return;
 
         isWaitingForResponse = true;
-        shouldStopTyping = false;
+        currentRequest = new AbortController();
 
         // Enable stop button when sending message
         stopResponseBtn.disabled = false;
@@ -97,45 +99,51 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading indicator
         showLoading();
 
+        let answer = '';
+        let answerDiv = null;
         try {
             const response = await fetch('/api/chat', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
-                body: JSON.stringify({ message: message })
+                body: JSON.stringify({ message: message, stream: true }),
+                signal: currentRequest.signal
             });
 
             if (!response.ok) {
                 throw new Error('Network response was not ok');
             }
 
-            const data = await response.json();
-            
-            // Remove loading indicator
+            await readEvents(response, (event, data) => {
+                if (event === 'token') {
+                    if (!answerDiv) {
+                        removeLoading();
+                        answerDiv = addMessage('');
+                    }
+                    answer += data.text;
+                    answerDiv.innerHTML = formatAnswer(answer);
+                    scrollToBottom();
+                } else if (event === 'error') {
+                    throw new Error(data.answer);
+                }
+            });
             removeLoading();
 
-            // Only add bot response if we haven't stopped
-            if (!shouldStopTyping) {
-                addMessage(data.answer);
-            }
-
-            // Disable stop button after response is complete
-            if (!isWaitingForResponse) {
-                stopResponseBtn.disabled = true;
-            }
-
         } catch (error) {
-            console.error('Error:', error);
             removeLoading();
-            if (!shouldStopTyping) {
+            // Stopping aborts the request, which also stops the generation on the server
+            if (error.name !== 'AbortError') {
+                console.error('Error:', error);
                 addMessage('Sorry, I encountered an error. Please try again in a moment.');
             }
-            // Disable stop button on error
-            stopResponseBtn.disabled = true;
         }
 
+        currentRequest = null;
         isWaitingForResponse = false;
+        // Disable stop button after response is complete
+        stopResponseBtn.disabled = true;
     }
 
     // Event listeners
@@ -165,13 +173,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // New Chat button event listener
     newChatBtn.addEventListener('click', () => {
-        // Stop any ongoing typewriter effect
-        if (currentTypewriterTimeout) {
-            clearTimeout(currentTypewriterTimeout);
-            currentTypewriterTimeout = null;
+        // Stop any ongoing answer and let the server forget the conversation
+        if (currentRequest) {
+            currentRequest.abort();
         }
-        shouldStopTyping = true;
-        isWaitingForResponse = false;
+        fetch('/api/chat', { method: 'DELETE' });
         stopResponseBtn.disabled = true;
         
         chatMessages.innerHTML = `
@@ -185,13 +191,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Stop Response button event listener
     stopResponseBtn.addEventListener('click', () => {
-        // Stop the typewriter effect
-        if (currentTypewriterTimeout) {
-            clearTimeout(currentTypewriterTimeout);
-            currentTypewriterTimeout = null;
+        if (currentRequest) {
+            currentRequest.abort();
         }
-        shouldStopTyping = true;
-        isWaitingForResponse = false;
         removeLoading();
         
         // Add a message indicating the response was stopped
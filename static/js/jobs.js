@@ -0,0 +1,71 @@
+// Follow background jobs through their Server-Sent Events stream.
+//
+// followJob(eventsUrl, options) returns a promise that resolves with the job
+// result or rejects with its error. options.onProgress(stage, percent) is
+// called as the job reports progress. With options.storageKey the job is
+// remembered in sessionStorage until it finishes, so a page reload can pick
+// it up again with resumeJob(storageKey) instead of starting over.
+(function() {
+    function followJob(eventsUrl, options) {
+        options = options || {};
+        if (options.storageKey) {
+            sessionStorage.setItem(options.storageKey, eventsUrl);
+        }
+
+        return new Promise(function(resolve, reject) {
+            // EventSource reconnects by itself after network hiccups and sends
+            // the last event id, so the server only replays what was missed
+            var source = new EventSource(eventsUrl);
+
+            function finish() {
+                source.close();
+                if (options.storageKey) {
+                    sessionStorage.removeItem(options.storageKey);
+                }
+            }
+
+            source.addEventListener('progress', function(e) {
+                var data = JSON.parse(e.data);
+                if (options.onProgress) {
+                    options.onProgress(data.stage, data.percent);
+                }
+            });
+
+            source.addEventListener('state', function(e) {
+                var job = JSON.parse(e.data);
+                if (job.state === 'done') {
+                    finish();
+                    resolve(job.result);
+                } else if (job.state === 'failed' || job.state === 'cancelled') {
+                    finish();
+                    reject(new Error(job.error || 'Job ' + job.state));
+                } else if (options.onProgress && job.stage) {
+                    options.onProgress(job.stage, job.percent);
+                }
+            });
+
+            source.onerror = function() {
+                // A closed source means the server refused it, usually because
+                // the job expired; otherwise the browser is already retrying
+                if (source.readyState === EventSource.CLOSED) {
+                    finish();
+                    reject(new Error('Lost track of the job'));
+                }
+            };
+        });
+    }
+
+    function resumeJob(storageKey) {
+        return sessionStorage.getItem(storageKey);
+    }
+
+    // Human readable progress text such as "Converting 42%"
+    function describeProgress(stage, percent) {
+        var label = stage ? stage.charAt(0).toUpperCase() + stage.slice(1) : 'Working';
+        return percent === null || percent === undefined ? label + '...' : label + ' ' + percent + '%';
+    }
+
+    window.followJob = followJob;
+    window.resumeJob = resumeJob;
+    window.describeProgress = describeProgress;
+})();
@@ -213,6 +213,13 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   };
 
+  // Apply a track's replay gain (dB) so tracks play at a similar loudness.
+  // The media element can only attenuate, so positive gains play at full volume
+  const applyReplayGain = (gain) => {
+    const db = parseFloat(gain);
+    player.audio.volume = isNaN(db) ? 1 : Math.min(1, Math.pow(10, db / 20));
+  };
+
   // Store track list
   const storeTrackList = () => {
     const trackButtons = document.querySelectorAll(".play-track-btn");
@@ -222,6 +229,7 @@ document.addEventListener("DOMContentLoaded", () => {
         name: button.dataset.trackName,
         artwork: button.dataset.trackArtwork,
         artworkSecondary: button.dataset.trackArtworkSecondary,
+        gain: button.dataset.trackGain,
       }));
       sessionStorage.setItem("trackList", JSON.stringify(trackList));
     }
@@ -238,6 +246,7 @@ document.addEventListener("DOMContentLoaded", () => {
         isRepeatEnabled: isRepeatEnabled,
         isPlayerHidden: isPlayerHidden,
         currentTrackIndex: currentTrackIndex,
+        gain: player.audio.dataset.gain,
         artworkSrc: player.artworkImage.style.display !== "none" ? player.artworkImage.src : "",
       };
       sessionStorage.setItem("audioState", JSON.stringify(state));
@@ -268,6 +277,8 @@ document.addEventListener("DOMContentLoaded", () => {
 
       // Restore track and metadata
       player.audio.src = state.src;
+      player.audio.dataset.gain = state.gain || "";
+      applyReplayGain(state.gain);
       player.trackName.textContent = state.trackName;
       currentTrackIndex = state.currentTrackIndex;
       isRepeatEnabled = state.isRepeatEnabled;
@@ -354,6 +365,8 @@ document.addEventListener("DOMContentLoaded", () => {
       const trackArtwork = button.dataset.trackArtwork;
 
       player.audio.src = trackUrl;
+      player.audio.dataset.gain = button.dataset.trackGain || "";
+      applyReplayGain(button.dataset.trackGain);
       player.trackName.textContent = trackName;
       
       // Only load and display artwork on desktop
@@ -462,6 +475,8 @@ document.addEventListener("DOMContentLoaded", () => {
       (currentTrackIndex - 1 + trackList.length) % trackList.length;
     const track = trackList[currentTrackIndex];
     player.audio.src = track.url;
+    player.audio.dataset.gain = track.gain || "";
+    applyReplayGain(track.gain);
     player.trackName.textContent = track.name;
     
     // Only show artwork on desktop
@@ -501,6 +516,8 @@ document.addEventListener("DOMContentLoaded", () => {
     currentTrackIndex = (currentTrackIndex + 1) % trackList.length;
     const track = trackList[currentTrackIndex];
     player.audio.src = track.url;
+    player.audio.dataset.gain = track.gain || "";
+    applyReplayGain(track.gain);
     player.trackName.textContent = track.name;
     
     // Only show artwork on desktop
@@ -17,6 +17,54 @@ document.addEventListener('DOMContentLoaded', function() {
     let currentSessionId = null;
     let isProcessing = false;
 
+    // Quality preset selection
+    const presetButtons = document.querySelectorAll('.preset-btn');
+    const twoStemsCheckbox = document.getElementById('two-stems');
+    presetButtons.forEach(button => {
+        button.addEventListener('click', function() {
+            presetButtons.forEach(btn => btn.classList.remove('selected'));
+            this.classList.add('selected');
+        });
+    });
+
+    // Remix controls: each change points the mix player and download link
+    // at a freshly rendered mix of the stems held on the server
+    const mixSection = document.querySelector('.mix-section');
+    const mixPlayer = document.querySelector('.mix-player');
+    const mixDownload = document.querySelector('.mix-download');
+
+    function mixUrl(download) {
+        const params = new URLSearchParams();
+        document.querySelectorAll('.stem-card').forEach(card => {
+            if (card.style.display === 'none') return;
+            const stem = card.dataset.stem;
+            const gain = card.querySelector('.stem-gain');
+            if (gain && gain.value !== '0') params.append(stem, gain.value);
+            if (card.querySelector('.mute-btn.active')) params.append('mute', stem);
+            if (card.querySelector('.solo-btn.active')) params.append('solo', stem);
+        });
+        if (download) params.append('download', '1');
+        return `/audio/separator/${currentSessionId}/mix?${params.toString()}`;
+    }
+
+    function updateMix() {
+        if (!currentSessionId) return;
+        const wasPlaying = !mixPlayer.paused;
+        mixPlayer.src = mixUrl(false);
+        mixDownload.href = mixUrl(true);
+        if (wasPlaying) mixPlayer.play();
+    }
+
+    document.querySelectorAll('.stem-gain').forEach(input => {
+        input.addEventListener('change', updateMix);
+    });
+    document.querySelectorAll('.mix-toggle').forEach(button => {
+        button.addEventListener('click', function() {
+            this.classList.toggle('active');
+            updateMix();
+        });
+    });
+
     // Function to show the warning
     function showWarning() {
         separationWarning.style.display = 'block';
@@ -127,6 +175,7 @@ document.addEventListener('DOMContentLoaded', function() {
         statusText.style.color = '#ff4081';
         progressBar.style.width = '0%';
         stemsSection.style.display = 'none';
+        mixSection.style.display = 'none';
         
         // Reset file selection
         fileInput.value = '';
@@ -139,6 +188,11 @@ document.addEventListener('DOMContentLoaded', function() {
         stemsSection.style.display = 'grid';
         currentSessionId = data.session_id;
 
+        // Only show the cards of stems this separation produced
+        document.querySelectorAll('.stem-card').forEach(card => {
+            card.style.display = data.stems[card.dataset.stem] ? '' : 'none';
+        });
+
         // Update each stem card
         Object.entries(data.stems).forEach(([stem, url]) => {
             const card = document.querySelector(`.stem-card[data-stem="${stem}"]`);
@@ -149,6 +203,8 @@ document.addEventListener('DOMContentLoaded', function() {
             if (audio) {
                 const source = audio.querySelector('source');
                 if (source) {
+                    // Stems may be MP3 or FLAC depending on the preset
+                    source.removeAttribute('type');
                     source.src = url;
                 }
                 audio.load();
@@ -158,7 +214,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const downloadBtn = card.querySelector('.download-btn');
             if (downloadBtn) {
                 const originalName = selectedFile ? selectedFile.name.split('.')[0] : 'audio';
-                const stemFilename = `${originalName}_${stem}.mp3`;
+                const extension = url.split('.').pop();
+                const stemFilename = `${originalName}_${stem}.${extension}`;
                 
                 // Remove any existing listeners
                 const newBtn = downloadBtn.cloneNode(true);
@@ -182,6 +239,12 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
 
+        // Start the remix from the unchanged stems
+        document.querySelectorAll('.stem-gain').forEach(input => { input.value = '0'; });
+        document.querySelectorAll('.mix-toggle').forEach(button => button.classList.remove('active'));
+        mixSection.style.display = 'block';
+        updateMix();
+
         // Set up audio visualizers after updating the stems section
         setupAudioVisualizers();
     }
@@ -209,6 +272,13 @@ document.addEventListener('DOMContentLoaded', function() {
 
         const formData = new FormData();
         formData.append('audio_file', selectedFile);
+        const selectedPreset = document.querySelector('.preset-btn.selected');
+        if (selectedPreset) {
+            formData.append('preset', selectedPreset.dataset.preset);
+        }
+        if (twoStemsCheckbox && twoStemsCheckbox.checked) {
+            formData.append('stems', 'vocals');
+        }
 
         // Reset and show status
         separationStatus.style.display = 'block';
@@ -217,32 +287,22 @@ document.addEventListener('DOMContentLoaded', function() {
         statusText.textContent = 'Processing... This may take a few minutes.';
         separateBtn.disabled = true;
         stemsSection.style.display = 'none';
+        mixSection.style.display = 'none';
         isProcessing = true;
 
         try {
-            progressBar.style.width = '50%';
-            
             const response = await fetch('/audio/separator', {
                 method: 'POST',
                 body: formData
             });
 
-            if (!response.ok) {
-                const data = await response.json();
-                throw new Error(data.error || 'Separation failed');
-            }
-
             const data = await response.json();
-            
-            if (data.success) {
-                progressBar.style.width = '100%';
-                statusText.textContent = 'Separation complete! Click to download stems.';
-                currentSessionId = data.session_id;
-                updateStemsSection(data);
-                isProcessing = false;
-            } else {
+            if (!response.ok || !data.success) {
                 throw new Error(data.error || 'Separation failed');
             }
+
+            statusText.textContent = 'Queued...';
+            await followSeparation(data.events_url);
         } catch (error) {
             console.error('Separation error:', error);
             progressBar.style.width = '100%';
@@ -254,11 +314,44 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Follow a separation job; it is remembered for this tab so a reload
+    // re-attaches to the running separation instead of starting another
+    async function followSeparation(eventsUrl) {
+        separationStatus.style.display = 'block';
+        isProcessing = true;
+        const result = await followJob(eventsUrl, {
+            storageKey: 'separator-job',
+            onProgress: function(stage, percent) {
+                statusText.textContent = describeProgress(stage, percent);
+                if (percent !== null && percent !== undefined) {
+                    progressBar.style.width = `${percent}%`;
+                }
+            }
+        });
+        progressBar.style.width = '100%';
+        statusText.textContent = 'Separation complete! Click to download stems.';
+        currentSessionId = result.session_id;
+        updateStemsSection(result);
+        isProcessing = false;
+    }
+
+    const pendingSeparation = resumeJob('separator-job');
+    if (pendingSeparation) {
+        statusText.style.color = '#F5F5DC';
+        statusText.textContent = 'Resuming separation...';
+        separateBtn.disabled = true;
+        followSeparation(pendingSeparation).catch(function(error) {
+            console.error('Separation error:', error);
+            showError(error.message || 'Error during separation');
+            isProcessing = false;
+        });
+    }
+
     // Clean up when leaving page
     window.addEventListener('beforeunload', function(e) {
-        if (currentSessionId && isProcessing) {
+        if (isProcessing) {
             // Show a warning message when leaving during processing
-            const message = 'Stem separation is still in progress. If you leave, it will continue but results may be lost.';
+            const message = 'Stem separation is still in progress. It will continue, and reopening this page in the same tab picks it up again.';
             e.returnValue = message;
             return message;
         }
@@ -141,16 +141,9 @@ document.addEventListener("DOMContentLoaded", function () {
         }
       });
 
-      // Convert each video
-      for (let i = 0; i < selectedVideos.length; i++) {
-        const video = selectedVideos[i];
-        const progress = (i / selectedVideos.length) * 100;
-
-        statusText.textContent = `Converting ${i + 1}/${
-          selectedVideos.length
-        }: ${video.title}`;
-        progressBar.style.width = `${progress}%`;
-
+      // Queue every video; the server runs a few at a time
+      const jobs = [];
+      for (const video of selectedVideos) {
         const convertResponse = await fetch("/youtube/convert", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
@@ -166,16 +159,43 @@ document.addEventListener("DOMContentLoaded", function () {
         }
 
         const convertData = await convertResponse.json();
-
-        // Trigger download
-        const link = document.createElement("a");
-        link.href = convertData.downloadUrl;
-        link.download = convertData.filename;
-        document.body.appendChild(link);
-        link.click();
-        document.body.removeChild(link);
+        jobs.push({ video, eventsUrl: convertData.eventsUrl });
       }
 
+      // Overall progress averages the jobs, each half download, half conversion
+      const progress = jobs.map(() => 0);
+      const showOverall = () => {
+        const total = progress.reduce((sum, value) => sum + value, 0);
+        progressBar.style.width = `${total / jobs.length}%`;
+      };
+
+      // Download each file as soon as its conversion finishes
+      let completed = 0;
+      statusText.textContent = `Converting 0/${jobs.length}...`;
+      await Promise.all(
+        jobs.map(async ({ video, eventsUrl }, index) => {
+          const result = await followJob(eventsUrl, {
+            onProgress: (stage, percent) => {
+              if (percent === null || percent === undefined) return;
+              progress[index] = stage === "convert" ? 50 + percent / 2 : percent / 2;
+              showOverall();
+            },
+          });
+          completed += 1;
+          progress[index] = 100;
+          showOverall();
+          statusText.textContent = `Converted ${completed}/${jobs.length}: ${video.title}`;
+
+          // Trigger download
+          const link = document.createElement("a");
+          link.href = result.downloadUrl;
+          link.download = result.filename;
+          document.body.appendChild(link);
+          link.click();
+          document.body.removeChild(link);
+        })
+      );
+
       statusText.textContent = "All conversions completed!";
       progressBar.style.width = "100%";
 
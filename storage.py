@@ -0,0 +1,220 @@
+import os
+import uuid
+import hashlib
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import case, event, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import MediaBlob
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def hash_file(file_path):
+    """Return the SHA-256 hex digest of a file on disk."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed storage for uploaded media.
+
+    Files are stored once under ``<sha256><ext>`` and reference counted in the
+    ``media_blobs`` table. Callers hold a reference for as long as they point
+    at a blob (a track column, an in-flight audio tool request) and release it
+    afterwards. The caller owns the transaction: blobs that drop to zero
+    references are returned by ``release`` and only removed from disk by
+    ``purge`` once the caller has committed. Files of new blobs whose
+    transaction is rolled back instead are removed again.
+    """
+
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+
+    def path(self, filename):
+        """Return the on-disk path of a stored file."""
+        return os.path.join(self.upload_folder, filename)
+
+    def put(self, file_obj, original_filename=None):
+        """Store an uploaded file and take a reference to it.
+
+        The upload is streamed to a temporary file while being hashed, so
+        memory use does not depend on the file size. Returns the blob
+        filename to store on the referencing row.
+        """
+        if original_filename is None:
+            original_filename = file_obj.filename
+        ext = os.path.splitext(original_filename)[1].lower()
+
+        os.makedirs(self.upload_folder, exist_ok=True)
+        tmp_path = self.path(f".{uuid.uuid4()}.upload")
+        digest = hashlib.sha256()
+        size = 0
+
+        stream = getattr(file_obj, 'stream', file_obj)
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            return self._adopt(tmp_path, digest.hexdigest(), size, ext)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_path(self, file_path):
+        """Store a file that already exists on disk (it is moved, not copied)."""
+        ext = os.path.splitext(file_path)[1].lower()
+        filename = self._adopt(file_path, hash_file(file_path), os.path.getsize(file_path), ext)
+        # Content that was already stored leaves the source behind
+        if os.path.exists(file_path) and os.path.abspath(file_path) != os.path.abspath(self.path(filename)):
+            os.remove(file_path)
+        return filename
+
+    def retain(self, filename):
+        """Take another reference to an existing blob."""
+        return self._adjust(MediaBlob.filename == filename, 1) > 0
+
+    def release(self, filename):
+        """Drop one reference to a blob.
+
+        Returns the filename if nothing references it any more (the file
+        should be purged after commit), otherwise None. Files that predate
+        the blob store are owned by their single referencing row, so they
+        are always returned.
+        """
+        if not filename:
+            return None
+
+        if not self._adjust(MediaBlob.filename == filename, -1):
+            return filename
+
+        remaining = db.session.query(MediaBlob.refcount).filter_by(filename=filename).scalar()
+        if remaining > 0:
+            return None
+
+        MediaBlob.query.filter_by(filename=filename).delete(synchronize_session=False)
+        return filename
+
+    def release_many(self, filenames):
+        """Drop one reference per occurrence of each filename in a single UPDATE.
+
+        Returns the filenames that are no longer referenced, including files
+        that predate the blob store.
+        """
+        counts = Counter(name for name in filenames if name)
+        if not counts:
+            return []
+
+        names = list(counts)
+        MediaBlob.query.filter(MediaBlob.filename.in_(names)).update(
+            {MediaBlob.refcount: MediaBlob.refcount - case(counts, value=MediaBlob.filename, else_=0)},
+            synchronize_session=False
+        )
+
+        rows = db.session.query(MediaBlob.filename, MediaBlob.refcount).filter(
+            MediaBlob.filename.in_(names)
+        ).all()
+        orphans = [filename for filename, refcount in rows if refcount <= 0]
+        if orphans:
+            MediaBlob.query.filter(MediaBlob.filename.in_(orphans)).delete(synchronize_session=False)
+
+        stored = {filename for filename, _ in rows}
+        return orphans + [name for name in names if name not in stored]
+
+    def purge(self, filenames):
+        """Remove released files from disk unless they were re-referenced."""
+        removed = []
+        for filename in filenames:
+            if not filename:
+                continue
+            # A concurrent upload of the same content may have revived the blob
+            if MediaBlob.query.filter_by(filename=filename).first():
+                continue
+            file_path = self.path(filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                removed.append(filename)
+        return removed
+
+    @contextmanager
+    def staged(self, file_obj, original_filename=None):
+        """Hold a committed reference to an upload for the duration of a block.
+
+        Used by the audio tools: identical uploads share one file on disk and
+        a file that is also a track's audio is never deleted by the tool.
+        Yields the stored file's path.
+        """
+        filename = self.put(file_obj, original_filename)
+        db.session.commit()
+        try:
+            yield self.path(filename)
+        finally:
+            self.discard(filename)
+
+    def discard(self, filename):
+        """Release a reference, commit, and delete the file if it was the last one."""
+        orphan = self.release(filename)
+        db.session.commit()
+        self.purge([orphan])
+
+    def _adjust(self, condition, delta):
+        """Change a refcount in SQL so concurrent workers never lose an update."""
+        return MediaBlob.query.filter(condition).update(
+            {MediaBlob.refcount: MediaBlob.refcount + delta},
+            synchronize_session=False
+        )
+
+    def _adopt(self, tmp_path, file_hash, size, ext):
+        """Move a hashed temporary file into place and count the reference."""
+        for attempt in range(2):
+            if self._adjust(MediaBlob.hash == file_hash, 1):
+                filename = db.session.query(MediaBlob.filename).filter_by(hash=file_hash).scalar()
+                if not os.path.exists(self.path(filename)):
+                    os.replace(tmp_path, self.path(filename))
+                return filename
+
+            blob = MediaBlob(hash=file_hash, filename=f"{file_hash}{ext}", size=size, refcount=1)
+            try:
+                # Flush in a savepoint so a concurrent insert of the same
+                # content only undoes this row, not the caller's transaction
+                with db.session.begin_nested():
+                    db.session.add(blob)
+            except IntegrityError:
+                if attempt:
+                    raise
+                continue
+            # The row goes first: if the transaction doesn't commit, the
+            # file is known and removed on rollback (see _remove_new_blobs)
+            db.session.info.setdefault('new_blobs', set()).add(self.path(blob.filename))
+            os.replace(tmp_path, self.path(blob.filename))
+            return blob.filename
+        return None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _forget_new_blobs(session):
+    session.info.pop('new_blobs', None)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _remove_new_blobs(session, transaction):
+    """Delete the files of blobs added in a transaction that ended without a commit."""
+    if transaction.parent is not None:
+        return  # A savepoint; the outer transaction may still commit
+    paths = session.info.pop('new_blobs', None)
+    if not paths:
+        return
+    # A concurrent upload of the same content may have committed its own row for the file
+    with db.engine.connect() as connection:
+        kept = set(connection.execute(
+            select(MediaBlob.filename).where(MediaBlob.filename.in_([os.path.basename(path) for path in paths]))
+        ).scalars())
+    for path in paths:
+        if os.path.basename(path) not in kept and os.path.exists(path):
+            os.remove(path)
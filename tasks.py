@@ -0,0 +1,76 @@
+import queue
+import threading
+import logging
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundQueue:
+    """In-process work queue drained by daemon threads.
+
+    Callables run inside an application context of the app that submitted
+    them, so they can use the database and configuration like a request.
+    """
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a callable to run in the background."""
+        app = current_app._get_current_object()
+        self._ensure_started()
+        self._queue.put((app, fn, args, kwargs))
+
+    def submit_later(self, delay, fn, *args, **kwargs):
+        """Queue a callable to run in the background after ``delay`` seconds."""
+        app = current_app._get_current_object()
+        timer = threading.Timer(delay, self._put_later, args=(app, fn, args, kwargs))
+        timer.daemon = True
+        timer.start()
+
+    def qsize(self):
+        """Number of tasks waiting to run."""
+        return self._queue.qsize()
+
+    def join(self):
+        """Block until every queued task has run."""
+        self._queue.join()
+
+    def _put_later(self, app, fn, args, kwargs):
+        self._ensure_started()
+        self._queue.put((app, fn, args, kwargs))
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                worker = threading.Thread(
+                    target=self._run,
+                    name=f"{self.name}-{len(self._threads)}"
+                )
+                worker.daemon = True
+                worker.start()
+                self._threads.append(worker)
+
+    def _run(self):
+        while True:
+            app, fn, args, kwargs = self._queue.get()
+            try:
+                with app.app_context():
+                    fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Background task in %s failed", self.name)
+            finally:
+                self._queue.task_done()
+
+
+# Removes files released by admin operations outside the request
+file_deleter = BackgroundQueue('file-deleter')
+
+# Ingest pipeline runs for uploaded and re-processed tracks
+ingest_jobs = BackgroundQueue('ingest')
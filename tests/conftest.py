@@ -0,0 +1,35 @@
+import os
+import sys
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+
+@pytest.fixture
+def make_app():
+    """Build a bare Flask app with the base configuration and the given overrides."""
+    def make(**overrides):
+        app = Flask(__name__)
+        app.config.from_object(Config)
+        app.config.update(TESTING=True, **overrides)
+        return app
+    return make
+
+
+@pytest.fixture
+def db_app(make_app, tmp_path):
+    """App with the models' tables in a fresh SQLite file and uploads in a temporary folder."""
+    import database
+    from extensions import db
+
+    app = make_app(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'music.db'}",
+        UPLOAD_FOLDER=str(tmp_path / 'uploads')
+    )
+    database.init_app(app)
+    with app.app_context():
+        db.create_all(bind_key=None)  # Other tests may have registered a replica bind on db
+    return app
@@ -0,0 +1,103 @@
+import io
+import os
+import pytest
+from flask_login import LoginManager
+from werkzeug.security import generate_password_hash
+import routes.admin
+from extensions import db
+from models import User, Track, MediaBlob
+from routes.admin import admin_bp, parse_track_ids
+from storage import BlobStore
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    """Ingest runs the bulk operations queue, as (track id, stages)."""
+    queued = []
+    monkeypatch.setattr(routes.admin.ingest, 'enqueue', lambda track_id, stages=None: queued.append((track_id, stages)))
+    return queued
+
+
+@pytest.fixture
+def purged(monkeypatch):
+    """Files bulk deletes handed to the background deleter."""
+    purged = []
+    monkeypatch.setattr(routes.admin, 'schedule_purge', purged.extend)
+    return purged
+
+
+@pytest.fixture
+def app(db_app, purged):
+    db_app.register_blueprint(admin_bp)
+    LoginManager(db_app).user_loader(lambda user_id: db.session.get(User, int(user_id)))
+    with db_app.app_context():
+        db.session.add(User(id=1, username='admin', password=generate_password_hash('secret'), is_admin=True))
+        db.session.add_all([Track(id=track_id, name=f"Track {track_id}", file=f"{track_id}.wav", like_count=3) for track_id in (1, 2)])
+        db.session.commit()
+    return db_app
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['_user_id'] = '1'
+        yield client
+
+
+def bulk(client, operation, track_ids):
+    return client.post(f"/admin/bulk/{operation}", json={'track_ids': track_ids}).get_json()
+
+
+def track_ids(app):
+    with app.app_context():
+        return [track.id for track in Track.query.order_by(Track.id)]
+
+
+def test_only_json_integers_are_ids():
+    assert parse_track_ids([3, 1, 3, '7', 1.5, 2.0, True, False, None, [4]]) == ([3, 1], ['7', 1.5, 2.0, True, False, None, [4]])
+
+
+def test_delete_reports_each_id(app, client):
+    data = bulk(client, 'delete', [1, 3, '2', 2.0, True])
+    assert data['success']
+    assert data['results'] == {'1': 'deleted', '3': 'not_found', '"2"': 'invalid', '2.0': 'invalid', 'true': 'invalid'}
+    assert track_ids(app) == [2]  # Neither "2" nor 2.0 nor true deleted a track
+
+
+def test_invalid_value_does_not_hide_valid_id(app, client):
+    data = bulk(client, 'clear-likes', ['1', 1])
+    assert data['results'] == {'"1"': 'invalid', '1': 'cleared'}
+    with app.app_context():
+        assert [track.like_count for track in Track.query.order_by(Track.id)] == [0, 3]
+
+
+def test_queueing_skips_missing_and_invalid_ids(client, queued):
+    data = bulk(client, 'retranscode', [2, 1, 9, 1.5])
+    assert data['results'] == {'2': 'queued', '1': 'queued', '9': 'not_found', '1.5': 'invalid'}
+    assert queued == [(1, ['normalize']), (2, ['normalize'])]
+
+
+def test_delete_releases_shared_files(app, client, purged):
+    upload = io.BytesIO(b'RIFF')
+    upload.filename = 'song.wav'
+    with app.app_context():
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+        store = BlobStore(app.config['UPLOAD_FOLDER'])
+        filename = store.put(upload)
+        store.retain(filename)  # The same audio uploaded for both tracks
+        Track.query.update({Track.file: filename})
+        db.session.commit()
+
+    def refcount():
+        with app.app_context():
+            return db.session.query(MediaBlob.refcount).filter_by(filename=filename).scalar()
+
+    assert refcount() == 2
+    bulk(client, 'delete', [1])
+    assert refcount() == 1
+    assert purged == []
+
+    bulk(client, 'delete', [2])
+    assert refcount() is None  # The last release drops the blob row
+    assert purged == [filename]
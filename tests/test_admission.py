@@ -0,0 +1,169 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+import time
+import pytest
+from flask import jsonify
+from flask_login import LoginManager
+import admission
+from admission import AdmissionController, AdmissionRefused, admission_controlled, take_lease
+from jobs import JobRunner
+
+LIMITS = {'queue': 3, 'admin_reserve': 1, 'per_ip': 2, 'per_session': 2, 'per_minute': 60, 'burst': 60, 'seconds': 30}
+
+
+@pytest.fixture
+def controller(tmp_path):
+    return AdmissionController(str(tmp_path / 'admission.db'), {'convert': dict(LIMITS)}, {'convert': 1})
+
+
+def active(controller):
+    return controller.stats()['convert']['active']
+
+
+def refusal(controller, *args, **kwargs):
+    with pytest.raises(AdmissionRefused) as error:
+        controller.admit('convert', *args, **kwargs)
+    return error.value
+
+
+def test_per_client_limits(controller):
+    controller.limits['convert']['queue'] = 10
+    controller.admit('convert', '10.0.0.1', 'a')
+    controller.admit('convert', '10.0.0.1', 'b')
+    error = refusal(controller, '10.0.0.1', 'c')
+    assert error.reason == 'too many at once'
+    assert 0 < error.retry_after <= 30
+
+    controller.admit('convert', '10.0.0.2', 'a')  # Another address, but the same session
+    assert refusal(controller, '10.0.0.3', 'a').reason == 'too many at once'
+    controller.admit('convert', '10.0.0.1', 'admin', admin=True)  # Admins skip the per-client limits
+
+
+def test_admin_reserve(controller):
+    for ip in ('10.0.0.1', '10.0.0.2'):
+        controller.admit('convert', ip, ip)
+    error = refusal(controller, '10.0.0.3', 'c')
+    assert error.reason == 'server busy'
+    assert error.retry_after == 30
+
+    controller.admit('convert', '10.0.0.3', 'admin', admin=True)  # The reserved slot
+    assert controller.stats()['convert'] == {'active': 3, 'admin': 1, 'queue': 3}
+    assert refusal(controller, '10.0.0.3', 'admin', admin=True).reason == 'server busy'
+
+
+def test_rate_limit(controller):
+    controller.limits['convert'].update(burst=2, per_minute=6)
+    for _ in range(2):
+        controller.admit('convert', '10.0.0.1', 'a').release()
+    error = refusal(controller, '10.0.0.1', 'a')
+    assert error.reason == 'rate limited'
+    assert error.retry_after == pytest.approx(10, abs=0.5)
+    controller.admit('convert', '10.0.0.2', 'b')  # Other addresses have their own bucket
+
+
+def test_release_frees_the_slot_once(controller):
+    first = controller.admit('convert', '10.0.0.1', 'a')
+    second = controller.admit('convert', '10.0.0.1', 'a')
+    refusal(controller, '10.0.0.1', 'a')
+
+    first.release()
+    first.release()
+    assert active(controller) == 1
+    controller.admit('convert', '10.0.0.1', 'a')
+    second.release()
+    assert active(controller) == 1
+
+
+def test_leases_of_dead_processes_are_reaped(controller):
+    for client in ('a', 'b'):
+        controller.admit('convert', '10.0.0.1', client)
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    with sqlite3.connect(controller.path) as db:
+        db.execute("UPDATE leases SET pid = ?", (child.pid,))
+
+    assert active(controller) == 0
+    controller.admit('convert', '10.0.0.1', 'a')
+
+
+@pytest.fixture
+def handed_off():
+    """Leases the ``/later`` view took over."""
+    return []
+
+
+@pytest.fixture
+def app(make_app, tmp_path, monkeypatch, handed_off):
+    app = make_app(ADMISSION_DB=str(tmp_path / 'admission.db'), ADMISSION_LIMITS={'convert': dict(LIMITS)})
+    LoginManager(app).user_loader(lambda user_id: None)
+    monkeypatch.setattr(admission, '_controller', None)
+
+    @app.route('/convert', methods=['GET', 'POST'])
+    @admission_controlled('convert')
+    def convert():
+        return jsonify(active=admission.get_admission_controller().stats()['convert']['active'])
+
+    @app.route('/later', methods=['POST'])
+    @admission_controlled('convert')
+    def later():
+        handed_off.append(take_lease())
+        return jsonify(success=True)
+
+    return app
+
+
+def app_active(app):
+    with app.app_context():
+        return admission.get_admission_controller().stats()['convert']['active']
+
+
+def test_lease_is_held_while_the_view_runs(app):
+    client = app.test_client()
+    assert client.post('/convert').get_json() == {'active': 1}
+    assert client.get('/convert').get_json() == {'active': 0}  # Only POSTs are admitted
+    assert app_active(app) == 0
+
+
+def test_refusal_is_a_429_with_retry_after(app):
+    client = app.test_client()
+    client.post('/later')
+    client.post('/later')
+    response = client.post('/convert')
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 30
+    assert not response.get_json()['success']
+
+
+def test_handed_off_lease_outlives_the_request(app, handed_off):
+    app.test_client().post('/later')
+    assert app_active(app) == 1
+    handed_off[0].release()
+    assert app_active(app) == 0
+
+
+def test_job_releases_the_lease_it_took_over(app):
+    runner = JobRunner({'convert': 1}, max_pending=4, result_ttl=60)
+    finished = asyncio.Event()
+    started = []
+
+    async def job_fn(job):
+        started.append(job)
+        while not finished.is_set():
+            await asyncio.sleep(0.01)
+
+    @app.route('/job', methods=['POST'])
+    @admission_controlled('convert')
+    def job():
+        return jsonify(id=runner.submit('convert', job_fn).id)
+
+    job_id = app.test_client().post('/job').get_json()['id']
+    assert app_active(app) == 1  # Held by the job after the request ended
+
+    runner._loop.call_soon_threadsafe(finished.set)
+    deadline = time.monotonic() + 5
+    while app_active(app) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runner.get(job_id).state == 'done'
+    assert app_active(app) == 0
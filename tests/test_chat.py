@@ -0,0 +1,175 @@
+import json
+import pytest
+import chat
+from outbound import UpstreamUnavailable
+from routes.chat import chat_bp, ERROR_ANSWER
+
+
+@pytest.fixture
+def chat_config():
+    """Chat settings of the app; parametrize to change them."""
+    return {'CHAT_HISTORY_MESSAGES': 4, 'CHAT_HISTORY_CHARS': 6000}
+
+
+@pytest.fixture
+def app(make_app, monkeypatch, chat_config):
+    app = make_app(CHAT_BACKEND='stub', CHAT_CACHE_MAX_ENTRIES=0, **chat_config)
+    app.register_blueprint(chat_bp)
+    monkeypatch.setattr(chat, '_service', None)
+    return app
+
+
+@pytest.fixture
+def service(app):
+    """The app's chat service, with the stub answering at once and every prompt recorded."""
+    with app.app_context():
+        service = chat.get_chat_service()
+    service.backend.first_token_delay = service.backend.token_delay = 0
+    service.prompts = []
+    stream = service.backend.stream
+
+    def record(messages):
+        service.prompts.append(messages)
+        return stream(messages)
+
+    service.backend.stream = record
+    return service
+
+
+@pytest.fixture
+def client(app, service):
+    with app.test_client() as client:
+        yield client
+
+
+def parse_events(body):
+    """(event, data) of each Server-Sent Event; blocks without an event, like ``retry``, come as (None, block)."""
+    events = []
+    for block in body.split('\n\n'):
+        if not block:
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+        else:
+            events.append((None, block))
+    return events
+
+
+def ask(client, message):
+    return client.post('/api/chat', json={'message': message}).get_json()['answer']
+
+
+def test_stream_sends_tokens_then_done(client):
+    response = client.post('/api/chat', json={'message': 'What is swing?', 'stream': True})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+
+    events = parse_events(response.get_data(as_text=True))
+    assert events[0] == (None, 'retry: 2000')
+    assert events[-1] == ('done', {})
+    tokens = events[1:-1]
+    assert len(tokens) > 1
+    assert all(event == 'token' for event, _ in tokens)
+    answer = ''.join(data['text'] for _, data in tokens)
+    assert answer.startswith('Alex here (stub backend). You asked: "What is swing?"')
+
+
+def test_event_stream_accept_header_streams(client):
+    response = client.post('/api/chat', json={'message': 'Hi'}, headers={'Accept': 'text/event-stream'})
+    assert response.mimetype == 'text/event-stream'
+    assert parse_events(response.get_data(as_text=True))[-1] == ('done', {})
+
+
+def test_streamed_answer_is_remembered(client, service):
+    client.post('/api/chat', json={'message': 'What is swing?', 'stream': True}).get_data()
+    with client.session_transaction() as session:
+        history = service.store.history(session['chat_id'])
+    assert [message['role'] for message in history] == ['user', 'assistant']
+    assert history[0]['content'] == 'What is swing?'
+
+
+def test_stream_error_ends_with_error_event(client, service):
+    def fail(messages):
+        yield 'Half an'
+        raise RuntimeError('connection reset')
+
+    service.backend.stream = fail
+    events = parse_events(client.post('/api/chat', json={'message': 'Hi', 'stream': True}).get_data(as_text=True))
+    assert events[1:] == [('token', {'text': 'Half an'}), ('error', {'answer': ERROR_ANSWER})]
+
+
+def test_stream_reports_busy_upstream(client, service):
+    def busy(messages):
+        raise UpstreamUnavailable('api.together.xyz', 'rate limited', 3)
+        yield
+
+    service.backend.stream = busy
+    event, data = parse_events(client.post('/api/chat', json={'message': 'Hi', 'stream': True}).get_data(as_text=True))[-1]
+    assert event == 'error'
+    assert data['retry_after'] == 3
+
+
+def test_json_answer(client):
+    response = client.post('/api/chat', json={'message': 'What is swing?'})
+    assert response.status_code == 200
+    assert 'You asked: "What is swing?"' in response.get_json()['answer']
+
+
+def test_empty_message_is_rejected(client):
+    response = client.post('/api/chat', json={'message': '  '})
+    assert response.status_code == 400
+
+
+def test_history_keeps_last_messages(app, client, service):
+    for question in ('One?', 'Two?', 'Three?'):
+        ask(client, question)
+    with client.session_transaction() as session:
+        history = service.store.history(session['chat_id'])
+    assert len(history) == app.config['CHAT_HISTORY_MESSAGES']
+    assert [message['content'] for message in history if message['role'] == 'user'] == ['Two?', 'Three?']
+
+    assert 'I can see 4 earlier messages' in ask(client, 'Four?')
+    assert service.prompts[-1][1] == {'role': 'user', 'content': 'Two?'}
+
+
+@pytest.mark.parametrize('chat_config', [{'CHAT_HISTORY_MESSAGES': 12, 'CHAT_HISTORY_CHARS': 250}])
+def test_prompt_history_fits_char_budget(app, client, service):
+    ask(client, 'One?')
+    ask(client, 'Two?')
+    ask(client, 'Three?')
+
+    prompt = service.prompts[-1]
+    history = prompt[1:-1]
+    assert prompt[0]['role'] == 'system'
+    assert prompt[-1] == {'role': 'user', 'content': 'Three?'}
+    assert sum(len(message['content']) for message in history) <= 250
+    assert 0 < len(history) < 4  # The oldest messages were left out, though all are remembered
+    with client.session_transaction() as session:
+        assert len(service.store.history(session['chat_id'])) == 6
+    assert history[-1]['role'] == 'assistant'
+    assert 'You asked: "Two?"' in history[-1]['content']
+
+
+def test_delete_resets_conversation(client, service):
+    ask(client, 'One?')
+    ask(client, 'Two?')
+    with client.session_transaction() as session:
+        old_chat_id = session['chat_id']
+
+    response = client.delete('/api/chat')
+    assert response.get_json() == {'success': True}
+    with client.session_transaction() as session:
+        assert 'chat_id' not in session
+    assert service.store.history(old_chat_id) == []
+
+    answer = ask(client, 'Three?')
+    assert 'This is question 1 of our chat, and I can see 0 earlier messages' in answer
+    with client.session_transaction() as session:
+        assert session['chat_id'] != old_chat_id
+
+
+def test_delete_without_conversation(client):
+    assert client.delete('/api/chat').get_json() == {'success': True}
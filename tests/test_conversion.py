@@ -0,0 +1,54 @@
+import json
+import subprocess
+import pytest
+from services import AudioConversionService
+from utils import probe_audio
+
+
+def probe_output(streams, tags=None):
+    return json.dumps({'format': {'duration': '12.5', 'format_name': 'flac', **({'tags': tags} if tags else {})},
+                       'streams': streams}).encode()
+
+
+def audio_stream(sample_fmt='s16', **extra):
+    return {'codec_type': 'audio', 'codec_name': 'flac', 'sample_rate': '44100', 'channels': 2,
+            'sample_fmt': sample_fmt, **extra}
+
+
+@pytest.fixture
+def ffprobe(monkeypatch):
+    """Make ffprobe print the given JSON."""
+    def answer(output):
+        monkeypatch.setattr(subprocess, 'run', lambda *args, **kwargs: subprocess.CompletedProcess(args, 0, output, b''))
+    return answer
+
+
+def test_plain_16_bit_source_uses_cached_pcm(ffprobe):
+    ffprobe(probe_output([audio_stream()]))
+    info = probe_audio('song.flac')
+    assert info['sample_format'] == 's16'
+    assert not info['has_metadata']
+    assert AudioConversionService._pcm_matches(info)
+
+
+@pytest.mark.parametrize('sample_fmt', ['s32', 'flt', 'fltp'])
+def test_deeper_sources_are_converted_from_the_original(ffprobe, sample_fmt):
+    ffprobe(probe_output([audio_stream(sample_fmt)]))
+    assert not AudioConversionService._pcm_matches(probe_audio('song.flac'))
+
+
+@pytest.mark.parametrize('output', [
+    probe_output([audio_stream()], tags={'title': 'Night Drive'}),
+    probe_output([audio_stream(tags={'artist': 'Nobz'})]),
+    probe_output([audio_stream(), {'codec_type': 'video', 'codec_name': 'mjpeg'}])
+])
+def test_sources_with_metadata_are_converted_from_the_original(ffprobe, output):
+    ffprobe(output)
+    info = probe_audio('song.flac')
+    assert info['has_metadata']
+    assert not AudioConversionService._pcm_matches(info)
+
+
+def test_other_rates_are_converted_from_the_original(ffprobe):
+    ffprobe(probe_output([audio_stream(sample_rate='48000')]))
+    assert not AudioConversionService._pcm_matches(probe_audio('song.flac'))
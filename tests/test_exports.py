@@ -0,0 +1,98 @@
+import io
+import os
+import zipfile
+import pytest
+from flask import Flask
+import exports
+from exports import ZipEntry, ZipStream, manifest_entry, zip_response
+
+
+@pytest.fixture(autouse=True)
+def crc_cache(monkeypatch):
+    """A fresh CRC cache, so every archive is read as if for the first time."""
+    monkeypatch.setattr(exports, '_crc_cache', exports.OrderedDict())
+    return exports._crc_cache
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {}
+    for name, size in (('kick.wav', 300000), ('snare.wav', 5000), ('empty.wav', 0)):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        paths[name] = str(path)
+    return paths
+
+
+@pytest.fixture
+def client(files):
+    app = Flask(__name__)
+
+    @app.route('/export')
+    def export():
+        entries = [ZipEntry(f"tracks/{name}", path=path) for name, path in files.items()]
+        return zip_response(ZipStream(entries + [manifest_entry({'tracks': sorted(files)})]), 'tracks.zip')
+
+    return app.test_client()
+
+
+def test_full_download_is_a_valid_zip(client, files):
+    response = client.get('/export')
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert int(response.headers['Content-Length']) == len(response.data)
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.testzip() is None
+        for name, path in files.items():
+            with open(path, 'rb') as f:
+                assert archive.read(f"tracks/{name}") == f.read()
+        assert archive.read('manifest.json').startswith(b'{')
+
+
+@pytest.mark.parametrize('split', [1, 30, 150000, 300100, 305200, -40])
+def test_resumed_download_matches_full_download(client, crc_cache, split):
+    full = client.get('/export')
+    etag = full.headers['ETag']
+    split = split % len(full.data)
+
+    crc_cache.clear()  # The resuming worker never read the files
+    rest = client.get('/export', headers={'Range': f"bytes={split}-", 'If-Range': etag})
+    assert rest.status_code == 206
+    assert rest.headers['Content-Range'] == f"bytes {split}-{len(full.data) - 1}/{len(full.data)}"
+    assert full.data[:split] + rest.data == full.data
+
+
+def test_changed_archive_is_sent_whole(client, files):
+    full = client.get('/export')
+    with open(files['snare.wav'], 'ab') as f:
+        f.write(b'more')
+    os.utime(files['snare.wav'], ns=(1, 1))
+
+    response = client.get('/export', headers={'Range': 'bytes=100-', 'If-Range': full.headers['ETag']})
+    assert response.status_code == 200
+    assert len(response.data) == len(full.data) + 4
+
+
+def test_unsatisfiable_range(client):
+    size = len(client.get('/export').data)
+    response = client.get('/export', headers={'Range': f"bytes={size}-"})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{size}"
+
+
+def test_crc_cache_forgets_least_recently_used(monkeypatch, crc_cache, files):
+    monkeypatch.setattr(exports, 'CRC_CACHE_ENTRIES', 2)
+    kick, snare, empty = (ZipEntry(name, path=path) for name, path in files.items())
+    kick.crc
+    snare.crc
+    ZipEntry('again', path=files['kick.wav']).crc  # Used again, so snare is the oldest
+    empty.crc
+    assert list(crc_cache) == [kick.cache_key, empty.cache_key]
+
+
+def test_range_without_if_range_is_served(client):
+    full = client.get('/export')
+    response = client.get('/export', headers={'Range': 'bytes=1000-1999'})
+    assert response.status_code == 206
+    assert response.data == full.data[1000:2000]
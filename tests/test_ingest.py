@@ -0,0 +1,114 @@
+import pytest
+from flask import current_app
+import ingest
+from extensions import db
+from models import Track, IngestStageRun
+
+
+@pytest.fixture
+def pipeline(db_app, monkeypatch):
+    """Stages 'check' (required) and 'render' that record their calls and fail while told to.
+
+    Retries are recorded as (delay, args) instead of being scheduled.
+    """
+    calls = []
+    failures = {}
+    retries = []
+
+    def make_stage(name):
+        def run(track, force=False):
+            calls.append((name, force))
+            if failures.get(name):
+                failures[name] -= 1
+                raise RuntimeError(f"{name} broke")
+            return {'duration': 12.5} if name == 'check' else {'rendition': 'song.mp3'}
+        return run
+
+    monkeypatch.setitem(ingest.STAGES, 'check', make_stage('check'))
+    monkeypatch.setitem(ingest.STAGES, 'render', make_stage('render'))
+    monkeypatch.setattr(ingest, 'REQUIRED_STAGES', {'check'})
+    monkeypatch.setattr(ingest.ingest_jobs, 'submit_later', lambda delay, fn, *args: retries.append((delay, args)))
+    db_app.config.update(INGEST_STAGES=['check', 'render'], INGEST_MAX_ATTEMPTS=3, INGEST_RETRY_DELAY=5)
+
+    with db_app.app_context():
+        track = Track(name='Song', file='song.wav', status='processing')
+        db.session.add(track)
+        db.session.commit()
+        yield {'track_id': track.id, 'calls': calls, 'failures': failures, 'retries': retries}
+        db.session.remove()
+
+
+def runs(track_id):
+    return {run.stage: run for run in IngestStageRun.query.filter_by(track_id=track_id)}
+
+
+def status(track_id):
+    db.session.expire_all()
+    return db.session.get(Track, track_id).status
+
+
+def test_stages_run_in_order_and_publish(pipeline):
+    track_id = pipeline['track_id']
+    ingest.run_pipeline(track_id)
+
+    assert pipeline['calls'] == [('check', False), ('render', False)]
+    assert status(track_id) == 'ready'
+    track = db.session.get(Track, track_id)
+    assert (track.duration, track.rendition) == (12.5, 'song.mp3')
+    for run in runs(track_id).values():
+        assert (run.status, run.attempts, run.error) == ('done', 1, None)
+        assert run.duration_ms >= 0
+
+
+def test_rerun_skips_done_stages_unless_forced(pipeline):
+    track_id = pipeline['track_id']
+    ingest.run_pipeline(track_id)
+    ingest.run_pipeline(track_id)
+    assert len(pipeline['calls']) == 2
+
+    ingest.run_pipeline(track_id, ['render'])
+    ingest.run_pipeline(track_id, force=True)
+    assert pipeline['calls'][2:] == [('render', True), ('check', True), ('render', True)]
+    assert runs(track_id)['render'].attempts == 3
+
+
+def test_failed_stage_is_retried_with_backoff(pipeline):
+    track_id = pipeline['track_id']
+    pipeline['failures']['render'] = 2
+
+    ingest.run_pipeline(track_id)
+    assert pipeline['retries'] == [(5, (track_id, None, False, 1, 1))]
+    run = runs(track_id)['render']
+    assert (run.status, run.error) == ('failed', 'render broke')
+    assert status(track_id) == 'processing'
+
+    ingest.run_pipeline(*pipeline['retries'][-1][1])
+    assert pipeline['retries'][-1] == (10, (track_id, None, False, 1, 2))
+
+    ingest.run_pipeline(*pipeline['retries'][-1][1])
+    assert len(pipeline['retries']) == 2
+    assert pipeline['calls'] == [('check', False)] + [('render', False)] * 3  # The done stage is not redone
+    assert runs(track_id)['render'].status == 'done'
+    assert runs(track_id)['render'].attempts == 3
+    assert status(track_id) == 'ready'
+
+
+def test_optional_stage_out_of_attempts_still_publishes(pipeline):
+    track_id = pipeline['track_id']
+    pipeline['failures']['render'] = 3
+    ingest.run_pipeline(track_id, start=1, attempt=2)
+
+    assert pipeline['retries'] == []
+    assert runs(track_id)['render'].status == 'failed'
+    assert status(track_id) == 'ready'
+
+
+def test_required_stage_out_of_attempts_fails_the_track(pipeline):
+    track_id = pipeline['track_id']
+    pipeline['failures']['check'] = 1
+    current_app.config['INGEST_MAX_ATTEMPTS'] = 1
+
+    ingest.run_pipeline(track_id)
+    assert pipeline['calls'] == [('check', False)]  # Later stages are not run
+    assert pipeline['retries'] == []
+    assert status(track_id) == 'failed'
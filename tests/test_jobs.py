@@ -0,0 +1,64 @@
+import time
+import sqlite3
+import pytest
+from jobs import Job, JobDirectory
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return JobDirectory(str(tmp_path / 'jobs.db'), result_ttl=600, progress_interval=0.3)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def shared_state(directory, job):
+    remote = directory.get(job.id)
+    return remote.snapshot if remote else None
+
+
+def test_state_changes_are_shared_at_once(directory):
+    job = Job('convert', on_change=directory.publish)
+    wait_for(lambda: shared_state(directory, job) is not None)
+    job.set_state('running')
+    wait_for(lambda: shared_state(directory, job)['state'] == 'running', timeout=0.2)
+
+
+def test_progress_within_a_stage_is_throttled(directory):
+    job = Job('convert', on_change=directory.publish)
+    job.progress('convert', 0)
+    wait_for(lambda: (shared_state(directory, job) or {}).get('stage') == 'convert', timeout=0.2)
+    for percent in range(1, 51):
+        job.progress('convert', percent)
+    time.sleep(0.1)
+    assert shared_state(directory, job)['percent'] < 50
+    wait_for(lambda: shared_state(directory, job)['percent'] == 50, timeout=1)
+
+
+def test_publishing_does_not_wait_for_a_locked_database(directory, tmp_path):
+    job = Job('convert', on_change=directory.publish)
+    wait_for(lambda: shared_state(directory, job) is not None)
+
+    blocker = sqlite3.connect(str(tmp_path / 'jobs.db'), isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    started = time.monotonic()
+    job.set_state('running')
+    job.progress('convert', 10)
+    job.set_state('done')
+    assert time.monotonic() - started < 0.1
+    blocker.execute("ROLLBACK")
+
+    wait_for(lambda: shared_state(directory, job)['state'] == 'done')
+    assert directory.get(job.id).finished
+
+
+def test_cancellation_requests_reach_the_owner(directory):
+    job = Job('youtube', on_change=directory.publish)
+    wait_for(lambda: shared_state(directory, job) is not None)
+    assert directory.request_cancel(job.id)
+    assert directory.take_cancellations() == [job.id]
+    assert directory.take_cancellations() == []
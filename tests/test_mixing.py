@@ -0,0 +1,81 @@
+import math
+import uuid
+import numpy as np
+import pytest
+from flask_login import LoginManager
+import admission
+from mixing import stem_gains, MAX_GAIN_DB
+from routes.audio import audio_bp
+from services import StemSeparationService
+
+MIX_LIMITS = {'queue': 4, 'admin_reserve': 0, 'per_ip': 1, 'per_session': 1, 'per_minute': 60, 'burst': 60, 'seconds': 10}
+
+
+def test_gains_from_db():
+    gains = stem_gains(['Vocals', 'Drums', 'Bass'], {'Vocals': -6, 'Drums': 100}, muted={'Bass'})
+    assert gains[0] == pytest.approx(10 ** (-6 / 20))
+    assert gains[1] == pytest.approx(10 ** (MAX_GAIN_DB / 20))
+    assert gains[2] == 0
+
+
+def test_solo_silences_other_stems():
+    assert list(stem_gains(['Vocals', 'Drums'], {}, soloed={'Drums'})) == [0, 1]
+
+
+@pytest.mark.parametrize('gain', [math.nan, math.inf, -math.inf])
+def test_non_finite_gains_are_rejected(gain):
+    with pytest.raises(ValueError):
+        stem_gains(['Vocals'], {'Vocals': gain})
+
+
+@pytest.fixture
+def app(make_app, tmp_path, monkeypatch):
+    app = make_app(
+        CONVERTED_FOLDER=str(tmp_path / 'converted'),
+        PCM_CACHE_FOLDER=str(tmp_path / 'pcm'),
+        ADMISSION_DB=str(tmp_path / 'admission.db'),
+        ADMISSION_LIMITS={'mix': MIX_LIMITS}
+    )
+    LoginManager(app).user_loader(lambda user_id: None)
+    app.register_blueprint(audio_bp)
+    monkeypatch.setattr(admission, '_controller', None)
+    return app
+
+
+@pytest.fixture
+def session_id(app, tmp_path):
+    session_id = str(uuid.uuid4())
+    (tmp_path / 'converted' / 'htdemucs' / session_id).mkdir(parents=True)
+    return session_id
+
+
+def active_mixes(app):
+    with app.app_context():
+        return admission.get_admission_controller().stats()['mix']['active']
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf', 'loud'])
+def test_mix_rejects_invalid_gains(app, session_id, value):
+    response = app.test_client().get(f'/audio/separator/{session_id}/mix?Vocals={value}')
+    assert response.status_code == 400
+    assert active_mixes(app) == 0
+
+
+def test_mix_holds_lease_until_sent(app, session_id, monkeypatch):
+    def render_mix(self, session_id, gains_db, muted=(), soloed=()):
+        chunks = [b'RIFF', np.zeros(4, dtype='<i2').tobytes()]
+        return sum(map(len, chunks)), iter(chunks)
+
+    monkeypatch.setattr(StemSeparationService, 'render_mix', render_mix)
+    client = app.test_client()
+    response = client.get(f'/audio/separator/{session_id}/mix?Vocals=-3', buffered=False)
+    assert response.status_code == 200
+    assert active_mixes(app) == 1
+
+    refused = client.get(f'/audio/separator/{session_id}/mix')
+    assert refused.status_code == 429
+    assert 'Retry-After' in refused.headers
+
+    assert response.get_data() == b'RIFF' + bytes(8)
+    response.close()
+    assert active_mixes(app) == 0
@@ -0,0 +1,294 @@
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import outbound
+from outbound import OutboundClient, CircuitBreaker, TokenBucket, UpstreamUnavailable
+from chat import TogetherChatBackend
+
+HOST = {'concurrency': 8, 'rate': 100, 'burst': 100, 'failures': 5, 'reset_after': 30}
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing early (on an error status, or a pooled connection at exit) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class Upstream:
+    """Local HTTP server answering with scripted responses, then 200 ``ok``.
+
+    A response is (status, headers, body); the body may be a list of
+    chunks, sent one at a time. Requests are recorded with their body, and
+    ``hold`` makes every handler wait for it to be set before answering.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        self.hold = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                upstream.handle(self)
+
+            def do_POST(self):
+                upstream.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def handle(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        with self._lock:
+            self.requests.append((handler.command, handler.path, dict(handler.headers), body))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            status, headers, content = self.responses.pop(0) if self.responses else (200, {}, 'ok')
+        try:
+            if self.hold is not None:
+                self.hold.wait(10)
+            chunks = content if isinstance(content, list) else [content]
+            handler.send_response(status)
+            for name, value in headers.items():
+                handler.send_header(name, value)
+            handler.send_header('Transfer-Encoding', 'chunked')
+            handler.end_headers()
+            for chunk in chunks:
+                data = chunk.encode()
+                handler.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                handler.wfile.flush()
+            handler.wfile.write(b"0\r\n\r\n")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    yield server
+    if server.hold is not None:
+        server.hold.set()
+    server.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the client's backoff sleeps instead of waiting them out."""
+    recorded = []
+    monkeypatch.setattr(outbound.time, 'sleep', recorded.append)
+    return recorded
+
+
+def make_client(retries=3, **host):
+    return OutboundClient(hosts={}, default_host=dict(HOST, **host), retries=retries, backoff=0, max_backoff=10)
+
+
+def test_retries_429_after_retry_after(upstream, sleeps):
+    upstream.responses.append((429, {'Retry-After': '2'}, 'slow down'))
+    response = make_client().request('GET', f"{upstream.url}/items")
+    assert response.status_code == 200
+    assert response.text == 'ok'
+    assert len(upstream.requests) == 2
+    assert sleeps == [2.0]
+
+
+def test_retries_503_after_retry_after(upstream, sleeps):
+    upstream.responses += [(503, {'Retry-After': '1'}, 'busy'), (503, {'Retry-After': '3'}, 'busy')]
+    response = make_client().request('GET', f"{upstream.url}/items")
+    assert response.status_code == 200
+    assert len(upstream.requests) == 3
+    assert sleeps == [1.0, 3.0]
+
+
+def test_retry_after_is_capped_by_max_backoff(upstream, sleeps):
+    upstream.responses.append((503, {'Retry-After': '3600'}, 'down for maintenance'))
+    make_client().request('GET', f"{upstream.url}/items")
+    assert sleeps == [10]
+
+
+def test_last_retryable_response_is_returned(upstream, sleeps):
+    upstream.responses += [(503, {}, 'busy')] * 3
+    client = make_client(retries=2)
+    response = client.request('GET', f"{upstream.url}/items")
+    assert response.status_code == 503
+    assert response.text == 'busy'
+    assert len(upstream.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_client_errors_are_not_retried(upstream, sleeps):
+    upstream.responses.append((404, {}, 'missing'))
+    client = make_client()
+    response = client.request('GET', f"{upstream.url}/items")
+    assert response.status_code == 404
+    assert len(upstream.requests) == 1
+    assert client.limiter('127.0.0.1').breaker.state == 'closed'
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=2, reset_after=30)
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    assert breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.allow() > 0
+
+
+def test_breaker_recovers_through_half_open():
+    breaker = CircuitBreaker(failures=1, reset_after=0.05)
+    breaker.record_failure()
+    assert breaker.allow() > 0
+    time.sleep(0.06)
+    assert breaker.allow() == 0
+    assert breaker.state == 'half-open'
+    assert breaker.allow() > 0  # One trial call at a time
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() == 0
+
+
+def test_failed_trial_call_reopens_breaker():
+    breaker = CircuitBreaker(failures=3, reset_after=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.allow() > 0
+
+
+def test_client_fails_fast_while_open_and_recovers(upstream):
+    upstream.responses += [(503, {}, 'busy')] * 2
+    client = make_client(retries=0, failures=2, reset_after=0.2)
+    url = f"{upstream.url}/items"
+    assert client.request('GET', url).status_code == 503
+    assert client.request('GET', url).status_code == 503
+    with pytest.raises(UpstreamUnavailable) as error:
+        client.request('GET', url)
+    assert error.value.reason == 'circuit open'
+    assert len(upstream.requests) == 2
+
+    time.sleep(0.25)
+    assert client.request('GET', url).status_code == 200
+    assert client.limiter('127.0.0.1').breaker.state == 'closed'
+    assert len(upstream.requests) == 3
+
+
+def test_connection_errors_count_as_failures(sleeps):
+    client = make_client(retries=1, failures=2)
+    with pytest.raises(requests.ConnectionError):
+        client.request('GET', 'http://127.0.0.1:9/items', timeout=1)  # Nothing listens on the discard port
+    assert client.limiter('127.0.0.1').breaker.state == 'open'
+
+
+def test_concurrency_is_capped_per_host(upstream):
+    upstream.hold = threading.Event()
+    client = make_client(concurrency=2)
+    results = []
+
+    def fetch():
+        results.append(client.request('GET', f"{upstream.url}/items").status_code)
+
+    threads = [threading.Thread(target=fetch) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while upstream.in_flight < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)  # Give requests over the cap the chance to get through
+    assert upstream.in_flight == 2
+    assert client.stats()['127.0.0.1']['in_use'] == 2
+
+    upstream.hold.set()
+    for thread in threads:
+        thread.join(10)
+    assert results == [200] * 5
+    assert upstream.max_in_flight == 2
+    assert client.stats()['127.0.0.1']['in_use'] == 0
+
+
+def test_requests_over_the_cap_give_up_after_waiting(upstream):
+    upstream.hold = threading.Event()
+    client = make_client(concurrency=1, wait=0.1)
+    thread = threading.Thread(target=client.request, args=('GET', f"{upstream.url}/slow"))
+    thread.start()
+    deadline = time.monotonic() + 5
+    while upstream.in_flight < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(UpstreamUnavailable) as error:
+        client.request('GET', f"{upstream.url}/items")
+    assert error.value.reason == 'too many concurrent requests'
+    upstream.hold.set()
+    thread.join(10)
+
+
+def test_stream_holds_slot_until_block_ends(upstream):
+    client = make_client()
+    with client.stream('GET', f"{upstream.url}/items") as response:
+        assert client.stats()['127.0.0.1']['in_use'] == 1
+        assert response.text == 'ok'
+    assert client.stats()['127.0.0.1']['in_use'] == 0
+
+
+def test_token_bucket_allows_bursts_then_rate():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.acquire(0) for _ in range(3)] == [0, 0, 0]
+    wait = bucket.acquire(0)
+    assert 0 < wait <= 0.1
+    assert bucket.acquire(1) == 0  # Waits for the next token
+
+
+def sse(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def test_together_backend_parses_stream(upstream):
+    upstream.responses.append((200, {'Content-Type': 'text/event-stream'}, [
+        sse({'choices': [{'delta': {'role': 'assistant'}}]}),
+        sse({'choices': [{'delta': {'content': 'Side'}}]}),
+        ': keep-alive\n\n',
+        sse({'choices': [{'delta': {'content': 'chain the '}}]}),
+        sse({'choices': []}),
+        sse({'choices': [{'delta': {'content': 'kick.'}, 'finish_reason': 'stop'}]}),
+        'data: [DONE]\n\n'
+    ]))
+    backend = TogetherChatBackend(f"{upstream.url}/v1/", 'key', 'model', make_client(), {'temperature': 0.5})
+    messages = [{'role': 'user', 'content': 'How do I make the bass duck?'}]
+
+    assert list(backend.stream(messages)) == ['Side', 'chain the ', 'kick.']
+    method, path, headers, body = upstream.requests[0]
+    assert (method, path) == ('POST', '/v1/chat/completions')
+    assert headers['Authorization'] == 'Bearer key'
+    assert json.loads(body) == {'model': 'model', 'messages': messages, 'stream': True, 'temperature': 0.5}
+
+
+def test_together_backend_raises_on_error_status(upstream):
+    upstream.responses.append((401, {}, '{"error": "invalid api key"}'))
+    backend = TogetherChatBackend(upstream.url, 'wrong', 'model', make_client())
+    with pytest.raises(requests.HTTPError):
+        list(backend.stream([{'role': 'user', 'content': 'Hi'}]))
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+import pcm_cache
+from pcm_cache import PcmCache
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Files 'decoded' by the cache; each decodes to 1000 frames of its length in bytes."""
+    decoded = []
+
+    def decode(file_path, sample_rate, channels=2):
+        decoded.append(file_path)
+        yield np.full((1000, channels), os.path.getsize(file_path), dtype=np.int16)
+
+    monkeypatch.setattr(pcm_cache, 'decode_pcm', decode)
+    return decoded
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Upload paths named like blob store files, so their cache keys are their names."""
+    paths = []
+    for size in (1, 2, 3):
+        path = tmp_path / f"{str(size) * 64}.wav"
+        path.write_bytes(b'x' * size)
+        paths.append(str(path))
+    return paths
+
+
+def cache_files(cache):
+    return sorted(name for name in os.listdir(cache.folder))
+
+
+def test_decodes_once_and_maps_the_samples(tmp_path, decodes, sources):
+    cache = PcmCache(str(tmp_path / 'pcm'), max_bytes=1 << 20)
+    assert cache.lookup(sources[0], 44100) is None
+
+    samples = cache.get(sources[0], 44100)
+    assert samples.shape == (1000, 2)
+    assert (samples == 1).all()
+    assert np.array_equal(cache.get(sources[0], 44100), samples)
+    assert decodes == [sources[0]]
+    assert cache_files(cache) == [f"{'1' * 64}_44100_2.pcm"]
+
+
+def test_eviction_keeps_pinned_files(tmp_path, decodes, sources):
+    cache = PcmCache(str(tmp_path / 'pcm'), max_bytes=4000)  # One entry of 1000 stereo int16 frames
+    cache.get(sources[0], 44100)
+    with cache.pinned(sources[0], 44100) as path:
+        assert path == cache.path('1' * 64, 44100, 2)
+        cache.get(sources[1], 44100)
+        assert os.path.exists(path)  # Over the limit, but a reader holds it
+
+    cache.get(sources[2], 44100)
+    assert cache_files(cache) == [f"{'3' * 64}_44100_2.pcm"]
+
+
+def test_pinned_yields_none_on_miss(tmp_path, decodes, sources):
+    cache = PcmCache(str(tmp_path / 'pcm'), max_bytes=1 << 20)
+    with cache.pinned(sources[0], 44100) as path:
+        assert path is None
+
+
+def test_samples_outlive_eviction(tmp_path, decodes, sources):
+    cache = PcmCache(str(tmp_path / 'pcm'), max_bytes=0)
+    first = cache.get(sources[0], 44100)
+    cache.get(sources[1], 44100)
+    assert cache_files(cache) == [f"{'2' * 64}_44100_2.pcm"]
+    assert (first == 1).all()
+
+
+def test_decode_locks_come_from_a_fixed_pool(tmp_path):
+    cache = PcmCache(str(tmp_path), max_bytes=0)
+    locks = {pcm_cache._decode_lock(cache.path(str(n), 44100, 2)) for n in range(1000)}
+    assert locks <= set(pcm_cache._locks)
+    assert pcm_cache._decode_lock(cache.path('1', 44100, 2)) is pcm_cache._decode_lock(cache.path('1', 44100, 2))
@@ -0,0 +1,68 @@
+import os
+import threading
+import pytest
+import profiling
+from profiling import Capture
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    from flask import g
+    from flask_login import LoginManager
+
+    app = make_app(PROFILE_FOLDER=str(tmp_path / 'profiles'), PROFILING_ENABLED=True, PROFILING_ENDPOINTS=['work'])
+    LoginManager(app).user_loader(lambda user_id: None)
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = 'same-id'
+
+    profiling.init_app(app)
+    app.add_url_rule('/work', 'work', lambda: 'done')
+    return app
+
+
+def test_one_capture_at_a_time(tmp_path):
+    first = Capture(str(tmp_path / 'a'), 'request').start()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(Capture(str(tmp_path / 'b'), 'request').start().running))
+    thread.start()
+    thread.join()
+    assert first.running
+    assert results == [False]
+    first.stop()
+    assert os.path.exists(tmp_path / 'a' / 'request.prof')
+    assert not os.path.exists(tmp_path / 'b')
+
+    second = Capture(str(tmp_path / 'b'), 'request').start()
+    assert second.running
+    second.stop()
+
+
+def test_nested_capture_is_part_of_the_outer_one(tmp_path):
+    with Capture(str(tmp_path), 'outer') as outer:
+        with Capture(str(tmp_path), 'inner') as inner:
+            assert outer.running and not inner.running
+    assert sorted(os.listdir(tmp_path)) == ['outer.json', 'outer.prof']
+
+
+def test_repeated_request_ids_get_their_own_profiles(app, tmp_path):
+    client = app.test_client()
+    ids = [client.get('/work').headers['X-Profile-ID'] for _ in range(2)]
+    assert ids[0] != ids[1]
+    assert all(profile_id.startswith('same-id-') for profile_id in ids)
+    assert sorted(os.listdir(tmp_path / 'profiles')) == sorted(ids)
+
+
+def test_request_skipped_while_another_is_profiled(app, tmp_path):
+    busy = Capture(str(tmp_path / 'busy'), 'job')
+    thread = threading.Thread(target=busy.start)
+    thread.start()
+    thread.join()
+    try:
+        response = app.test_client().get('/work')
+    finally:
+        busy.stop()
+    assert response.data == b'done'
+    assert 'X-Profile-ID' not in response.headers
+    assert not os.path.exists(tmp_path / 'profiles')
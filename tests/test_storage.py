@@ -0,0 +1,112 @@
+import io
+import os
+import pytest
+from extensions import db
+from models import MediaBlob
+from storage import BlobStore
+
+
+class Upload(io.BytesIO):
+    def __init__(self, data, filename):
+        super().__init__(data)
+        self.filename = filename
+
+
+@pytest.fixture
+def store(db_app):
+    os.makedirs(db_app.config['UPLOAD_FOLDER'])
+    with db_app.app_context():
+        yield BlobStore(db_app.config['UPLOAD_FOLDER'])
+
+
+def refcount(filename):
+    return db.session.query(MediaBlob.refcount).filter_by(filename=filename).scalar()
+
+
+def test_identical_uploads_share_one_file(store):
+    first = store.put(Upload(b'kick', 'Kick.WAV'))
+    second = store.put(Upload(b'kick', 'other name.wav'))
+    db.session.commit()
+    assert first == second
+    assert first.endswith('.wav')
+    assert refcount(first) == 2
+    assert os.listdir(store.upload_folder) == [first]
+
+
+def test_releasing_the_last_reference_purges_the_file(store):
+    filename = store.put(Upload(b'snare', 'snare.wav'))
+    store.retain(filename)
+    db.session.commit()
+
+    assert store.release(filename) is None
+    db.session.commit()
+    assert refcount(filename) == 1
+
+    orphan = store.release(filename)
+    db.session.commit()
+    assert orphan == filename
+    assert store.purge([orphan]) == [filename]
+    assert MediaBlob.query.count() == 0
+    assert not os.path.exists(store.path(filename))
+
+
+def test_release_many_counts_each_occurrence(store):
+    kick = store.put(Upload(b'kick', 'kick.wav'))
+    store.retain(kick)
+    hat = store.put(Upload(b'hat', 'hat.wav'))
+    db.session.commit()
+
+    orphans = store.release_many([kick, hat, 'legacy.mp3', None])
+    db.session.commit()
+    assert sorted(orphans) == sorted([hat, 'legacy.mp3'])
+    assert refcount(kick) == 1
+
+    assert store.release_many([kick, kick]) == [kick]
+    db.session.commit()
+    assert refcount(kick) is None
+
+
+def test_purge_keeps_revived_blobs(store):
+    filename = store.put(Upload(b'clap', 'clap.wav'))
+    db.session.commit()
+    orphan = store.release(filename)
+    db.session.commit()
+    assert store.put(Upload(b'clap', 'clap.wav')) == filename  # Uploaded again before the purge
+    db.session.commit()
+    assert store.purge([orphan]) == []
+    assert os.path.exists(store.path(filename))
+
+
+def test_put_path_moves_new_content_and_drops_duplicates(store, tmp_path):
+    source = tmp_path / 'render.wav'
+    source.write_bytes(b'mix')
+    filename = store.put_path(str(source))
+    duplicate = tmp_path / 'again.wav'
+    duplicate.write_bytes(b'mix')
+    assert store.put_path(str(duplicate)) == filename
+    db.session.commit()
+    assert not source.exists() and not duplicate.exists()
+    assert refcount(filename) == 2
+
+
+def test_rolled_back_upload_leaves_no_file(store):
+    filename = store.put(Upload(b'vocals', 'vocals.wav'))
+    assert os.path.exists(store.path(filename))
+    db.session.rollback()
+    assert not os.path.exists(store.path(filename))
+    assert MediaBlob.query.count() == 0
+
+
+def test_upload_closed_without_commit_leaves_no_file(store):
+    filename = store.put(Upload(b'bass', 'bass.wav'))
+    db.session.close()
+    assert not os.path.exists(store.path(filename))
+
+
+def test_rollback_keeps_files_of_committed_blobs(store):
+    filename = store.put(Upload(b'pad', 'pad.wav'))
+    db.session.commit()
+    store.put(Upload(b'pad', 'pad.wav'))
+    db.session.rollback()
+    assert os.path.exists(store.path(filename))
+    assert refcount(filename) == 1
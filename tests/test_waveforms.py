@@ -0,0 +1,26 @@
+import os
+import threading
+import numpy as np
+from waveforms import WaveformPeaksService
+
+
+def test_concurrent_writers_leave_a_whole_file(tmp_path):
+    service = WaveformPeaksService(str(tmp_path), str(tmp_path), resolutions=[256], sample_rate=22050, bits=16)
+    path = str(tmp_path / 'track_256.dat')
+    levels = {n: (np.full(20000, -n, dtype=np.int32), np.full(20000, n, dtype=np.int32)) for n in range(1, 9)}
+
+    def write(n):
+        for _ in range(20):
+            service._save(path, 256, *levels[n])
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in levels]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    peaks = service.read(path)
+    assert peaks['length'] == 20000
+    n = peaks['data'][1]
+    assert peaks['data'] == [-n, n] * 20000  # All from one writer
+    assert os.listdir(tmp_path) == ['track_256.dat']
@@ -0,0 +1,41 @@
+import threading
+import pytest
+from outbound import UpstreamUnavailable
+from youtube import YoutubeDLPool
+
+OPTIONS = {'format': 'bestaudio/best', 'quiet': False, 'no_warnings': False}
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return YoutubeDLPool(OPTIONS, str(tmp_path / 'staging'), size=1, client=None, wait=0.1)
+
+
+def test_instances_are_quiet(pool):
+    with pool.instance() as pooled:
+        assert pooled.ydl.params['quiet'] is True
+        assert pooled.ydl.params['no_warnings'] is True
+
+
+def test_instances_are_reused(pool):
+    with pool.instance() as first:
+        pass
+    with pool.instance() as second:
+        assert second is first
+
+
+def test_lookup_gives_up_while_all_instances_are_busy(pool):
+    with pool.instance():
+        with pytest.raises(UpstreamUnavailable) as error:
+            pool.extract_info('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+    assert error.value.reason == 'all downloaders busy'
+    assert error.value.retry_after == pool.wait
+
+
+def test_waiting_caller_gets_released_instance(pool):
+    taken = []
+    with pool.instance() as pooled:
+        waiter = threading.Thread(target=lambda: taken.append(pool.instance(timeout=5).__enter__()))
+        waiter.start()
+    waiter.join(5)
+    assert taken == [pooled]
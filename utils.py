@@ -1,11 +1,19 @@
 import os
 import gc
+import time
 import uuid
 import shutil
-import traceback
+import logging
 from werkzeug.utils import secure_filename
-import librosa
 import numpy as np
+from metrics import StageTimer, observe, inc
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Rate of the stereo PCM the analyzer reads from the PCM cache; the same
+# rate the separator and converter use, so one decode serves all of them
+PCM_SAMPLE_RATE = 44100
 
 def ensure_directory_exists(directory_path):
     """Ensure a directory exists, creating it if necessary."""
@@ -31,31 +39,49 @@ def save_uploaded_file(file_obj, upload_folder, original_filename=None):
 
 def cleanup_file(file_path):
     """Safely remove a file if it exists."""
-    print(f"Attempting to clean up file: {file_path}")
+    logger.debug("Cleaning up file %s", file_path)
     if os.path.exists(file_path):
         try:
             os.remove(file_path)
-            print(f"Successfully removed file: {file_path}")
+            logger.debug("Removed file %s", file_path)
             return True
-        except Exception as e:
-            print(f"Error cleaning up file {file_path}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error cleaning up file %s", file_path)
             return False
     else:
-        print(f"File not found for cleanup: {file_path}")
+        logger.debug("File not found for cleanup: %s", file_path)
         return False
 
-def analyze_audio_file(file_path):
-    """Analyze audio file to detect tempo and key."""
+def mono_from_pcm(pcm, sr=22050):
+    """Downmix cached stereo int16 samples to float mono at the analysis rate."""
+    import librosa
+
+    y = pcm.mean(axis=1, dtype=np.float32) / 32768.0
+    return librosa.resample(y, orig_sr=PCM_SAMPLE_RATE, target_sr=sr)
+
+@profiled('analyze')
+def analyze_audio_file(file_path, progress=None, pcm_cache=None):
+    """Analyze audio file to detect tempo and key.
+
+    progress, if given, is called with (stage, percent) as analysis advances.
+    With a PcmCache the file is decoded once into the cache (or not at all
+    if another tool already did) and both analysis passes read from it.
+    """
+    import librosa
+
+    stages = StageTimer('analyze')
+
+    def report(stage, percent=None):
+        stages.start(stage)
+        if progress is not None:
+            progress(stage, percent)
+
     try:
-        print(f"=== ANALYZE_AUDIO_FILE FUNCTION CALLED ===")
-        print(f"File path: {file_path}")
-        print(f"Processing file size: {os.path.getsize(file_path) / (1024 * 1024):.2f} MB")
+        logger.info("Analyzing %s (%.2f MB)", file_path, os.path.getsize(file_path) / (1024 * 1024))
         
         # Verify the file exists
         if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
+            logger.warning("File not found: %s", file_path)
             return {
                 'success': False,
                 'error': f"File not found: {file_path}"
@@ -63,37 +89,39 @@ def analyze_audio_file(file_path):
             
         # Verify the file is readable
         if not os.access(file_path, os.R_OK):
-            print(f"File is not readable: {file_path}")
+            logger.warning("File is not readable: %s", file_path)
             return {
                 'success': False,
                 'error': f"File is not readable: {file_path}"
             }
             
         # Load the audio file with librosa using a lower sample rate and mono
-        print(f"Loading audio file: {file_path}")
-        print(f"Memory usage before loading: {gc.get_count()}")
+        report('load', 5)
+        logger.debug("Loading audio file %s, GC counts %s", file_path, gc.get_count())
+        pcm = None
         try:
-            y, sr = librosa.load(file_path, sr=22050, mono=True)
+            if pcm_cache is not None:
+                pcm = pcm_cache.get(file_path, PCM_SAMPLE_RATE, channels=2)
+                y, sr = mono_from_pcm(pcm), 22050
+            else:
+                y, sr = librosa.load(file_path, sr=22050, mono=True)
             duration = librosa.get_duration(y=y, sr=sr)
-            print(f"Audio loaded successfully, sample rate: {sr}, length: {len(y)}, duration: {duration:.2f} seconds")
+            logger.debug("Audio loaded, sample rate: %s, length: %s, duration: %.2f seconds", sr, len(y), duration)
         except Exception as load_error:
-            print(f"Failed to load audio file: {str(load_error)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to load audio file")
             return {
                 'success': False,
                 'error': f"Failed to load audio file: {str(load_error)}"
             }
         
         # Get onset envelope with reduced complexity
-        print("Calculating onset envelope")
+        report('onset', 25)
+        logger.debug("Calculating onset envelope")
         try:
             onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=512)
-            print(f"Onset envelope calculated, length: {len(onset_env)}")
+            logger.debug("Onset envelope calculated, length: %s", len(onset_env))
         except Exception as onset_error:
-            print(f"Failed to calculate onset envelope: {str(onset_error)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to calculate onset envelope")
             return {
                 'success': False,
                 'error': f"Failed to calculate onset envelope: {str(onset_error)}"
@@ -104,7 +132,8 @@ def analyze_audio_file(file_path):
         gc.collect()
         
         # Dynamic tempo detection with simplified parameters
-        print("Detecting tempo")
+        report('tempo', 40)
+        logger.debug("Detecting tempo")
         try:
             # Use more comprehensive tempo detection by trying multiple starting points
             # and combining the results to avoid bias toward any particular value
@@ -113,17 +142,15 @@ def analyze_audio_file(file_path):
             
             # Try multiple starting points to get a broader range of tempo estimates
             for start_bpm in candidate_start_bpms:
-                print(f"Trying tempo detection with start_bpm={start_bpm}")
+                logger.debug("Trying tempo detection with start_bpm=%s", start_bpm)
                 dtempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr, aggregate=None,
                                            hop_length=512, start_bpm=start_bpm)
                 all_tempos.extend(dtempo)
-                print(f"  Found {len(dtempo)} tempo estimates")
+                logger.debug("Found %s tempo estimates", len(dtempo))
             
-            print(f"Tempo candidates collected, count: {len(all_tempos)}")
+            logger.debug("Tempo candidates collected, count: %s", len(all_tempos))
         except Exception as tempo_error:
-            print(f"Failed to detect tempo: {str(tempo_error)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to detect tempo")
             return {
                 'success': False,
                 'error': f"Failed to detect tempo: {str(tempo_error)}"
@@ -153,7 +180,7 @@ def analyze_audio_file(file_path):
             
             # Sort by count (frequency)
             grouped_tempos.sort(key=lambda x: x[1], reverse=True)
-            print(f"Grouped tempos: {grouped_tempos[:5]}")
+            logger.debug("Grouped tempos: %s", grouped_tempos[:5])
             
             # Consider tempo harmonics (double or half the tempo)
             tempo_candidates = []
@@ -164,11 +191,9 @@ def analyze_audio_file(file_path):
             
             # Sort by score
             tempo_candidates.sort(key=lambda x: x[1], reverse=True)
-            print(f"Tempo candidates with harmonics: {tempo_candidates[:5]}")
+            logger.debug("Tempo candidates with harmonics: %s", tempo_candidates[:5])
         except Exception as tempo_calc_error:
-            print(f"Failed to calculate tempo frequencies: {str(tempo_calc_error)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Failed to calculate tempo frequencies")
             return {
                 'success': False,
                 'error': f"Failed to calculate tempo frequencies: {str(tempo_calc_error)}"
@@ -181,18 +206,22 @@ def analyze_audio_file(file_path):
         
         # Get the best tempo
         if not tempo_candidates:
-            print("No tempo candidates found, using default 120 BPM")
+            logger.info("No tempo candidates found, using default 120 BPM")
             best_tempo = 120  # Default if no tempo detected
         else:
             best_tempo = tempo_candidates[0][0]
-            print(f"Best tempo: {best_tempo} BPM")
+            logger.debug("Best tempo: %s BPM", best_tempo)
         
         # Load audio again for key detection with very low duration
-        print("Detecting key")
+        report('key', 65)
+        logger.debug("Detecting key")
         key = "Unknown"  # Default value
         try:
-            y, sr = librosa.load(file_path, sr=22050, duration=30, mono=True)
-            print(f"Audio reloaded for key detection, sample rate: {sr}, length: {len(y)}")
+            if pcm is not None:
+                y, sr = mono_from_pcm(pcm[:PCM_SAMPLE_RATE * 30]), 22050
+            else:
+                y, sr = librosa.load(file_path, sr=22050, duration=30, mono=True)
+            logger.debug("Audio reloaded for key detection, sample rate: %s, length: %s", sr, len(y))
             
             # Improved key detection using Krumhansl-Schmuckler key-finding algorithm
             chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=512, n_chroma=12)
@@ -229,98 +258,192 @@ def analyze_audio_file(file_path):
             
             # Sort by correlation (highest first)
             key_scores.sort(key=lambda x: x[1], reverse=True)
-            print(f"Top key candidates: {key_scores[:3]}")
+            logger.debug("Top key candidates: %s", key_scores[:3])
             
             # Get the most likely key
             key = key_scores[0][0]
-            print(f"Key detected: {key}")
+            logger.debug("Key detected: %s", key)
             
             # Clean up
             del y
             del chroma
-        except Exception as key_error:
-            print(f"Error detecting key: {str(key_error)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error detecting key")
             # Continue with the default key value
         
         gc.collect()
         
-        print(f"Analysis complete: Tempo={best_tempo:.2f} BPM, Key={key}")
+        # Loudness is measured in its own streaming pass, so long files never
+        # need to be held in memory at 48 kHz stereo
+        report('loudness', 85)
+        logger.debug("Measuring loudness")
+        loudness = {'loudness': None, 'true_peak': None}
+        try:
+            from loudness import measure_loudness
+            if pcm is not None:
+                loudness = measure_loudness(file_path, pcm=pcm, sample_rate=PCM_SAMPLE_RATE)
+            else:
+                loudness = measure_loudness(file_path)
+            logger.debug("Integrated loudness: %s LUFS, true peak: %.2f dBTP", loudness['loudness'], loudness['true_peak'])
+        except Exception:
+            logger.exception("Error measuring loudness")
+            # Tempo and key are still useful without loudness
+        
+        logger.info("Analysis complete: Tempo=%.2f BPM, Key=%s", best_tempo, key)
         return {
             'success': True,
             'tempo': int(round(float(best_tempo))),
-            'key': key
+            'key': key,
+            'loudness': loudness['loudness'],
+            'true_peak': loudness['true_peak']
         }
     
     except Exception as e:
-        print(f"Error during audio analysis: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error during audio analysis")
         return {
             'success': False,
             'error': f"Error analyzing audio: {str(e)}"
         }
+    finally:
+        stages.stop()
+
+# ffmpeg encoder arguments for each output format
+CODEC_ARGS = {
+    'mp3': ['-codec:a', 'libmp3lame', '-qscale:a', '2'],
+    'wav': ['-codec:a', 'pcm_s16le'],
+    'flac': ['-codec:a', 'flac'],
+}
+
+def ffmpeg_convert_args(input_path, output_path, output_format, loudness_target=None, extra_args=(), progress=False,
+                        input_args=()):
+    """Build the ffmpeg argument list for a conversion, or None for an unknown format.
+
+    With progress, ffmpeg writes key=value progress lines to stdout (see
+    ffmpeg_progress_parser). ``input_args`` describe the input, e.g. the
+    layout of raw PCM.
+    """
+    if output_format not in CODEC_ARGS:
+        return None
+    args = ['ffmpeg']
+    if progress:
+        args += ['-progress', 'pipe:1', '-nostats']
+    args += [*input_args, '-i', input_path, *extra_args, *CODEC_ARGS[output_format]]
+    if loudness_target is not None:
+        args += ['-af', f'loudnorm=I={float(loudness_target)}:TP=-1:LRA=11']
+    return args + ['-y', output_path]
+
+def ffmpeg_progress_parser(duration):
+    """Return a function turning ffmpeg -progress lines into a percentage of ``duration`` seconds."""
+    def parse(line):
+        key, _, value = line.partition('=')
+        if key == 'progress' and value == 'end':
+            return 100
+        if key == 'out_time_us' and duration and value.isdigit():
+            return int(value) / 1e6 / duration * 100
+        return None
+    return parse
+
+def record_conversion(tool, seconds, input_path, output_path):
+    """Record an ffmpeg run's wall time and the bytes it read and wrote."""
+    observe('ffmpeg_duration_seconds', seconds, tool=tool)
+    inc('conversion_bytes_total', os.path.getsize(input_path), tool=tool, direction='in')
+    if os.path.exists(output_path):
+        inc('conversion_bytes_total', os.path.getsize(output_path), tool=tool, direction='out')
 
-def convert_audio(input_path, output_path, output_format):
-    """Convert audio file to specified format using ffmpeg."""
+@profiled('convert')
+def convert_audio(input_path, output_path, output_format, loudness_target=None, tool='convert'):
+    """Convert audio file to specified format using ffmpeg.
+
+    With a loudness_target (LUFS) the audio is EBU R128 normalized in the
+    same ffmpeg pass, peaks limited to -1 dBTP. ``tool`` labels the
+    conversion's metrics.
+    """
     import subprocess
     import os
     
     try:
-        print(f"=== CONVERT_AUDIO FUNCTION CALLED ===")
-        print(f"Input path: {input_path}")
-        print(f"Output path: {output_path}")
-        print(f"Output format: {output_format}")
+        logger.debug("Converting %s to %s (%s, loudness target %s)", input_path, output_path, output_format, loudness_target)
         
         # Ensure the output directory exists
         output_dir = os.path.dirname(output_path)
-        print(f"Ensuring output directory exists: {output_dir}")
         os.makedirs(output_dir, exist_ok=True)
         
-        # Build the command as a single string
-        if output_format == 'mp3':
-            cmd = f'ffmpeg -i "{input_path}" -codec:a libmp3lame -qscale:a 2 -y "{output_path}"'
-        elif output_format == 'wav':
-            cmd = f'ffmpeg -i "{input_path}" -codec:a pcm_s16le -y "{output_path}"'
-        elif output_format == 'flac':
-            cmd = f'ffmpeg -i "{input_path}" -codec:a flac -y "{output_path}"'
-        else:
-            print(f"Invalid format: {output_format}")
+        cmd = ffmpeg_convert_args(input_path, output_path, output_format, loudness_target)
+        if cmd is None:
+            logger.warning("Invalid format: %s", output_format)
             return False
         
-        print(f"Command: {cmd}")
+        logger.debug("Command: %s", ' '.join(cmd))
         
-        # Run the command with shell=True
-        print("Starting subprocess...")
+        started = time.perf_counter()
         process = subprocess.Popen(
             cmd,
-            shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
         
         # Wait for the process to complete
-        print("Waiting for process to complete...")
         stdout, stderr = process.communicate()
+        record_conversion(tool, time.perf_counter() - started, input_path, output_path)
         
         # Check if the process was successful
-        print(f"Process return code: {process.returncode}")
         if process.returncode != 0:
             stderr_text = stderr.decode('utf-8', errors='replace')
-            print(f"FFmpeg error: {stderr_text}")
+            logger.error("FFmpeg exited with code %s: %s", process.returncode, stderr_text)
             return False
         
         # Check if the output file was created
-        print(f"Checking if output file exists: {output_path}")
         if not os.path.exists(output_path):
-            print(f"Output file was not created: {output_path}")
+            logger.error("Output file was not created: %s", output_path)
             return False
             
-        print(f"Conversion successful: {output_path}")
+        logger.info("Converted %s to %s", input_path, output_path)
         return True
-    except Exception as e:
-        print(f"General conversion error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return False 
\ No newline at end of file
+    except Exception:
+        logger.exception("General conversion error")
+        return False
+
+def probe_audio(file_path):
+    """Read duration and stream info of an audio file with ffprobe.
+
+    Returns None if the file is not a decodable audio file.
+    """
+    import json
+    import subprocess
+
+    try:
+        process = subprocess.run(
+            ['ffprobe', '-v', 'error', '-print_format', 'json',
+             '-show_entries',
+             'format=duration,format_name:format_tags:stream=codec_type,codec_name,sample_rate,channels,sample_fmt:stream_tags',
+             file_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning("ffprobe failed for %s: %s", file_path, e)
+        return None
+
+    if process.returncode != 0:
+        logger.warning("ffprobe error: %s", process.stderr.decode('utf-8', errors='replace'))
+        return None
+
+    info = json.loads(process.stdout or b'{}')
+    audio_streams = [s for s in info.get('streams', []) if s.get('codec_type') == 'audio']
+    if not audio_streams:
+        return None
+
+    stream = audio_streams[0]
+    return {
+        'duration': float(info.get('format', {}).get('duration') or 0),
+        'format': info.get('format', {}).get('format_name'),
+        'codec': stream.get('codec_name'),
+        'sample_rate': int(stream.get('sample_rate') or 0),
+        'channels': int(stream.get('channels') or 0),
+        'sample_format': stream.get('sample_fmt'),
+        # Tags or other streams (cover art) that a conversion carries over
+        'has_metadata': bool(
+            info.get('format', {}).get('tags') or stream.get('tags') or len(info.get('streams', [])) > 1
+        )
+    }
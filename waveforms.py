@@ -0,0 +1,169 @@
+import os
+import struct
+import threading
+import subprocess
+import numpy as np
+
+# audiowaveform binary format (version 1), readable by peaks.js and friends:
+# version, flags (bit 0 set = 8-bit samples), sample rate, samples per pixel,
+# number of min/max pairs, then the interleaved pairs
+HEADER = struct.Struct('<iIiiI')
+FLAG_8BIT = 0x1
+
+# Bytes of 16-bit mono PCM read from ffmpeg at a time
+CHUNK_SIZE = 256 * 1024
+
+
+def decode_pcm(file_path, sample_rate, channels=1):
+    """Yield an audio file as int16 sample blocks, decoded by ffmpeg.
+
+    Mono blocks are 1-D; with more channels they are (samples, channels).
+    Only one block is held in memory at a time, whatever the file length.
+    """
+    frame_size = 2 * channels
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-i', file_path,
+         '-ac', str(channels), '-ar', str(sample_rate), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    try:
+        carry = b''
+        while True:
+            chunk = process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunk = carry + chunk
+            usable = len(chunk) - len(chunk) % frame_size
+            carry = chunk[usable:]
+            samples = np.frombuffer(chunk[:usable], dtype='<i2')
+            yield samples if channels == 1 else samples.reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg could not decode {file_path}: {stderr.decode('utf-8', errors='replace')}")
+
+
+def compute_peaks(blocks, samples_per_pixel):
+    """Reduce int16 sample blocks to min/max arrays at one resolution."""
+    mins, maxs = [], []
+    carry = np.empty(0, dtype=np.int16)
+    for block in blocks:
+        samples = np.concatenate((carry, block)) if len(carry) else block
+        whole = len(samples) - len(samples) % samples_per_pixel
+        if whole:
+            frames = samples[:whole].reshape(-1, samples_per_pixel)
+            mins.append(frames.min(axis=1))
+            maxs.append(frames.max(axis=1))
+        carry = samples[whole:].copy()
+
+    # The last, partial pixel still counts
+    if len(carry):
+        mins.append(carry.min(keepdims=True))
+        maxs.append(carry.max(keepdims=True))
+
+    if not mins:
+        return np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)
+    return np.concatenate(mins), np.concatenate(maxs)
+
+
+def downsample_peaks(mins, maxs, factor):
+    """Merge every ``factor`` neighbouring pixels of a finer resolution."""
+    if factor == 1 or not len(mins):
+        return mins, maxs
+    starts = np.arange(0, len(mins), factor)
+    return np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+
+
+class WaveformPeaksService:
+    """Service for generating and locating precomputed waveform peaks."""
+
+    def __init__(self, upload_folder, peaks_folder, resolutions, sample_rate, bits=8):
+        self.upload_folder = upload_folder
+        self.peaks_folder = peaks_folder
+        self.resolutions = sorted(resolutions)
+        self.sample_rate = sample_rate
+        self.bits = bits
+
+        # Coarser levels are merged from the finest one, so they must divide evenly
+        base = self.resolutions[0]
+        if any(resolution % base for resolution in self.resolutions):
+            raise ValueError(f"Peak resolutions must be multiples of {base}")
+
+    def peaks_path(self, audio_filename, resolution):
+        """Path of the peaks file for an audio file at one resolution."""
+        stem = os.path.splitext(audio_filename)[0]
+        return os.path.join(self.peaks_folder, f"{stem}_{resolution}.dat")
+
+    def exists(self, audio_filename):
+        """Check whether every resolution has been generated."""
+        return all(os.path.isfile(self.peaks_path(audio_filename, r)) for r in self.resolutions)
+
+    def generate(self, audio_filename, force=False):
+        """Decode the audio once and write every resolution. Returns the paths written."""
+        if not force and self.exists(audio_filename):
+            return []
+
+        source = os.path.join(self.upload_folder, audio_filename)
+        if not os.path.isfile(source):
+            raise FileNotFoundError(f"Audio file not found: {source}")
+
+        os.makedirs(self.peaks_folder, exist_ok=True)
+        base = self.resolutions[0]
+        mins, maxs = compute_peaks(decode_pcm(source, self.sample_rate), base)
+
+        written = []
+        for resolution in self.resolutions:
+            level_mins, level_maxs = downsample_peaks(mins, maxs, resolution // base)
+            path = self.peaks_path(audio_filename, resolution)
+            self._save(path, resolution, level_mins, level_maxs)
+            written.append(path)
+        return written
+
+    def remove(self, audio_filename):
+        """Delete the peaks files for an audio file."""
+        for resolution in self.resolutions:
+            path = self.peaks_path(audio_filename, resolution)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def read(self, path):
+        """Parse a peaks file into a dict in audiowaveform's JSON layout."""
+        with open(path, 'rb') as f:
+            version, flags, sample_rate, samples_per_pixel, length = HEADER.unpack(f.read(HEADER.size))
+            dtype = np.int8 if flags & FLAG_8BIT else np.dtype('<i2')
+            data = np.frombuffer(f.read(), dtype=dtype, count=length * 2)
+        return {
+            'version': 2,
+            'channels': 1,
+            'sample_rate': sample_rate,
+            'samples_per_pixel': samples_per_pixel,
+            'bits': 8 if flags & FLAG_8BIT else 16,
+            'length': length,
+            'data': data.tolist()
+        }
+
+    def _save(self, path, resolution, mins, maxs):
+        if self.bits == 8:
+            flags, dtype = FLAG_8BIT, np.int8
+            mins, maxs = mins >> 8, maxs >> 8
+        else:
+            flags, dtype = 0, np.dtype('<i2')
+
+        pairs = np.empty(len(mins) * 2, dtype=dtype)
+        pairs[0::2] = mins
+        pairs[1::2] = maxs
+
+        # Write under a name of this writer's own so readers never see a
+        # partial file and concurrent writers of the same peaks don't mix
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(1, flags, self.sample_rate, resolution, len(mins)))
+                f.write(pairs.tobytes())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,157 @@
+import itertools
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+import metrics
+import logs
+import profiling
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by _init_worker
+_progress_queue = None
+
+
+def _init_worker(progress_queue, metrics_folder, metrics_interval, log_settings):
+    global _progress_queue
+    _progress_queue = progress_queue
+    if log_settings is not None:
+        logs.configure(**log_settings)
+    if metrics_folder is not None:
+        metrics.registry.configure(metrics_folder, role='worker', flush_interval=metrics_interval)
+
+
+def _run_task(token, correlation, profile_folder, fn, args, kwargs):
+    """Call ``fn`` in a worker, forwarding its progress to the web process."""
+    logs.restore_correlation(correlation)
+    profiling.current.set(profile_folder)
+    if token is not None:
+        def report(stage, percent=None):
+            _progress_queue.put((token, stage, percent))
+        kwargs = dict(kwargs, progress=report)
+    return fn(*args, **kwargs)
+
+
+class WorkerPool:
+    """Process pool for CPU-heavy work, kept out of the web process.
+
+    Workers are forked from a fork server that imported the ``preload``
+    modules (librosa, numpy, scipy...) once, so every worker starts in
+    milliseconds and shares those pages with its siblings copy-on-write
+    instead of paying the imports and their memory again. The pool and its
+    fork server are only started by the first submission: serving pages
+    never imports the heavy libraries.
+
+    Functions that accept a ``progress(stage, percent)`` callback can report
+    back through ``submit(..., progress=callback)``; the callback runs on a
+    thread of the submitting process. A task that already started runs to
+    completion even if its caller gives up on it. If a worker dies (e.g.
+    killed for running out of memory) the executor is broken: its tasks
+    fail, and it is replaced by a new one for the next submission.
+    """
+
+    def __init__(self, processes, preload=()):
+        self.processes = max(1, processes)
+        self.preload = list(preload)
+        self._executor = None
+        self._progress_queue = None
+        self._listeners = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, progress=None, **kwargs):
+        """Run ``fn(*args, **kwargs)`` in a worker; returns a concurrent.futures Future."""
+        token = None
+        if progress is not None:
+            token = next(self._tokens)
+            with self._lock:
+                self._listeners[token] = progress
+        try:
+            executor = self._ensure_started()
+            try:
+                future = executor.submit(_run_task, token, logs.correlation(), profiling.current.get(), fn, args, kwargs)
+            except BrokenProcessPool:
+                # A worker died since the last submission finished
+                self._discard(executor)
+                executor = self._ensure_started()
+                future = executor.submit(_run_task, token, logs.correlation(), profiling.current.get(), fn, args, kwargs)
+        except BaseException:
+            self._forget(token)
+            raise
+        future.add_done_callback(lambda done: self._finished(executor, token, done))
+        return future
+
+    def stats(self):
+        """Configured worker processes and whether the pool is running."""
+        return {'processes': self.processes, 'started': self._executor is not None}
+
+    def _finished(self, executor, token, future):
+        self._forget(token)
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._discard(executor)
+
+    def _discard(self, executor):
+        """Shut down a broken executor, so the next submission starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return  # Already replaced
+            self._executor = None
+        logger.warning("Worker pool broken (a worker process died), starting a new one on the next submission")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forget(self, token):
+        if token is not None:
+            with self._lock:
+                self._listeners.pop(token, None)
+
+    def _dispatch_progress(self):
+        while True:
+            token, stage, percent = self._progress_queue.get()
+            with self._lock:
+                listener = self._listeners.get(token)
+            if listener is None:
+                continue
+            try:
+                listener(stage, percent)
+            except Exception:
+                logger.exception("Progress listener for worker task %s failed", token)
+
+    def _ensure_started(self):
+        """Return the running executor, starting one (and the progress dispatcher) if needed."""
+        with self._lock:
+            if self._executor is not None:
+                return self._executor
+            context = multiprocessing.get_context('forkserver')
+            if self._progress_queue is None:
+                context.set_forkserver_preload(self.preload)
+                self._progress_queue = context.Queue()
+                thread = threading.Thread(target=self._dispatch_progress, name='worker-progress')
+                thread.daemon = True
+                thread.start()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue, metrics.registry.folder, metrics.registry.flush_interval, logs.settings)
+            )
+            logger.info("Worker pool started: %s processes, preloading %s", self.processes, ', '.join(self.preload))
+            return self._executor
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Return the process-wide worker pool, configured from the current app."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(
+                processes=current_app.config['WORKER_PROCESSES'],
+                preload=current_app.config['WORKER_PRELOAD']
+            )
+        return _pool
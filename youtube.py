@@ -0,0 +1,145 @@
+import os
+import re
+import queue
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from flask import current_app
+from outbound import get_outbound_client, UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Host name the YouTube limits and circuit breaker are configured under
+HOST = 'youtube'
+
+# yt-dlp errors that say YouTube or the network is struggling, as opposed
+# to a private, removed or mistyped video
+TRANSIENT_ERROR = re.compile(r'HTTP Error (429|5\d\d)|timed out|Connection|Unable to download (webpage|API page)', re.I)
+
+
+class PooledYoutubeDL:
+    """A reusable YoutubeDL and the staging folder its downloads land in."""
+
+    def __init__(self, options, staging_dir):
+        import yt_dlp
+
+        self.staging_dir = staging_dir
+        self.progress = None
+        os.makedirs(staging_dir, exist_ok=True)
+        # yt-dlp's own output goes through logging, not stdout
+        self.ydl = yt_dlp.YoutubeDL({
+            **options,
+            'quiet': True,
+            'no_warnings': True,
+            'logger': logger,
+            'outtmpl': os.path.join(staging_dir, '%(id)s.%(ext)s'),
+            'progress_hooks': [self._report_progress],
+        })
+
+    def _report_progress(self, progress):
+        if self.progress is not None:
+            self.progress(progress)
+
+
+class YoutubeDLPool:
+    """YoutubeDL instances shared by the YouTube routes and download jobs.
+
+    Each instance keeps its HTTP connections, cookies and the player code
+    it already fetched between uses, instead of starting cold for every
+    lookup and download. An instance is used by one caller at a time and
+    downloads into its own staging folder, so concurrent downloads of the
+    same video can't collide; callers take the file out with ``download``.
+    All yt-dlp traffic goes through the outbound client's YouTube limits
+    and circuit breaker. Lookups wait at most ``wait`` seconds for an
+    instance while downloads hold them all.
+    """
+
+    def __init__(self, options, staging_folder, size, client, wait=10):
+        self.options = options
+        self.staging_folder = staging_folder
+        self.size = size
+        self.client = client
+        self.wait = wait
+        self._idle = queue.LifoQueue()  # Most recently used first, its connections are warmest
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def instance(self, timeout=None):
+        """Check out an instance, creating one while the pool isn't full.
+
+        Raises UpstreamUnavailable if none is free within ``timeout`` seconds.
+        """
+        pooled = None
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    index = self._created
+                else:
+                    index = None
+            if index is not None:
+                pooled = PooledYoutubeDL(self.options, os.path.join(self.staging_folder, str(index)))
+            else:
+                try:
+                    pooled = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise UpstreamUnavailable(HOST, 'all downloaders busy', timeout) from None
+        try:
+            yield pooled
+        finally:
+            pooled.progress = None
+            self._idle.put(pooled)
+
+    def extract_info(self, url):
+        """Metadata of a video or playlist, without downloading."""
+        with self.instance(self.wait) as pooled:
+            return self.client.call(
+                HOST, pooled.ydl.extract_info, url, download=False,
+                is_failure=is_transient_error, retries=1
+            )
+
+    def download(self, url, output_base, progress=None):
+        """Download a video's audio to ``output_base`` plus its extension; returns the path and info."""
+        with self.instance() as pooled:
+            pooled.progress = progress
+            try:
+                info = self.client.call(
+                    HOST, pooled.ydl.extract_info, url, download=True,
+                    is_failure=is_transient_error, retries=1
+                )
+            except BaseException:
+                # Don't leave partial downloads for the instance's next user
+                for filename in os.listdir(pooled.staging_dir):
+                    os.remove(os.path.join(pooled.staging_dir, filename))
+                raise
+            staged = pooled.ydl.prepare_filename(info)
+            path = f"{output_base}{os.path.splitext(staged)[1]}"
+            shutil.move(staged, path)
+            return path, info
+
+
+def is_transient_error(error):
+    return bool(TRANSIENT_ERROR.search(str(error)))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_youtube_pool():
+    """Return the process-wide YoutubeDL pool, configured from the current app."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = YoutubeDLPool(
+                options=current_app.config['YDL_OPTS_BASE'],
+                staging_folder=os.path.join(current_app.config['YOUTUBE_FOLDER'], 'staging'),
+                size=current_app.config['YDL_POOL_SIZE'],
+                client=get_outbound_client(),
+                wait=current_app.config['YDL_POOL_WAIT']
+            )
+        return _pool